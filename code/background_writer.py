@@ -0,0 +1,106 @@
+import os
+import queue
+import threading
+import time
+
+
+def replace_file(path, data):
+    """
+    Write a file through a temporary file that atomically replaces it, readers never see it half written
+    :param str path: file path
+    :param bytes data: file contents
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+class BackgroundWriter(object):
+    """
+    Writes payloads to disk on a background thread.
+
+    A payload is taken every every_n_frames frames and/or every interval seconds and
+    queued without blocking, it is dropped if the queue is full.  Subclasses make the
+    payload on the frame thread with payload() and write it on the writer thread with
+    write(), usually through replace_file().
+    """
+
+    def __init__(self, every_n_frames=250, interval=None, queue_size=1, name='background-writer'):
+        """
+        :param int every_n_frames: take a payload every N frames, 0 to only use interval
+        :param float interval: take a payload every interval seconds, None to only use every_n_frames
+        :param int queue_size: payloads waiting to be written before new ones are dropped
+        :param str name: name of the writer thread
+        """
+        self.every_n_frames = every_n_frames
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self._last_time = time.time()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def due(self, frame):
+        """
+        :param int frame: frame counter
+        :return: True if a payload is due at this frame
+        """
+        if self.every_n_frames and frame % self.every_n_frames == 0:
+            return True
+        return self.interval is not None and time.time() - self._last_time >= self.interval
+
+    def maybe_submit(self, frame, *args):
+        """
+        Queue a payload if one is due
+        :param int frame: frame counter
+        :param args: arguments of payload(), only called when due
+        :return: True if a payload was queued
+        """
+        if not self.due(frame):
+            return False
+        return self.submit(*args)
+
+    def submit(self, *args, block=False):
+        """
+        Queue a payload
+        :param args: arguments of payload()
+        :param bool block: wait for room in the queue instead of dropping the payload
+        :return: True if the payload was queued
+        """
+        self._last_time = time.time()
+        try:
+            self._queue.put(self.payload(*args), block=block)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """Write the queued payloads and stop the writer"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def payload(self, *args):
+        """
+        Called on the frame thread, copies what write() needs
+        :return: the payload, not None
+        """
+        raise NotImplementedError
+
+    def write(self, payload):
+        """
+        Called on the writer thread
+        :param payload: a payload from payload()
+        """
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            payload = self._queue.get()
+            if payload is None:
+                return
+            self.write(payload)
+            self.written += 1
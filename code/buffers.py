@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class BufferPool(object):
+    """
+    Named arrays reused from frame to frame, so that the telemetry loop does not
+    allocate its full size arrays again every frame.
+
+    An array is allocated the first time its name is asked for, and again only if
+    its shape or type changes.  Vectors of varying length share one allocation that
+    grows when needed.  The content of a buffer is whatever its previous user left
+    in it, and a buffer handed out is only valid until its name is asked for again.
+    """
+    # Growth factor of vectors, so that a slowly growing length does not reallocate every frame
+    growth = 1.5
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """
+        :param str name: buffer name
+        :param tuple shape: buffer shape
+        :param dtype: buffer type
+        :return: array of that shape and type
+        """
+        buffer = self._buffers.get(name)
+        shape = tuple(shape)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def vector(self, name, length, dtype):
+        """
+        :param str name: buffer name
+        :param int length: number of elements
+        :param dtype: buffer type
+        :return: 1 dimensional view of length elements
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or len(buffer) < length or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(int(length * self.growth) + 1, dtype=dtype)
+        return buffer[:length]
+
+    def select(self, name, selection, values):
+        """
+        values[selection], into a vector buffer
+        :param str name: buffer name
+        :param np.ndarray selection: boolean selection
+        :param np.ndarray values: values to select from, 1 dimensional
+        :return: view of the selected values
+        """
+        out = self.vector(name, np.count_nonzero(selection), values.dtype)
+        np.compress(selection, values, out=out)
+        return out
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for all buffers"""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
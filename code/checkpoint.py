@@ -0,0 +1,151 @@
+"""
+Checkpoints of a run, to resume it when drive_rover.py restarts.
+
+A checkpoint is a folder.  The worldmap window lives in a memory-mapped file in it,
+so its counts reach the disk through the page cache without any copy on the frame
+thread.  The rest of the mapping and decision state of the rover is small: every
+every_n_frames frames it is copied on the frame thread, and a writer thread flushes
+the worldmap and writes the copy as an npz file that atomically replaces the
+previous one.  The map statistics, the sample index and the plan are not saved,
+they are rebuilt from the worldmap on the first frame after resuming.
+
+    python drive_rover.py --checkpoint ../output/checkpoint
+    python drive_rover.py --checkpoint ../output/checkpoint --resume
+"""
+import json
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from background_writer import BackgroundWriter, replace_file
+from world_map import TiledWorldMap
+from sample_index import SampleIndex
+
+WORLD_MAP_FILE = 'worldmap.npy'
+STATE_FILE = 'state.npz'
+# Scalar fields of the rover that are saved, None is allowed
+STATE_FIELDS = ('total_time', 'mode', 'samples_to_find', 'samples_located', 'samples_collected',
+                'active_sample_start_time', 'active_sample_distance', 'active_sample_angle',
+                'active_sample_search_ignore_until', 'active_sample_search_started', 'waypoint_ignore_until',
+                'image_generation_counter')
+
+
+def has_checkpoint(path):
+    """
+    :param str path: checkpoint folder
+    :return: True if the folder holds a checkpoint to resume from
+    """
+    return os.path.exists(os.path.join(path, STATE_FILE)) and os.path.exists(os.path.join(path, WORLD_MAP_FILE))
+
+
+def open_world_map(path, shape, tile_size=20, resume=False, tiles=None):
+    """
+    Worldmap whose window is kept in the memory-mapped file of a checkpoint
+    :param str path: checkpoint folder, created if needed
+    :param tuple shape: (rows, cols, channels) of the worldmap window
+    :param int tile_size: tile side of the worldmap, in cells
+    :param bool resume: start from the counts in the file instead of a new, empty file; a new file invalidates
+        the state of the previous checkpoint in the folder, so it cannot be resumed onto the empty worldmap
+    :param dict tiles: tiles beyond the window to start from, see TiledWorldMap
+    :rtype: TiledWorldMap
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    file_path = os.path.join(path, WORLD_MAP_FILE)
+    if resume:
+        counts = open_memmap(file_path, mode='r+')
+    else:
+        if os.path.exists(os.path.join(path, STATE_FILE)):
+            os.remove(os.path.join(path, STATE_FILE))
+        counts = open_memmap(file_path, mode='w+', dtype=np.uint16, shape=tuple(shape))
+    return TiledWorldMap(*shape, tile_size=tile_size, counts=counts, tiles=tiles)
+
+
+def rover_state(Rover):
+    """
+    Copy of the rover state a checkpoint saves, besides the worldmap window
+    :param RoverState Rover: the rover
+    :return: dict of arrays, for np.savez
+    """
+    fields = {name: getattr(Rover, name) for name in STATE_FIELDS}
+    fields = {name: value.item() if isinstance(value, np.generic) else value for name, value in fields.items()}
+    tiles = Rover.world_map.outside_tiles()
+    size, channels = Rover.world_map.tile_size, Rover.worldmap.shape[2]
+    state = {
+        'fields': np.frombuffer(json.dumps(fields).encode('utf-8'), dtype=np.uint8),
+        'pos_every_second': Rover.pos_every_second.copy(),
+        'picked_up_sample_position': np.array(Rover.picked_up_sample_position, dtype=np.float64).reshape(-1, 2),
+        'tile_keys': np.array(list(tiles), dtype=np.int64).reshape(-1, 2),
+        'tiles': np.array([tile.copy() for tile in tiles.values()], dtype=np.uint16).reshape(
+            -1, size, size, channels),
+    }
+    if Rover.samples_pos is not None:
+        state['samples_pos'] = np.array(Rover.samples_pos, dtype=np.int64)
+    if Rover.active_sample_position is not None:
+        state['active_sample_position'] = np.array(Rover.active_sample_position, dtype=np.float64)
+    return state
+
+
+def restore(Rover, path):
+    """
+    Resume a rover from a checkpoint, its worldmap window stays memory-mapped to the checkpoint file
+    :param RoverState Rover: a new rover
+    :param str path: checkpoint folder
+    :return: the rover
+    """
+    with np.load(os.path.join(path, STATE_FILE)) as state:
+        state = dict(state)
+    for name, value in json.loads(state['fields'].tobytes().decode('utf-8')).items():
+        setattr(Rover, name, value)
+    # The elapsed time goes on from the saved one
+    Rover.start_time = time.time() - Rover.total_time
+    Rover.seconds_for_being_stuck = len(state['pos_every_second'])
+    Rover.pos_every_second = state['pos_every_second']
+    Rover.picked_up_sample_position = [tuple(position) for position in state['picked_up_sample_position'].tolist()]
+    if 'active_sample_position' in state:
+        Rover.active_sample_position = tuple(state['active_sample_position'].tolist())
+    if 'samples_pos' in state:
+        Rover.samples_pos = (state['samples_pos'][0], state['samples_pos'][1])
+        Rover.sample_index = SampleIndex(Rover.samples_pos[0], Rover.samples_pos[1], Rover.worldmap.shape)
+    tiles = {tuple(key): tile for key, tile in zip(state['tile_keys'].tolist(), state['tiles'])}
+    Rover.world_map = open_world_map(path, Rover.worldmap.shape, Rover.world_map.tile_size, resume=True,
+                                     tiles=tiles)
+    Rover.worldmap = Rover.world_map.grid
+    return Rover
+
+
+class CheckpointWriter(BackgroundWriter):
+    """
+    Writes checkpoints of a rover on a background thread.
+
+    A checkpoint is taken every every_n_frames frames and/or every interval seconds,
+    queued without blocking (it is dropped if the previous one is still being
+    written) and written to a temporary file that atomically replaces the state
+    file.  The worldmap file is flushed first, so it is at least as recent as the state.
+    """
+
+    def __init__(self, path, every_n_frames=250, interval=None):
+        """
+        :param str path: checkpoint folder, see open_world_map()
+        :param int every_n_frames: take a checkpoint every N frames, 0 to only use interval
+        :param float interval: take a checkpoint every interval seconds, None to only use every_n_frames
+        """
+        self.path = path
+        super(CheckpointWriter, self).__init__(every_n_frames, interval, queue_size=1, name='checkpoint-writer')
+
+    def payload(self, Rover):
+        """
+        :param RoverState Rover: the rover, its worldmap window must be memory-mapped with open_world_map()
+        :return: the worldmap window and a copy of the rest of the state
+        """
+        return Rover.worldmap, rover_state(Rover)
+
+    def write(self, checkpoint):
+        counts, state = checkpoint
+        counts.flush()
+        buff = BytesIO()
+        np.savez(buff, **state)
+        replace_file(os.path.join(self.path, STATE_FILE), buff.getvalue())
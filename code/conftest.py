@@ -0,0 +1,11 @@
+"""
+The tests run like the scripts, from the code folder:
+
+    python -m pytest
+"""
+import os
+import sys
+
+CODE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CODE_FOLDER)
+os.chdir(CODE_FOLDER)
@@ -1,5 +1,35 @@
 import numpy as np
 
+
+def waypoint_bearing(Rover):
+    """
+    :param RoverState Rover: the rover
+    :return: angle of the waypoint relative to the rover heading in radians, in [-pi, pi), None without a waypoint
+    """
+    if Rover.waypoint is None:
+        return None
+    bearing = np.arctan2(Rover.waypoint[1] - Rover.pos[1], Rover.waypoint[0] - Rover.pos[0]) - Rover.yaw * np.pi / 180
+    return (bearing + np.pi) % (2 * np.pi) - np.pi
+
+
+def steering_angles(Rover):
+    """
+    Navigable terrain angles to steer by: those towards the waypoint if enough open terrain leads there
+    :param RoverState Rover: the rover
+    :return: angles in radians
+    """
+    bearing = waypoint_bearing(Rover)
+    if bearing is None or len(Rover.nav_angles) == 0:
+        return Rover.nav_angles
+    # A waypoint outside the field of view is approached along its edge
+    bearing = np.clip(bearing, Rover.nav_angles.min(), Rover.nav_angles.max())
+    towards = Rover.nav_angles[np.abs(Rover.nav_angles - bearing) < Rover.waypoint_window]
+    # As much open terrain as needed to start driving, so that the rover does not steer into walls
+    if len(towards) < Rover.go_forward:
+        return Rover.nav_angles
+    return towards
+
+
 def decision_step(Rover):
     """
     This is where you can build a decision tree for determining throttle, brake and steer
@@ -21,6 +51,13 @@ def decision_step(Rover):
     Rover.pos_every_second[array_index, 2] = Rover.steer
     tolerance = 0.05
 
+    # Plan towards the nearest unexplored part of the map
+    if Rover.planner is not None:
+        Rover.waypoint = Rover.planner.update(Rover.world_map, Rover.pos)
+        # Wander for a while after getting stuck, the way to the waypoint may be blocked
+        if Rover.waypoint_ignore_until is not None and Rover.total_time < Rover.waypoint_ignore_until:
+            Rover.waypoint = None
+
     is_stuck = (abs(Rover.pos_every_second[:, 0] - Rover.pos[0]) < tolerance).all() and \
         (abs(Rover.pos_every_second[:, 1] - Rover.pos[1]) < tolerance).all()
     if is_stuck:
@@ -29,6 +66,7 @@ def decision_step(Rover):
         Rover.brake = 0
         Rover.steer = -15
         Rover.pos_every_second[array_index, 0] = -1  # Prevent being in the same condition after the turn
+        Rover.waypoint_ignore_until = Rover.total_time + Rover.waypoint_cooldown
         Rover.mode = 'stop'
         return Rover
     is_around_steering = (Rover.pos_every_second[:, 2] == 15).all() or (Rover.pos_every_second[:, 2] == -15).all()
@@ -96,8 +134,8 @@ def decision_step(Rover):
                 else: # Else coast
                     Rover.throttle = 0
                 Rover.brake = 0
-                # Set steering to average angle clipped to the range +/- 15
-                Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi), -15, 15)
+                # Set steering to average angle towards the waypoint clipped to the range +/- 15
+                Rover.steer = np.clip(np.mean(steering_angles(Rover) * 180/np.pi), -15, 15)
             # If there's a lack of navigable terrain pixels then go to 'stop' mode
             elif len(Rover.nav_angles) < Rover.stop_forward:
                     # Set mode to "stop" and hit the brakes!
@@ -122,15 +160,17 @@ def decision_step(Rover):
                     # Release the brake to allow turning
                     Rover.brake = 0
                     # Turn range is +/- 15 degrees, when stopped the next line will induce 4-wheel turning
-                    Rover.steer = -15 # Could be more clever here about which way to turn
+                    # Towards the waypoint if there is one
+                    bearing = waypoint_bearing(Rover)
+                    Rover.steer = 15 if bearing is not None and bearing > 0 else -15
                 # If we're stopped but see sufficient navigable terrain in front then go!
                 if len(Rover.nav_angles) >= Rover.go_forward:
                     # Set throttle back to stored value
                     Rover.throttle = Rover.throttle_set
                     # Release the brake
                     Rover.brake = 0
-                    # Set steer to mean angle
-                    Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi), -15, 15)
+                    # Set steer to mean angle towards the waypoint
+                    Rover.steer = np.clip(np.mean(steering_angles(Rover) * 180/np.pi), -15, 15)
                     Rover.mode = 'forward'
     # Just to make the rover do something 
     # even if no modifications have been made to the code
@@ -1,19 +1,22 @@
 # Do the necessary imports
 import argparse
 import shutil
-from datetime import datetime
 import os
-import numpy as np
 import socketio
 import eventlet
 import eventlet.wsgi
-from flask import Flask
-import time
+import eventlet.tpool
+from flask import Flask, jsonify
+import logging
 
-# Import functions for perception and decision making
-from perception import perception_step
-from decision import decision_step
-from supporting_functions import update_rover, create_output_images
+from image_encoding import InsetEncoder
+from snapshots import SnapshotWriter
+from profiling import StageProfiler
+from recording import RecordingWriter
+from checkpoint import CheckpointWriter, has_checkpoint, open_world_map, restore
+from scheduling import LatestFrameScheduler
+from pipeline import FramePipeline
+from sessions import Session, Sessions, SessionWorkers, control_data, numbered_path
 # Initialize socketio server and Flask application 
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 from rover_state import RoverState
@@ -21,112 +24,143 @@ from rover_state import RoverState
 sio = socketio.Server()
 app = Flask(__name__)
 
-# Define RoverState() class to retain rover state parameters
-# Initialize our rover
-Rover = RoverState()
+# A rover per connected simulator, by session id, created when the server starts
+sessions = None
 
-# Variables to track frames per second (FPS)
-# Intitialize frame counter
-frame_counter = 0
-# Initalize second counter
-second_counter = time.time()
-fps = None
+# Latency of every stage of the telemetry handler, served at /metrics
+profiler = StageProfiler()
+logger = logging.getLogger(__name__)
 
 
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
 def telemetry(sid, data):
+    if data:
+        # Handled in the background, on the latest telemetry only if more arrive in the meantime
+        scheduler.submit(sid, data)
+    else:
+        sio.emit('manual', data={}, room=sid)
 
-    global frame_counter, second_counter, fps
-    frame_counter+=1
-    # Do a rough calculation of frames per second (FPS)
-    if (time.time() - second_counter) > 1:
-        fps = frame_counter
-        frame_counter = 0
-        second_counter = time.time()
-    print("Current FPS: {}".format(fps))
 
-    if data:
-        global Rover
-        # Initialize / update Rover with current telemetry
-        Rover, image = update_rover(Rover, data)
-
-        if np.isfinite(Rover.vel):
-
-            # Execute the perception and decision steps to update the Rover's state
-            Rover = perception_step(Rover)
-            Rover = decision_step(Rover)
-
-            # Create output images to send to server
-            out_image_string1, out_image_string2 = create_output_images(Rover)
-
-            # The action step!  Send commands to the rover!
- 
-            # Don't send both of these, they both trigger the simulator
-            # to send back new telemetry so we must only send one
-            # back in respose to the current telemetry data.
-
-            # If in a state where want to pickup a rock send pickup command
-            if Rover.send_pickup and not Rover.picking_up:
-                send_pickup()
-                # Reset Rover flags
-                Rover.send_pickup = False
-            else:
-                # Send commands to the rover!
-                commands = (Rover.throttle, Rover.brake, Rover.steer)
-                send_control(commands, out_image_string1, out_image_string2)
-
-        # In case of invalid telemetry, send null commands
+def handle_telemetry(sid, data, degraded=False):
+    """
+    Update the rover of a session with telemetry and send the commands back
+    :param sid: session id
+    :param dict data: telemetry
+    :param bool degraded: the previous frame took too long, do only what is needed for the commands
+    """
+    profiler.record_frame()
+    logger.debug("Current FPS: %.1f", profiler.fps)
+
+    # Perception and decision steps on the session's rover, possibly in a worker process
+    with profiler.stage('session_step'):
+        event, payload = sessions.step(sid, data, degraded)
+
+    # The action step!  Send commands to the rover!
+    # Only one of pickup and data is sent back, they both trigger the
+    # simulator to send back new telemetry
+    with profiler.stage('send_control'):
+        if event == 'pickup':
+            send_pickup(sid)
         else:
+            send_control(sid, payload)
+    # Let the other green threads run, outside of the stage so that it only times the emit
+    eventlet.sleep(0)
+
+
+# Handles the freshest telemetry only, skipping frames that arrive while busy
+scheduler = LatestFrameScheduler(handle_telemetry, eventlet.spawn_n, profiler=profiler)
+
 
-            # Send zeros for throttle, brake and steer and empty images
-            send_control((0, 0, 0), '', '')
+def fresh_folder(path):
+    """
+    Create an empty folder, removing what a previous run left in it
+    :param str path: folder path
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
 
-        # If you want to save camera images from autonomous driving specify a path
-        # Example: $ python drive_rover.py image_folder_path
-        # Conditional to save image frame if folder was specified
-        if args.image_folder != '':
-            timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
-            image_filename = os.path.join(args.image_folder, timestamp)
-            image.save('{}.jpg'.format(image_filename))
 
+def create_session(index):
+    """
+    :param int index: session index, numbers the snapshot, recording and image paths of all but the first session
+    :return: a new Session, configured from the command line
+    """
+    Rover = RoverState()
+    if pipeline is not None:
+        Rover.telemetry_decoder = pipeline.decoder()
+        inset_encoder = pipeline.inset_encoder(**inset_options)
     else:
-        sio.emit('manual', data={}, skip_sid=True)
+        inset_encoder = InsetEncoder(**inset_options)
+    snapshot_writer = SnapshotWriter(numbered_path(args.snapshot_path, index), every_n_frames=args.snapshot_every,
+                                     interval=args.snapshot_interval, keep=args.snapshot_keep)
+    recording_writer = None
+    if args.recording != '':
+        recording_path = numbered_path(args.recording, index)
+        print("Recording this run to {}".format(recording_path))
+        recording_writer = RecordingWriter(recording_path, args.recording_capacity)
+    checkpoint_writer = None
+    if args.checkpoint != '':
+        checkpoint_path = numbered_path(args.checkpoint, index)
+        if args.resume and has_checkpoint(checkpoint_path):
+            print("Resuming from {}".format(checkpoint_path))
+            restore(Rover, checkpoint_path)
+        else:
+            Rover.world_map = open_world_map(checkpoint_path, Rover.worldmap.shape, Rover.world_map.tile_size)
+            Rover.worldmap = Rover.world_map.grid
+        checkpoint_writer = CheckpointWriter(checkpoint_path, every_n_frames=args.checkpoint_every)
+    image_folder = ''
+    if args.image_folder != '':
+        image_folder = numbered_path(args.image_folder, index)
+        # main() prepared the folder of the first session
+        if index > 0:
+            print("Creating image folder at {}".format(image_folder))
+            fresh_folder(image_folder)
+    return Session(Rover, inset_encoder, snapshot_writer, recording_writer, image_folder, profiler,
+                   checkpoint_writer)
+
+
+@app.route('/metrics')
+def metrics():
+    summary = profiler.summary()
+    summary['sessions'] = len(sessions)
+    return jsonify(summary)
+
 
 @sio.on('connect')
 def connect(sid, environ):
     print("connect ", sid)
-    send_control((0, 0, 0), '', '')
+    sessions.open(sid)
+    send_control(sid, control_data((0, 0, 0), '', ''))
+    eventlet.sleep(0)
     sample_data = {}
     sio.emit(
         "get_samples",
         sample_data,
-        skip_sid=True)
-
-def send_control(commands, image_string1, image_string2):
-    # Define commands to be sent to the rover
-    data={
-        'throttle': commands[0].__str__(),
-        'brake': commands[1].__str__(),
-        'steering_angle': commands[2].__str__(),
-        'inset_image1': image_string1,
-        'inset_image2': image_string2,
-        }
-    # Send commands via socketIO server
+        room=sid)
+
+
+@sio.on('disconnect')
+def disconnect(sid):
+    print("disconnect ", sid)
+    scheduler.discard(sid)
+    sessions.close(sid)
+
+def send_control(sid, data):
+    # Send commands via socketIO server, to the session's simulator only
     sio.emit(
         "data",
         data,
-        skip_sid=True)
-    eventlet.sleep(0)
+        room=sid)
 # Define a function to send the "pickup" command 
-def send_pickup():
+def send_pickup(sid):
     print("Picking up")
     pickup = {}
     sio.emit(
         "pickup",
         pickup,
-        skip_sid=True)
-    eventlet.sleep(0)
+        room=sid)
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Remote Driving')
     parser.add_argument(
@@ -136,16 +170,146 @@ if __name__ == '__main__':
         default='',
         help='Path to image folder. This is where the images from the run will be saved.'
     )
+    parser.add_argument(
+        '--inset_every',
+        type=int,
+        default=1,
+        help='Encode the inset images of every Nth frame.'
+    )
+    parser.add_argument(
+        '--inset_max_hz',
+        type=float,
+        default=0,
+        help='Maximum number of inset image encodings per second, 0 for no limit.'
+    )
+    parser.add_argument(
+        '--inset_format',
+        choices=['png', 'jpeg'],
+        default='png',
+        help='Format of the inset images.'
+    )
+    parser.add_argument(
+        '--inset_compression',
+        type=int,
+        default=3,
+        help='PNG compression level (0-9) or JPEG quality (0-100) of the inset images.'
+    )
+    parser.add_argument(
+        '--snapshot_path',
+        type=str,
+        default='../output/fidelity_render.png',
+        help='Path of the fidelity map snapshot.'
+    )
+    parser.add_argument(
+        '--snapshot_every',
+        type=int,
+        default=250,
+        help='Save the fidelity map every N frames, 0 to only use --snapshot_interval.'
+    )
+    parser.add_argument(
+        '--snapshot_interval',
+        type=float,
+        default=None,
+        help='Save the fidelity map every N seconds.'
+    )
+    parser.add_argument(
+        '--snapshot_keep',
+        type=int,
+        default=0,
+        help='Number of numbered fidelity map snapshots to keep next to the latest one.'
+    )
+    parser.add_argument(
+        '--recording',
+        type=str,
+        default='',
+        help='Record the run to this folder, in the memory-mapped recording format (see recording.py).'
+    )
+    parser.add_argument(
+        '--recording_capacity',
+        type=int,
+        default=20000,
+        help='Maximum number of frames of the recording.'
+    )
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        default='',
+        help='Checkpoint the run to this folder, to resume it after a restart (see checkpoint.py).'
+    )
+    parser.add_argument(
+        '--checkpoint_every',
+        type=int,
+        default=250,
+        help='Checkpoint every N frames.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume from the --checkpoint folder, if it holds a checkpoint.'
+    )
+    parser.add_argument(
+        '--frame_budget',
+        type=float,
+        default=0,
+        help='Seconds per frame above which the next frame is handled without rendering the insets, 0 to disable.'
+    )
+    parser.add_argument(
+        '--pipeline',
+        type=int,
+        default=0,
+        help='Decode the camera images and encode the inset images in this many worker processes, '
+             '0 to do everything in this process.'
+    )
+    parser.add_argument(
+        '--session_workers',
+        type=int,
+        default=0,
+        help='Spread the sessions of the connected simulators over this many worker processes, '
+             '0 to run them in this process.'
+    )
+    parser.add_argument(
+        '--log_level',
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help='Logging level, per frame telemetry is logged at DEBUG.'
+    )
+    parser.add_argument(
+        '--metrics_csv',
+        type=str,
+        default='',
+        help='Write the per stage latency summary to this csv file at shutdown.'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=4567,
+        help='Port to listen on, the simulator connects to 4567.'
+    )
     args = parser.parse_args()
-    
+    logging.basicConfig(level=args.log_level)
+    scheduler.frame_budget = args.frame_budget or None
+
+    if args.resume and args.checkpoint == '':
+        parser.error("--resume needs --checkpoint")
+    if args.pipeline > 0 and args.session_workers > 0:
+        parser.error("--pipeline and --session_workers can not be combined")
+
+    inset_options = dict(every_n_frames=args.inset_every, max_hz=args.inset_max_hz,
+                         image_format=args.inset_format, compression=args.inset_compression)
+    pipeline = None
+    if args.pipeline > 0:
+        # Wait for the workers from a native thread, the server keeps receiving meanwhile
+        pipeline = FramePipeline(args.pipeline, wait=lambda result: eventlet.tpool.execute(result.get))
+    if args.session_workers > 0:
+        sessions = SessionWorkers(create_session, args.session_workers,
+                                  wait=lambda result: eventlet.tpool.execute(result.get), profiler=profiler)
+    else:
+        sessions = Sessions(create_session)
+
     #os.system('rm -rf IMG_stream/*')
     if args.image_folder != '':
         print("Creating image folder at {}".format(args.image_folder))
-        if not os.path.exists(args.image_folder):
-            os.makedirs(args.image_folder)
-        else:
-            shutil.rmtree(args.image_folder)
-            os.makedirs(args.image_folder)
+        fresh_folder(args.image_folder)
         print("Recording this run ...")
     else:
         print("NOT recording this run ...")
@@ -154,4 +318,11 @@ if __name__ == '__main__':
     app = socketio.Middleware(sio, app)
 
     # deploy as an eventlet WSGI server
-    eventlet.wsgi.server(eventlet.listen(('', 4567)), app)
+    try:
+        eventlet.wsgi.server(eventlet.listen(('', args.port)), app)
+    finally:
+        sessions.close_all()
+        if pipeline is not None:
+            pipeline.close()
+        if args.metrics_csv != '':
+            profiler.dump_csv(args.metrics_csv)
@@ -0,0 +1,121 @@
+import base64
+import threading
+import time
+
+import numpy as np
+import cv2
+
+
+def encode_image(image, image_format='png', compression=3):
+    """
+    Encode an image to a base64 string for the simulator insets
+    :param np.ndarray image: uint8 RGB image
+    :param str image_format: 'png' or 'jpeg'
+    :param int compression: zlib level (0-9) for png, quality (0-100) for jpeg
+    :return: base64 encoded image
+    """
+    if image_format == 'png':
+        extension, params = '.png', [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    elif image_format == 'jpeg':
+        extension, params = '.jpg', [cv2.IMWRITE_JPEG_QUALITY, compression]
+    else:
+        raise ValueError("Unsupported image format {}".format(image_format))
+    ok, encoded = cv2.imencode(extension, cv2.cvtColor(image, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError("Could not encode image as {}".format(image_format))
+    return base64.b64encode(encoded).decode("utf-8")
+
+
+class InsetEncoder(object):
+    """
+    Encodes the inset images sent along with the control commands on a worker thread.
+
+    submit() only hands the images over, the commands go out with whatever latest()
+    returns, so a reply never waits for an encoding.  Images are submitted every
+    every_n_frames frames and at most max_hz times a second, a submission replaces
+    one that the worker has not picked up yet, and an image identical to the
+    previous one reuses its encoded string.
+    """
+
+    def __init__(self, every_n_frames=1, max_hz=None, image_format='png', compression=3):
+        """
+        :param int every_n_frames: submit the images of every Nth frame
+        :param float max_hz: maximum submissions per second, None for no limit
+        :param str image_format: 'png' or 'jpeg'
+        :param int compression: see encode_image()
+        """
+        self.every_n_frames = max(int(every_n_frames), 1)
+        self.min_interval = 1.0 / max_hz if max_hz else 0
+        self.image_format = image_format
+        self.compression = compression
+        self.frames = 0
+        self.encoded_count = 0
+        self.reused_count = 0
+        self._last_submit_time = None
+        self._pending = None
+        self._previous_images = ()
+        self._encoded = ('', '')
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='inset-encoder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, images):
+        """
+        Hand over the images of a frame, if it is due for encoding
+        :param tuple images: uint8 RGB images, in inset order
+        :return: True if the images were submitted
+        """
+        self.frames += 1
+        if self.frames % self.every_n_frames:
+            return False
+        now = time.time()
+        if self._last_submit_time is not None and now - self._last_submit_time < self.min_interval:
+            return False
+        self._last_submit_time = now
+        # Copy, the caller is free to reuse its buffers for the next frame
+        pending = tuple(np.array(image, copy=True) for image in images)
+        with self._condition:
+            self._pending = pending
+            self._condition.notify()
+        return True
+
+    def latest(self):
+        """
+        :return: the most recently encoded strings, empty strings until the first images are ready
+        """
+        return self._encoded
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                images, self._pending = self._pending, None
+
+            # Only encode the images that changed since the previous submission
+            changed = [idx for idx, image in enumerate(images)
+                       if idx >= len(self._previous_images) or not np.array_equal(image, self._previous_images[idx])]
+            encoded = list(self._encoded) + [''] * (len(images) - len(self._encoded))
+            for idx, image_string in zip(changed, self._encode([images[idx] for idx in changed])):
+                encoded[idx] = image_string
+            self.encoded_count += len(changed)
+            self.reused_count += len(images) - len(changed)
+            self._previous_images = images
+            self._encoded = tuple(encoded[:len(images)])
+
+    def _encode(self, images):
+        """
+        :param list images: uint8 RGB images
+        :return: list of base64 encoded images
+        """
+        return [encode_image(image, self.image_format, self.compression) for image in images]
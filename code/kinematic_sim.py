@@ -0,0 +1,371 @@
+"""
+Fast closed-loop stand-in for the simulator: a 2D kinematic rover on the ground truth map.
+
+Every step integrates the throttle, brake and steering commands, synthesizes what
+perception would see from the ground truth map and the rock sample positions, and
+runs decision_step.  No images are rendered or decoded, so simulated minutes take
+seconds.  Evaluate decision changes from the code folder with:
+
+    python kinematic_sim.py --minutes 15 --runs 8
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from perception import (NAVIGABLE, OBSTACLE, ROCK, WORLD_MAP_CHANNELS, get_perception_engine, update_active_sample,
+                        world_cells)
+from decision import decision_step
+from supporting_functions import update_map_state
+from sample_index import SampleIndex
+from rover_state import RoverState, ground_truth
+
+# Pose of the rover at the start of the recorded test dataset
+START_POS = (99.7, 85.6)
+START_YAW = 56.8
+# Cells the planner expands per step, instead of its time budget, so that a seed repeats the same run whatever
+# the load of the CPU; about what the live server expands in its 5 ms
+PLANNER_EXPANSIONS = 200
+
+
+def sample_positions(count, seed=0):
+    """
+    Rock sample positions on navigable ground truth cells
+    :param int count: number of samples
+    :param int seed: random seed
+    :return: x and y positions
+    """
+    y, x = ground_truth.nonzero()
+    picks = np.random.RandomState(seed).choice(len(x), count, replace=False)
+    return x[picks], y[picks]
+
+
+class KinematicSimulator(object):
+    """
+    Kinematic rover on the ground truth map, with synthesized perception.
+
+    Perception uses the pixels of the perception engine's clip region: each is
+    projected to the world with the rover pose, like map_image() does, and is
+    navigable where the ground truth is and nothing closer along its viewing ray is
+    an obstacle.  Pixels within rock_radius of a sample not picked up yet see a rock.
+    The rover accelerates with the throttle, brakes to a standstill, turns in place
+    when stopped and stops when it would drive into an obstacle.
+    """
+    throttle_accel = 10.0  # m/s^2 at full throttle
+    brake_accel = 1.0  # m/s^2 per unit of brake
+    drag = 0.5  # 1/s
+    max_speed = 5.0  # m/s
+    wheelbase = 1.5  # m
+    turn_in_place_rate = 3.0  # degrees/s per degree of steering
+    near_sample_distance = 1.0  # m
+    pickup_seconds = 3.0
+    rock_radius = 0.5  # m
+    ray_degrees = 1.0
+
+    def __init__(self, truth=ground_truth, samples=None, pos=START_POS, yaw=START_YAW, dt=0.04,
+                 image_shape=(160, 320), scale=10):
+        """
+        :param np.ndarray truth: (rows, cols) ground truth map, non zero where navigable
+        :param tuple samples: x and y positions of the rock samples, six random ones if None
+        :param tuple pos: start position
+        :param float yaw: start yaw, in degrees
+        :param float dt: simulated seconds per step
+        :param tuple image_shape: camera image shape the perception engine is for
+        :param int scale: pixels per meter of the warped image
+        """
+        self.truth = np.asarray(truth) > 0
+        self.samples = samples if samples is not None else sample_positions(6)
+        self.remaining = np.ones(len(self.samples[0]), dtype=bool)
+        self.pos = np.array(pos, dtype=np.float64)
+        self.yaw = float(yaw)
+        self.vel = 0.0
+        self.dt = dt
+        self.time = 0.0
+        self.collisions = 0
+        self._colliding = False
+        self._pickup_end = None
+        self._pickup_sample = None
+
+        engine = self.engine = get_perception_engine(tuple(image_shape))
+        self.scale = scale
+        count = engine.clipped_count
+        self.selection = np.zeros(engine.pixel_count, dtype=bool)
+        # Viewing rays: clip region pixels sorted by ray, then by distance
+        rays = np.floor(engine.angles[:count] * 180 / np.pi / self.ray_degrees).astype(np.int64)
+        self.order = np.lexsort((engine.dists[:count], rays))
+        sorted_rays = rays[self.order]
+        starts = np.flatnonzero(np.r_[True, sorted_rays[1:] != sorted_rays[:-1]])
+        self.ray_starts = starts
+        self.ray_lengths = np.diff(np.r_[starts, count])
+        self.rover_x = engine.rover_x[:count]
+        self.rover_y = engine.rover_y[:count]
+        self.view_range = engine.dists[:count].max() / scale
+
+    def new_rover(self):
+        """
+        :return: a RoverState at the start of the simulation, as after its first telemetry
+        """
+        Rover = RoverState()
+        Rover.start_time = 0
+        Rover.samples_pos = (np.int_(self.samples[0]), np.int_(self.samples[1]))
+        Rover.samples_to_find = len(self.samples[0])
+        Rover.sample_index = SampleIndex(Rover.samples_pos[0], Rover.samples_pos[1], Rover.worldmap.shape)
+        if Rover.planner is not None:
+            Rover.planner.budget, Rover.planner.max_expansions = None, PLANNER_EXPANSIONS
+        self.telemetry(Rover)
+        return Rover
+
+    def telemetry(self, Rover):
+        """
+        Update the rover with the simulated telemetry
+        :param RoverState Rover: the rover
+        """
+        Rover.total_time = self.time
+        Rover.pos = [float(self.pos[0]), float(self.pos[1])]
+        Rover.yaw = self.yaw
+        Rover.pitch = 0.0
+        Rover.roll = 0.0
+        Rover.vel = self.vel
+        distances = np.hypot(self.samples[0] - self.pos[0], self.samples[1] - self.pos[1])
+        Rover.near_sample = int(np.any(self.remaining & (distances < self.near_sample_distance)))
+        Rover.picking_up = int(self._pickup_end is not None)
+        Rover.samples_collected = int(np.count_nonzero(~self.remaining))
+
+    def sense(self, Rover):
+        """
+        Synthesized perception step: worldmap update and navigable terrain angles and distances
+        :param RoverState Rover: the rover
+        """
+        yaw_rad = self.yaw * np.pi / 180
+        cos_yaw, sin_yaw = np.cos(yaw_rad), np.sin(yaw_rad)
+        x = (self.rover_x * cos_yaw - self.rover_y * sin_yaw) / self.scale + self.pos[0]
+        y = (self.rover_x * sin_yaw + self.rover_y * cos_yaw) / self.scale + self.pos[1]
+        rows, cols = self.truth.shape
+        x_cell, y_cell = world_cells(x, y)
+        inside = (x_cell >= 0) & (x_cell < cols) & (y_cell >= 0) & (y_cell < rows)
+        navigable = np.zeros(len(x), dtype=bool)
+        navigable[inside] = self.truth[y_cell[inside], x_cell[inside]]
+
+        # Whatever is behind an obstacle looks like the obstacle
+        blocked = np.cumsum(~navigable[self.order])
+        blocked -= np.repeat(blocked[self.ray_starts] - ~navigable[self.order][self.ray_starts], self.ray_lengths)
+        visible = np.empty(len(x), dtype=bool)
+        visible[self.order] = blocked == 0
+
+        labels = np.where(visible, NAVIGABLE, OBSTACLE).astype(np.uint8)
+        # Only the samples within the view range can be seen
+        in_range = self.remaining & (np.hypot(self.samples[0] - self.pos[0], self.samples[1] - self.pos[1])
+                                     < self.view_range + self.rock_radius)
+        for sample_x, sample_y in zip(self.samples[0][in_range], self.samples[1][in_range]):
+            labels[visible & ((x - sample_x) ** 2 + (y - sample_y) ** 2 < self.rock_radius ** 2)] = ROCK
+
+        Rover.world_map.accumulate(x_cell, y_cell, labels, WORLD_MAP_CHANNELS)
+        self.selection[:len(x)] = labels == NAVIGABLE
+        Rover.nav_dists, Rover.nav_angles = self.engine.polar_coords(self.selection)
+        update_map_state(Rover)
+        update_active_sample(Rover)
+
+    def actuate(self, Rover):
+        """
+        Apply the commands of the rover for one step
+        :param RoverState Rover: the rover
+        """
+        dt = self.dt
+        # Send a pickup, like drive_rover.py
+        if Rover.send_pickup and not Rover.picking_up:
+            Rover.send_pickup = False
+            distances = np.hypot(self.samples[0] - self.pos[0], self.samples[1] - self.pos[1])
+            distances[~self.remaining] = np.inf
+            if distances.min() < self.near_sample_distance and self.vel == 0:
+                self._pickup_sample = int(distances.argmin())
+                self._pickup_end = self.time + self.pickup_seconds
+        if self._pickup_end is not None:
+            if self.time >= self._pickup_end:
+                self.remaining[self._pickup_sample] = False
+                self._pickup_end = None
+            self.time += dt
+            return
+
+        vel = self.vel + (Rover.throttle * self.throttle_accel - self.drag * self.vel) * dt
+        if Rover.brake > 0:
+            braking = Rover.brake * self.brake_accel * dt
+            vel = 0.0 if abs(vel) <= braking else vel - np.sign(vel) * braking
+        vel = float(np.clip(vel, -self.max_speed, self.max_speed))
+
+        if abs(vel) < 0.2 and Rover.throttle == 0 and Rover.brake == 0:
+            # Four wheel turning when stopped
+            self.yaw += Rover.steer * self.turn_in_place_rate * dt
+        else:
+            self.yaw += np.degrees(vel * np.tan(np.radians(Rover.steer)) / self.wheelbase) * dt
+        self.yaw %= 360
+
+        yaw_rad = self.yaw * np.pi / 180
+        pos = self.pos + vel * dt * np.array([np.cos(yaw_rad), np.sin(yaw_rad)])
+        rows, cols = self.truth.shape
+        x_cell, y_cell = int(pos[0]), int(pos[1])
+        if 0 <= x_cell < cols and 0 <= y_cell < rows and self.truth[y_cell, x_cell]:
+            self.pos = pos
+            self.vel = vel
+            self._colliding = False
+        else:
+            # Count driving into an obstacle once, not every step pushing against it
+            self.collisions += not self._colliding
+            self._colliding = True
+            self.vel = 0.0
+        self.time += dt
+
+    def step(self, Rover):
+        """
+        One telemetry, perception, decision and actuation cycle
+        :param RoverState Rover: the rover
+        :return: the rover
+        """
+        self.telemetry(Rover)
+        self.sense(Rover)
+        Rover = decision_step(Rover)
+        self.actuate(Rover)
+        return Rover
+
+
+def simulate(minutes=15, seed=0, samples=6, random_start=False, map_targets=(40, 60, 80), dt=0.04, quiet=True,
+             configure=None):
+    """
+    Drive the rover on the ground truth map
+    :param float minutes: simulated minutes
+    :param int seed: seed of the sample positions, the start pose and decision_step's randomness
+    :param int samples: number of rock samples
+    :param bool random_start: start at a random navigable position and yaw instead of the dataset start
+    :param tuple map_targets: mapped percentages to report the time to
+    :param float dt: simulated seconds per step, the simulator sends telemetry about 25 times a second
+    :param bool quiet: silence the prints of the decision and perception steps
+    :param configure: called with the rover before the first step, e.g. to set its tuning parameters
+    :return: dict with the results
+    """
+    np.random.seed(seed)
+    pos, yaw = START_POS, START_YAW
+    if random_start:
+        (x,), (y,) = sample_positions(1, seed + 1000)
+        pos, yaw = (x + 0.5, y + 0.5), np.random.uniform(0, 360)
+    sim = KinematicSimulator(samples=sample_positions(samples, seed), pos=pos, yaw=yaw, dt=dt)
+    Rover = sim.new_rover()
+    if configure is not None:
+        configure(Rover)
+    time_to_map = {target: None for target in map_targets}
+    start = time.time()
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        while sim.time < minutes * 60:
+            Rover = sim.step(Rover)
+            for target in map_targets:
+                if time_to_map[target] is None and Rover.map_stats.perc_mapped >= target:
+                    time_to_map[target] = sim.time
+    elapsed = time.time() - start
+    return {
+        'seed': seed,
+        'simulated_s': sim.time,
+        'elapsed_s': elapsed,
+        'speedup': sim.time / elapsed if elapsed > 0 else 0.0,
+        'mapped_percent': Rover.map_stats.perc_mapped,
+        'fidelity_percent': Rover.map_stats.fidelity,
+        'time_to_map_s': {str(target): value for target, value in time_to_map.items()},
+        'samples_located': Rover.samples_located,
+        'samples_collected': int(np.count_nonzero(~sim.remaining)),
+        'collisions': sim.collisions,
+    }
+
+
+def _simulate(kwargs):
+    return simulate(**kwargs)
+
+
+def simulate_runs(runs, workers=None, **kwargs):
+    """
+    simulate() for several seeds in a process pool
+    :param int runs: number of runs, seeded 0 to runs - 1
+    :param int workers: number of worker processes, the number of CPUs if None
+    :param kwargs: see simulate()
+    :return: list of result dicts, in seed order
+    """
+    jobs = [dict(kwargs, seed=seed) for seed in range(runs)]
+    workers = min(workers or multiprocessing.cpu_count(), runs)
+    if workers <= 1:
+        return [_simulate(job) for job in jobs]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_simulate, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate decision_step on a kinematic simulator')
+    parser.add_argument(
+        '--minutes',
+        type=float,
+        default=15,
+        help='Simulated minutes per run.'
+    )
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=1,
+        help='Number of runs, each with other sample positions.'
+    )
+    parser.add_argument(
+        '--random_start',
+        action='store_true',
+        help='Start every run at a random position and yaw instead of the test dataset start.'
+    )
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=6,
+        help='Number of rock samples.'
+    )
+    parser.add_argument(
+        '--map_targets',
+        type=float,
+        nargs='+',
+        default=[40, 60, 80],
+        help='Mapped percentages to report the time to.'
+    )
+    parser.add_argument(
+        '--dt',
+        type=float,
+        default=0.04,
+        help='Simulated seconds per step, larger is faster and coarser.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='Number of worker processes, 0 for one per CPU.'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the results as json.'
+    )
+    args = parser.parse_args()
+
+    results = simulate_runs(args.runs, args.workers or None, minutes=args.minutes, samples=args.samples,
+                            random_start=args.random_start, map_targets=tuple(args.map_targets), dt=args.dt)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for result in results:
+            times = ', '.join('{}%: {}'.format(target, '-' if value is None else '{:.0f} s'.format(value))
+                              for target, value in result['time_to_map_s'].items())
+            print("Seed {seed}: mapped {mapped_percent}%, fidelity {fidelity_percent}%, samples located "
+                  "{samples_located}, collected {samples_collected}, collisions {collisions}, "
+                  "{speedup:.0f}x real time".format(**result) + ", time to map " + times)
+        print("Mean mapped: {:.1f}%, mean samples collected: {:.2f}".format(
+            np.mean([result['mapped_percent'] for result in results]),
+            np.mean([result['samples_collected'] for result in results])))
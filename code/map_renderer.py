@@ -0,0 +1,222 @@
+"""
+Incremental renderer of the worldmap inset.
+
+The inset is the obstacle and navigable counts, normalized, over the ground truth
+at half weight, flipped so that y points up, with the rock samples, the rover and
+a few lines of text on top.  MapRenderer keeps that image in a uint8 buffer in
+display orientation, next to a layer of the map alone, and each frame only
+recomputes the cells of the worldmap tiles changed since the previous frame,
+restores what the previous overlays covered and redraws the text lines whose
+string changed or whose area was touched.
+
+The normalization scale of a channel, the mean count of its observed cells, drifts
+a little with every frame.  The layer keeps the scales of its last full render, and
+is rendered again in full once a scale moved by more than scale_tolerance from them;
+with a tolerance of 0 the image is the same as the one rendered from scratch.
+"""
+import cv2
+import numpy as np
+
+from world_map import OBSTACLE_CHANNEL, NAVIGABLE_CHANNEL
+
+# Text lines of the inset: y of their baseline and how to write them
+TEXT_LINES = (
+    (10, lambda Rover: "Time: " + str(np.round(Rover.total_time, 1)) + ' s'),
+    (25, lambda Rover: "Mapped: " + str(Rover.map_stats.perc_mapped) + '%'),
+    (40, lambda Rover: "Fidelity: " + str(Rover.map_stats.fidelity) + '%'),
+    (55, lambda Rover: "Rocks"),
+    (70, lambda Rover: "  Located: " + str(Rover.samples_located)),
+    (85, lambda Rover: "  Collected: " + str(Rover.samples_collected)),
+)
+TEXT_FONT = cv2.FONT_HERSHEY_COMPLEX
+TEXT_SCALE = 0.4
+TEXT_THICKNESS = 1
+ROCK_SIZE = 2
+ROVER_HALF_SIZE = 2
+
+
+def rover_marker(rover):
+    """
+    :param RoverState rover: the rover
+    :return: (rows, columns) slices of the rover marker, in worldmap orientation
+    """
+    rover_x, rover_y = int(rover.pos[0]), int(rover.pos[1])
+    return (slice(rover_y - ROVER_HALF_SIZE, rover_y + ROVER_HALF_SIZE),
+            slice(rover_x - ROVER_HALF_SIZE, rover_x + ROVER_HALF_SIZE))
+
+
+def draw_rover(rover, image):
+    """
+    Draw the rover on the image
+    :param RoverState rover: the rover
+    :param np.ndarray image: the image
+    :return:
+    """
+    # Mark the rover
+    rows, columns = rover_marker(rover)
+    image[rows, columns, 0] = 255
+    image[rows, columns, 1] = 255
+    image[rows, columns, 2] = 0
+
+
+def text_box(text, y, shape):
+    """
+    :param str text: a text line
+    :param int y: y of its baseline
+    :param tuple shape: image shape
+    :return: (rows, columns) slices of the image the line may draw on
+    """
+    (width, height), baseline = cv2.getTextSize(text, TEXT_FONT, TEXT_SCALE, TEXT_THICKNESS)
+    return (slice(max(y - height - TEXT_THICKNESS, 0), min(y + baseline, shape[0])),
+            slice(0, min(width + TEXT_THICKNESS, shape[1])))
+
+
+class MapRenderer(object):
+    """
+    Renders the worldmap inset into a uint8 buffer, recomputing only what changed since the previous frame
+    """
+
+    def __init__(self, ground_truth, scale_tolerance=0.02):
+        """
+        :param np.ndarray ground_truth: (rows, cols, 3) ground truth image, in worldmap orientation
+        :param float scale_tolerance: relative drift of a normalization scale that renders the map in full again
+        """
+        self.scale_tolerance = scale_tolerance
+        self.full_renders = 0
+        self._ground_truth = ground_truth * 0.5
+        # The ground truth base of cells with no observation, see _cells()
+        self._base = self._ground_truth.astype(np.float32).astype(np.uint8)
+        # Map layer without the overlays, and the image, both flipped; the [::-1] views are in worldmap orientation
+        self._layer = np.ascontiguousarray(self._base[::-1])
+        self._layer_map = self._layer[::-1]
+        self.image = self._layer.copy()
+        self._image_map = self.image[::-1]
+        self._dirty = np.zeros(ground_truth.shape[:2], dtype=bool)
+        self._dirty_map = self._dirty[::-1]
+        self._world_map = None
+        self._revision = 0
+        self._scales = None
+        self._overlays = []
+        self._texts = [None] * len(TEXT_LINES)
+
+    def render(self, Rover):
+        """
+        Render the inset of the rover
+        :param RoverState Rover: the rover, with a TiledWorldMap; its map statistics are not updated
+        :return: uint8 RGB image, the buffer of the renderer, valid until the next call
+        """
+        world_map = Rover.world_map
+        self._dirty.fill(False)
+
+        # 1) Map cells: all of them when the scales drifted or the worldmap is a new one, else the changed tiles
+        scales = self._current_scales(world_map)
+        if world_map is not self._world_map or self._drifted(scales):
+            self._world_map, self._scales = world_map, scales
+            region = (slice(None), slice(None))
+            self.full_renders += 1
+        else:
+            region = self._changed_region(world_map)
+        self._revision = world_map.revision
+        if region is not None:
+            self._cells(world_map.grid[region], region, self._layer_map[region])
+            self._dirty_map[region] = True
+
+        # 2) Overlays, in worldmap orientation: what the previous ones covered is restored from the layer
+        overlays = []
+        if Rover.sample_index is not None:
+            for idx in Rover.sample_index.confirmed_samples():
+                rock_x, rock_y = Rover.samples_pos[0][idx], Rover.samples_pos[1][idx]
+                overlays.append((slice(rock_y - ROCK_SIZE, rock_y + ROCK_SIZE),
+                                 slice(rock_x - ROCK_SIZE, rock_x + ROCK_SIZE)))
+        overlays.append(rover_marker(Rover))
+        for overlay in self._overlays + overlays:
+            self._dirty_map[overlay] = True
+
+        # 3) Text lines, in display orientation: the changed ones and those over anything redrawn, until no
+        # other line is touched, neighbor lines may share a row
+        texts = [text_of(Rover) for y, text_of in TEXT_LINES]
+        boxes = [text_box(text, y, self.image.shape) for text, (y, text_of) in zip(texts, TEXT_LINES)]
+        redraw = set()
+        touched = True
+        while touched:
+            touched = False
+            for line, previous in enumerate(self._texts):
+                if line in redraw or previous is not None and previous[0] == texts[line] and \
+                        not self._dirty[boxes[line]].any() and not self._dirty[previous[1]].any():
+                    continue
+                redraw.add(line)
+                touched = True
+                self._dirty[boxes[line]] = True
+                if previous is not None:
+                    self._dirty[previous[1]] = True
+
+        # 4) Composite: restore the layer where anything changed, then draw the overlays and the text
+        if region is not None:
+            self._image_map[region] = self._layer_map[region]
+        for overlay in self._overlays:
+            self._image_map[overlay] = self._layer_map[overlay]
+        for line in redraw:
+            if self._texts[line] is not None:
+                self.image[self._texts[line][1]] = self._layer[self._texts[line][1]]
+            self.image[boxes[line]] = self._layer[boxes[line]]
+        for overlay in overlays[:-1]:
+            self._image_map[overlay] = 255
+        draw_rover(Rover, self._image_map)
+        self._overlays = overlays
+        for line in sorted(redraw):
+            self._texts[line] = texts[line], boxes[line]
+            cv2.putText(self.image, texts[line], (0, TEXT_LINES[line][0]), TEXT_FONT, TEXT_SCALE, (255, 255, 255),
+                        TEXT_THICKNESS)
+        return self.image
+
+    def _current_scales(self, world_map):
+        """
+        Channel counts times the scale of their channel make the mean of the observed cells 255
+        :param WorldMap world_map: the worldmap
+        :return: (obstacle, navigable) normalization scales, 0 for a channel with no observed cell
+        """
+        return tuple(255 * world_map.channel_observed[channel] / world_map.channel_totals[channel]
+                     if world_map.channel_observed[channel] else 0.
+                     for channel in (OBSTACLE_CHANNEL, NAVIGABLE_CHANNEL))
+
+    def _drifted(self, scales):
+        """
+        :param tuple scales: current normalization scales
+        :return: True if a scale moved from the one the layer was rendered with by more than the tolerance
+        """
+        return any(abs(scale - rendered) > self.scale_tolerance * rendered or (rendered == 0) != (scale == 0)
+                   for scale, rendered in zip(scales, self._scales))
+
+    def _changed_region(self, world_map):
+        """
+        :param TiledWorldMap world_map: the worldmap
+        :return: (rows, columns) slices of the window tiles changed since the previous frame, None if none did
+        """
+        rows, cols = world_map.grid.shape[:2]
+        size = world_map.tile_size
+        keys = np.array([key for key in world_map.changed_tiles(self._revision)
+                         if 0 <= key[0] < rows // size and 0 <= key[1] < cols // size]).reshape(-1, 2)
+        if len(keys) == 0:
+            return None
+        top, left = keys.min(axis=0) * size
+        bottom, right = (keys.max(axis=0) + 1) * size
+        return slice(top, bottom), slice(left, right)
+
+    def _cells(self, counts, region, out):
+        """
+        Render map cells the way full frames were rendered: normalized obstacle (red) and navigable
+        (blue) counts, obstacles cleared where navigable is as likely, over the ground truth
+        :param np.ndarray counts: (rows, cols, channels) counts of the cells
+        :param tuple region: (rows, columns) slices of the cells in the worldmap
+        :param np.ndarray out: (rows, cols, 3) uint8 array to write the cells to
+        """
+        obstacle_scale, navigable_scale = self._scales
+        obstacle = counts[:, :, OBSTACLE_CHANNEL] * obstacle_scale
+        navigable = counts[:, :, NAVIGABLE_CHANNEL] * navigable_scale
+        np.putmask(obstacle, navigable >= obstacle, 0)
+        out[:, :, 1] = self._base[region][:, :, 1]
+        for channel, values in ((0, obstacle), (2, navigable)):
+            np.minimum(values, 255, out=values)
+            values += self._ground_truth[region][:, :, channel]
+            # Through float32 like the text layer of full frames, so the same values truncate the same way
+            out[:, :, channel] = values.astype(np.float32)
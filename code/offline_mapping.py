@@ -0,0 +1,129 @@
+"""
+Maps a recorded drive in parallel: frames are sharded over a process pool, every
+worker builds a partial worldmap and the partial maps are merged.
+
+Run it from the code folder, like drive_rover.py, on a recording log or on a folder
+in the recording format (see recording.py):
+
+    python offline_mapping.py ../test_dataset/robot_log.csv --workers 4
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from perception import map_images
+from replay import read_log
+from recording import Recording, is_recording
+from telemetry import TelemetryDecoder
+from world_map import TiledWorldMap
+from rover_state import RoverState
+
+
+def map_rows(rows, map_shape, batch_size=64):
+    """
+    Map recorded frames into a new worldmap, in batches
+    :param list rows: frames from replay.read_log()
+    :param tuple map_shape: (rows, cols, channels) of the worldmap
+    :param int batch_size: frames mapped per map_images() call
+    :return: the window counts and the tiles beyond the window of the worldmap
+    """
+    world_map = TiledWorldMap(*map_shape)
+    decoder = TelemetryDecoder()
+    images = None
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        for idx, row in enumerate(batch):
+            with open(row['path'], 'rb') as f:
+                image = decoder.decode_jpeg(f.read())
+            if images is None:
+                images = np.empty((batch_size,) + image.shape, dtype=np.uint8)
+            images[idx] = image
+        map_images(images[:len(batch)],
+                   [row['pos'][0] for row in batch], [row['pos'][1] for row in batch],
+                   [row['yaw'] for row in batch], world_map)
+    return world_map.grid, world_map.outside_tiles()
+
+
+def map_recording(path, start, stop, map_shape, batch_size=64):
+    """
+    Map a range of frames of a recording into a new worldmap, reading the frames in place
+    :param str path: recording folder
+    :param int start: first frame
+    :param int stop: frame after the last one
+    :param tuple map_shape: (rows, cols, channels) of the worldmap
+    :param int batch_size: frames mapped per map_images() call
+    :return: the window counts and the tiles beyond the window of the worldmap
+    """
+    world_map = TiledWorldMap(*map_shape)
+    recording = Recording(path)
+    pos = recording.columns['pos']
+    for batch_start in range(start, stop, batch_size):
+        batch = slice(batch_start, min(batch_start + batch_size, stop))
+        map_images(recording.frames[batch], pos[batch, 0], pos[batch, 1], recording.columns['yaw'][batch],
+                   world_map)
+    return world_map.grid, world_map.outside_tiles()
+
+
+def _map_shard(shard):
+    if isinstance(shard[0], str):
+        return map_recording(*shard)
+    return map_rows(*shard)
+
+
+def map_log(rows, world_map, workers=None, shards_per_worker=4):
+    """
+    Map recorded frames into a worldmap using a process pool.  The result is the same
+    as mapping the frames one at a time into the worldmap
+    :param rows: frames from replay.read_log(), or the path of a recording folder
+    :param TiledWorldMap world_map: the worldmap to merge the frames into
+    :param int workers: number of worker processes, the number of CPUs if None
+    :param int shards_per_worker: shards per worker, more balance the load better
+    :return: the worldmap
+    """
+    workers = workers or multiprocessing.cpu_count()
+    frame_count = len(Recording(rows)) if isinstance(rows, str) else len(rows)
+    shard_count = max(min(workers * shards_per_worker, frame_count), 1)
+    shard_size = -(-frame_count // shard_count)
+    if isinstance(rows, str):
+        shards = [(rows, start, min(start + shard_size, frame_count), world_map.shape)
+                  for start in range(0, frame_count, shard_size)]
+    else:
+        shards = [(rows[start:start + shard_size], world_map.shape) for start in range(0, frame_count, shard_size)]
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        partial_maps = pool.imap_unordered(_map_shard, shards) if pool else map(_map_shard, shards)
+        for counts, tiles in partial_maps:
+            world_map.merge(counts, tiles)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return world_map
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map a recorded drive in parallel')
+    parser.add_argument(
+        'log',
+        type=str,
+        help='Path to the recording log (robot_log.csv) or to a recording folder.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='Number of worker processes, 0 for one per CPU.'
+    )
+    args = parser.parse_args()
+
+    Rover = RoverState()
+    rows = args.log if is_recording(args.log) else read_log(args.log)
+    frame_count = len(Recording(rows)) if isinstance(rows, str) else len(rows)
+    start = time.time()
+    map_log(rows, Rover.world_map, workers=args.workers or None)
+    elapsed = time.time() - start
+    Rover.map_stats.update(Rover.world_map.pop_updated())
+    print("Frames: {}, {:.2f} s, {:.1f} frames/s".format(frame_count, elapsed, frame_count / elapsed))
+    print("Mapped: {}%, Fidelity: {}%".format(Rover.map_stats.perc_mapped, Rover.map_stats.fidelity))
@@ -1,7 +1,12 @@
+import copy
+import functools
+
 import numpy as np
 import cv2
 
+from buffers import BufferPool
 from rover_state import RoverState
+from world_map import OBSTACLE_CHANNEL, ROCK_CHANNEL, NAVIGABLE_CHANNEL
 
 def color_thresh(img, rgb_thresh_lower=(160, 160, 160), rgb_thresh_upper=(255, 255, 255)):
     """
@@ -11,20 +16,76 @@ def color_thresh(img, rgb_thresh_lower=(160, 160, 160), rgb_thresh_upper=(255, 2
     :param rgb_thresh_upper: tuple R,G,B for upper bound
     :return: image with 1, with the current selection (>lower and <=upper)
     """
-    color_select = np.zeros_like(img[:, :, 0])
-    above_thresh_lower = (img[:, :, 0] >= rgb_thresh_lower[0]) \
-                         & (img[:, :, 1] >= rgb_thresh_lower[1]) \
-                         & (img[:, :, 2] >= rgb_thresh_lower[2])
+    color_select = np.zeros_like(img[..., 0])
+    above_thresh_lower = (img[..., 0] >= rgb_thresh_lower[0]) \
+                         & (img[..., 1] >= rgb_thresh_lower[1]) \
+                         & (img[..., 2] >= rgb_thresh_lower[2])
 
-    above_thresh_upper = (img[:, :, 0] <= rgb_thresh_upper[0]) \
-                         & (img[:, :, 1] <= rgb_thresh_upper[1]) \
-                         & (img[:, :, 2] <= rgb_thresh_upper[2])
+    above_thresh_upper = (img[..., 0] <= rgb_thresh_upper[0]) \
+                         & (img[..., 1] <= rgb_thresh_upper[1]) \
+                         & (img[..., 2] <= rgb_thresh_upper[2])
 
     above_thresh = above_thresh_lower & above_thresh_upper
 
     color_select[above_thresh] = 1
     return color_select
 
+# Terrain label bits produced by classify_terrain()
+OBSTACLE = 1
+ROCK = 2
+NAVIGABLE = 4
+
+# (label, lower RGB, upper RGB) thresholds, inclusive like color_thresh()
+TERRAIN_THRESHOLDS = (
+    (OBSTACLE, (0, 0, 0), (160, 160, 160)),
+    (ROCK, (100, 0, 0), (180, 180, 70)),
+    (NAVIGABLE, (160, 160, 160), (255, 255, 255)),
+)
+
+# Color of every combination of terrain labels in the vision image: obstacles red,
+# rock samples green and navigable terrain blue
+VISION_COLORS = np.array([[255 * bool(labels & OBSTACLE), 255 * bool(labels & ROCK), 255 * bool(labels & NAVIGABLE)]
+                          for labels in range(8)], dtype=np.uint8)
+
+# Worldmap channel of each terrain label
+WORLD_MAP_CHANNELS = (
+    (OBSTACLE, OBSTACLE_CHANNEL),
+    (ROCK, ROCK_CHANNEL),
+    (NAVIGABLE, NAVIGABLE_CHANNEL),
+)
+
+
+def terrain_lut(thresholds=TERRAIN_THRESHOLDS):
+    """
+    Per channel lookup table for classify_terrain()
+    :param tuple thresholds: (label, lower RGB, upper RGB) for every terrain class
+    :return: (1, 256, 3) uint8 table, the labels that each channel value is within the thresholds of
+    """
+    lut = np.zeros((1, 256, 3), dtype=np.uint8)
+    values = np.arange(256)
+    for label, lower, upper in thresholds:
+        for channel in range(3):
+            lut[0, (values >= lower[channel]) & (values <= upper[channel]), channel] |= label
+    return lut
+
+
+def classify_terrain(img, lut, out=None, scratch=None):
+    """
+    Label the pixels of all terrain classes in a single pass, the same selections
+    color_thresh() returns for each class thresholds
+    :param np.ndarray img: uint8 image in RGB, (..., 3)
+    :param np.ndarray lut: table from terrain_lut()
+    :param np.ndarray out: optional contiguous uint8 output, img.shape[:-1]
+    :param np.ndarray scratch: optional contiguous uint8 buffer for the labels of every channel, img.shape
+    :return: uint8 label image, bitwise or of the labels of the classes each pixel belongs to
+    """
+    channel_labels = cv2.LUT(img.reshape(-1, 1, 3), lut,
+                             dst=scratch.reshape(-1, 1, 3) if scratch is not None else None)
+    if out is None:
+        return np.bitwise_and.reduce(channel_labels, axis=2).reshape(img.shape[:-1])
+    np.bitwise_and.reduce(channel_labels, axis=2, out=out.reshape(-1, 1))
+    return out
+
 # Define a function to convert from image coords to rover coords
 def rover_coords(binary_img):
     # Identify nonzero pixels
@@ -46,6 +107,20 @@ def to_polar_coords(x_pixel, y_pixel):
     angles = np.arctan2(y_pixel, x_pixel)
     return dist, angles
 
+@functools.lru_cache(maxsize=None)
+def rover_coord_tables(image_shape):
+    """
+    rover_coords() and to_polar_coords() of every pixel of an image shape
+    :param tuple image_shape: (rows, columns) of the image
+    :return: x, y, distance and angle tables, each (rows, columns)
+    """
+    x_pixel, y_pixel = rover_coords(np.ones(image_shape, dtype=np.uint8))
+    dist, angles = to_polar_coords(x_pixel, y_pixel)
+    tables = tuple(table.reshape(image_shape) for table in (x_pixel, y_pixel, dist, angles))
+    for table in tables:
+        table.flags.writeable = False
+    return tables
+
 # Define a function to map rover space pixels to world space
 def rotate_pix(xpix, ypix, yaw):
     # Convert yaw to radians
@@ -77,6 +152,44 @@ def pix_to_world(xpix, ypix, xpos, ypos, yaw, world_size, scale):
     # Return the result
     return x_pix_world, y_pix_world
 
+def world_cells(x_world, y_world, out=None):
+    """
+    :param np.ndarray x_world: x world coordinates
+    :param np.ndarray y_world: y world coordinates
+    :param tuple out: optional x and y int64 outputs, the coordinates are then floored in place
+    :return: x and y cells, not clipped to the worldmap
+    """
+    if out is None:
+        return np.floor(x_world).astype(np.int64), np.floor(y_world).astype(np.int64)
+    for coordinates, cells in zip((x_world, y_world), out):
+        np.copyto(cells, np.floor(coordinates, out=coordinates), casting='unsafe')
+    return out
+
+
+def rover_to_world(xpix, ypix, xpos, ypos, yaw, scale, buffers):
+    """
+    rotate_pix() and translate_pix() into buffers, with the same arithmetic
+    :param np.ndarray xpix: x rover coordinates
+    :param np.ndarray ypix: y rover coordinates
+    :param float xpos: rover x position
+    :param float ypos: rover y position
+    :param float yaw: rover yaw, in degrees
+    :param int scale: pixels per meter
+    :param BufferPool buffers: buffers to use
+    :return: x and y world coordinates
+    """
+    yaw_rad = yaw * np.pi / 180
+    cos_yaw, sin_yaw = np.cos(yaw_rad), np.sin(yaw_rad)
+    x_world = buffers.vector('x_world', len(xpix), np.float64)
+    y_world = buffers.vector('y_world', len(xpix), np.float64)
+    scratch = buffers.vector('world_scratch', len(xpix), np.float64)
+    np.subtract(np.multiply(xpix, cos_yaw, out=x_world), np.multiply(ypix, sin_yaw, out=scratch), out=x_world)
+    np.add(np.multiply(xpix, sin_yaw, out=y_world), np.multiply(ypix, cos_yaw, out=scratch), out=y_world)
+    np.add(np.divide(x_world, scale, out=x_world), xpos, out=x_world)
+    np.add(np.divide(y_world, scale, out=y_world), ypos, out=y_world)
+    return x_world, y_world
+
+
 # Define a function to perform a perspective transform
 def perspect_transform(img, src, dst):
            
@@ -85,12 +198,269 @@ def perspect_transform(img, src, dst):
     
     return warped
 
+# Rows at the top and columns at the sides of the warped image that are too far
+# away from the rover to be trusted for navigable terrain and obstacles
+CLIP_TOP = 80
+CLIP_SIDE = 60
+
+# Camera calibration: grid square corners in the camera image and the size of the
+# square they are mapped onto in the top-down view (1 square meter = 10x10 pixels)
+CALIBRATION_SOURCE = ((10, 140), (301, 140), (200, 96), (118, 96))
+DEST_HALF_SIZE = 5
+DEST_BOTTOM_OFFSET = 5
+
+
 def clip_selection(selection):
-    selection[0:80, ] = 0
-    selection[:, 0:60] = 0
-    selection[:, -60:selection.shape[1]] = 0
+    selection[0:CLIP_TOP, ] = 0
+    selection[:, 0:CLIP_SIDE] = 0
+    selection[:, -CLIP_SIDE:selection.shape[1]] = 0
     return selection
 
+
+def perspective_points(image_shape):
+    """
+    Source and destination points of the perspective transform for a camera image
+    :param tuple image_shape: (rows, columns) of the camera image
+    :return: source and destination points as float32 arrays
+    """
+    source = np.float32(CALIBRATION_SOURCE)
+    dest_size = DEST_HALF_SIZE * 2
+    dest_center_x = image_shape[1] / 2
+    dest_start_y = image_shape[0] - DEST_BOTTOM_OFFSET
+
+    destination = np.float32([[dest_center_x - DEST_HALF_SIZE, dest_start_y],
+                              [dest_center_x + DEST_HALF_SIZE, dest_start_y],
+                              [dest_center_x + DEST_HALF_SIZE, dest_start_y - dest_size],
+                              [dest_center_x - DEST_HALF_SIZE, dest_start_y - dest_size]])
+    return source, destination
+
+
+class PerceptionEngine(object):
+    """
+    Per camera configuration perception tables.
+
+    The perspective matrix is computed once and turned into a fixed point remap
+    table that covers only the warped pixels perception actually reads: the
+    region kept by clip_selection (navigable terrain and obstacles) plus the
+    pixels outside of it that the camera can see (rock samples are not clipped,
+    and the rest of the warped image is always black).  Warping a frame is then a
+    single cv2.remap over that pixel list.
+    """
+    # cv2.remap() needs both dimensions of the map below SHRT_MAX
+    remap_columns = 256
+    # Sub-pixel precision of OpenCV's fixed point maps (cv2.INTER_BITS)
+    interpolation_bits = 5
+    interpolation_steps = 1 << interpolation_bits
+
+    def __init__(self, image_shape, source=None, destination=None, thresholds=TERRAIN_THRESHOLDS):
+        """
+        :param tuple image_shape: (rows, columns) of the camera image
+        :param np.ndarray source: perspective source points, calibration default if None
+        :param np.ndarray destination: perspective destination points, calibration default if None
+        :param tuple thresholds: terrain class thresholds, see terrain_lut()
+        """
+        self.image_shape = tuple(image_shape[:2])
+        rows, cols = self.image_shape
+        if source is None or destination is None:
+            source, destination = perspective_points(self.image_shape)
+        self.matrix = cv2.getPerspectiveTransform(source, destination)
+
+        # Warped pixels (as flat indexes) kept by clip_selection come first
+        clip_mask = clip_selection(np.ones(self.image_shape, dtype=np.uint8)).astype(bool)
+        visible = cv2.warpPerspective(np.full(self.image_shape, 255, dtype=np.uint8), self.matrix,
+                                      (cols, rows)).astype(bool)
+        self.pixel_index = np.concatenate((np.flatnonzero(clip_mask),
+                                           np.flatnonzero(visible & ~clip_mask)))
+        self.clipped_count = int(np.count_nonzero(clip_mask))
+        self.pixel_count = len(self.pixel_index)
+        self.pixel_rows, self.pixel_cols = np.divmod(self.pixel_index, cols)
+        # Only rock samples are detected outside of the clip region
+        self.label_mask = np.full(self.pixel_count, OBSTACLE | ROCK | NAVIGABLE, dtype=np.uint8)
+        self.label_mask[self.clipped_count:] = ROCK
+        self.thresholds = thresholds
+        self.lut = terrain_lut(thresholds)
+        # Rover space and polar coordinates of the warped pixels
+        self.rover_x, self.rover_y, self.dists, self.angles = (
+            table[self.pixel_rows, self.pixel_cols] for table in rover_coord_tables(self.image_shape))
+
+        # Fixed point source image coordinates of each warped pixel, in double precision with
+        # cv2.INTER_TAB_SIZE sub-pixel steps for the bilinear interpolation.  cv2.warpPerspective()
+        # rounds its coordinates a little differently, so the warped pixels only match its output
+        # within a small tolerance: 1 to 3 levels apart on 62 of the 283 test_dataset images, with
+        # the same terrain labels
+        inverse = np.linalg.inv(self.matrix)
+        homogeneous = inverse.dot(np.vstack((self.pixel_cols, self.pixel_rows,
+                                             np.ones(self.pixel_count))))
+        with np.errstate(divide='ignore'):
+            weight = np.where(homogeneous[2] != 0, self.interpolation_steps / homogeneous[2], 0)
+        fixed_x = np.rint(homogeneous[0] * weight).astype(np.int64)
+        fixed_y = np.rint(homogeneous[1] * weight).astype(np.int64)
+        padded_count = -(-self.pixel_count // self.remap_columns) * self.remap_columns
+        # Padding points outside of the image, remap() fills them with the border value
+        map1 = np.full((padded_count, 2), -1, dtype=np.int16)
+        map2 = np.zeros(padded_count, dtype=np.uint16)
+        map1[:self.pixel_count, 0] = np.clip(fixed_x >> self.interpolation_bits, -32768, 32767)
+        map1[:self.pixel_count, 1] = np.clip(fixed_y >> self.interpolation_bits, -32768, 32767)
+        map2[:self.pixel_count] = (fixed_y & (self.interpolation_steps - 1)) * self.interpolation_steps \
+            + (fixed_x & (self.interpolation_steps - 1))
+        self.map1 = map1.reshape(-1, self.remap_columns, 2)
+        self.map2 = map2.reshape(-1, self.remap_columns)
+
+    def with_thresholds(self, thresholds):
+        """
+        Engine for other terrain thresholds, that shares the tables of this one
+        :param tuple thresholds: terrain class thresholds, see terrain_lut()
+        :rtype: PerceptionEngine
+        """
+        engine = copy.copy(self)
+        engine.thresholds = thresholds
+        engine.lut = terrain_lut(thresholds)
+        return engine
+
+    def warp(self, img, out=None):
+        """
+        Warp the pixels used by perception
+        :param np.ndarray img: camera image
+        :param np.ndarray out: optional output, (map rows, remap_columns, channels) of the image type
+        :return: (pixel_count, channels) warped pixels, in the order of pixel_index
+        """
+        warped = cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=out)
+        return warped.reshape(-1, img.shape[2])[:self.pixel_count]
+
+    def warp_batch(self, images):
+        """
+        warp() for a batch of images
+        :param np.ndarray images: (N, rows, columns, channels) camera images
+        :return: (N, pixel_count, channels) warped pixels
+        """
+        warped = np.empty((len(images),) + self.map2.shape + images.shape[3:], dtype=images.dtype)
+        for idx, image in enumerate(images):
+            cv2.remap(image, self.map1, self.map2, cv2.INTER_LINEAR, dst=warped[idx])
+        return warped.reshape(len(images), -1, images.shape[3])[:, :self.pixel_count]
+
+    def classify(self, warped, out=None, scratch=None):
+        """
+        Terrain labels of the warped pixels, clipped like clip_selection()
+        :param np.ndarray warped: pixels from warp() or warp_batch()
+        :param np.ndarray out: optional uint8 output, warped.shape[:-1]
+        :param np.ndarray scratch: optional uint8 buffer, warped.shape, see classify_terrain()
+        :return: uint8 labels in the order of pixel_index
+        """
+        labels = classify_terrain(warped, self.lut, out, scratch)
+        labels &= self.label_mask
+        return labels
+
+    def polar_coords(self, selection):
+        """
+        to_polar_coords() for a selection over the warped pixel list
+        :param np.ndarray selection: boolean selection in the order of pixel_index
+        :return: distances and angles of the selected pixels
+        """
+        return self.dists[selection], self.angles[selection]
+
+    def paint(self, labels, image, out=None):
+        """
+        Write the label colors of the warped pixels into a full size RGB image, see VISION_COLORS
+        :param np.ndarray labels: labels from classify()
+        :param np.ndarray image: contiguous (rows, columns, 3) uint8 image to write to
+        :param np.ndarray out: optional (pixel_count, 3) uint8 buffer for the colors
+        """
+        image.reshape(-1, 3)[self.pixel_index] = np.take(VISION_COLORS, labels, axis=0, out=out)
+
+
+@functools.lru_cache(maxsize=None)
+def _camera_engine(image_shape):
+    # The tables only depend on the camera image shape
+    return PerceptionEngine(image_shape)
+
+
+# Threshold sets whose lookup tables are kept, a sweep can try any number of them
+@functools.lru_cache(maxsize=64)
+def get_perception_engine(image_shape, thresholds=TERRAIN_THRESHOLDS):
+    """
+    Perception engine for the camera image shape and terrain thresholds, created on first use.  The
+    engines of all thresholds share the tables of the image shape, only their lookup tables differ
+    :param tuple image_shape: (rows, columns) of the camera image
+    :param tuple thresholds: terrain class thresholds, see terrain_lut()
+    :rtype: PerceptionEngine
+    """
+    engine = _camera_engine(tuple(image_shape))
+    return engine if thresholds == engine.thresholds else engine.with_thresholds(thresholds)
+
+
+def map_image(image, xpos, ypos, yaw, world_map, scale=10, thresholds=TERRAIN_THRESHOLDS, buffers=None):
+    """
+    Warp and classify a camera image and add its observations to a worldmap
+    :param np.ndarray image: camera image
+    :param float xpos: rover x position
+    :param float ypos: rover y position
+    :param float yaw: rover yaw, in degrees
+    :param WorldMap world_map: the worldmap to update
+    :param int scale: pixels per meter of the warped image
+    :param tuple thresholds: terrain class thresholds, see terrain_lut()
+    :param BufferPool buffers: buffers to reuse from frame to frame, new ones if None
+    :return: the perception engine and the terrain labels of its warped pixels, in a buffer
+    """
+    buffers = buffers if buffers is not None else BufferPool()
+    # 1) Perspective transform for this camera, computed on the first frame
+    engine = get_perception_engine(image.shape[:2], thresholds)
+
+    # 2) Apply perspective transform
+    warped = engine.warp(image, buffers.get('warped', engine.map2.shape + image.shape[2:], image.dtype))
+
+    # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
+    labels = engine.classify(warped, buffers.get('labels', (engine.pixel_count,), np.uint8),
+                             buffers.get('channel_labels', warped.shape, np.uint8))
+
+    # 4) Convert map image pixel values to rover-centric coords
+    observed = np.not_equal(labels, 0, out=buffers.get('observed', labels.shape, bool))
+    observed_xpix = buffers.select('observed_xpix', observed, engine.rover_x)
+    observed_ypix = buffers.select('observed_ypix', observed, engine.rover_y)
+
+    # 5) Convert rover-centric pixel values to world cells, like pix_to_world() but
+    # leaving the clipping to the worldmap, a tiled one keeps what is beyond its window
+    xpix_tran, ypix_tran = rover_to_world(observed_xpix, observed_ypix, xpos, ypos, yaw, scale, buffers)
+    observed_x_world, observed_y_world = world_cells(xpix_tran, ypix_tran, (
+        buffers.vector('x_cells', len(xpix_tran), np.int64), buffers.vector('y_cells', len(ypix_tran), np.int64)))
+
+    # 6) Update the worldmap
+    world_map.accumulate(observed_x_world, observed_y_world, buffers.select('observed_labels', observed, labels),
+                         WORLD_MAP_CHANNELS)
+    return engine, labels
+
+
+def map_images(images, xpos, ypos, yaw, world_map, scale=10, thresholds=TERRAIN_THRESHOLDS):
+    """
+    map_image() for a batch of frames, with a single worldmap update
+    :param np.ndarray images: (N, rows, columns, 3) camera images
+    :param np.ndarray xpos: (N,) rover x positions
+    :param np.ndarray ypos: (N,) rover y positions
+    :param np.ndarray yaw: (N,) rover yaws, in degrees
+    :param WorldMap world_map: the worldmap to update
+    :param int scale: pixels per meter of the warped image
+    :param tuple thresholds: terrain class thresholds, see terrain_lut()
+    :return: the perception engine and the (N, pixel_count) terrain labels
+    """
+    engine = get_perception_engine(images.shape[1:3], thresholds)
+    labels = engine.classify(engine.warp_batch(images))
+
+    # Rover-centric coords of every observed pixel, and the frame it belongs to
+    frame, pixel = labels.nonzero()
+    xpix, ypix = engine.rover_x[pixel], engine.rover_y[pixel]
+
+    # Same rotation and translation as map_image(), with the pose of each pixel's frame
+    yaw_rad = np.asarray(yaw, dtype=np.float64) * np.pi / 180
+    cos_yaw, sin_yaw = np.cos(yaw_rad)[frame], np.sin(yaw_rad)[frame]
+    xpix_rot = (xpix * cos_yaw) - (ypix * sin_yaw)
+    ypix_rot = (xpix * sin_yaw) + (ypix * cos_yaw)
+    xpix_tran, ypix_tran = translate_pix(xpix_rot, ypix_rot, np.asarray(xpos, dtype=np.float64)[frame],
+                                         np.asarray(ypos, dtype=np.float64)[frame], scale)
+    x_world, y_world = world_cells(xpix_tran, ypix_tran)
+
+    world_map.accumulate(x_world, y_world, labels[frame, pixel], WORLD_MAP_CHANNELS)
+    return engine, labels
+
+
 # Apply the above functions in succession and update the Rover state accordingly
 def perception_step(Rover):
     """
@@ -99,69 +469,34 @@ def perception_step(Rover):
     :return RoverState: updated rover
     """
     # Perform perception steps to update Rover()
-    # TODO: 
     # NOTE: camera image is coming to you in Rover.img
-    image = Rover.img
-
-    # 1) Define source and destination points for perspective transform
-    source = np.float32([[10, 140], [301, 140], [200, 96], [118, 96]])
-    dest_half_size = 5
-    dest_size = dest_half_size * 2
-    dest_center_x = image.shape[1] / 2
-    dest_start_y = image.shape[0] - 5
-
-    destination = np.float32([[dest_center_x - dest_half_size, dest_start_y],
-                     [dest_center_x + dest_half_size, dest_start_y],
-                     [dest_center_x + dest_half_size, dest_start_y - dest_size],
-                     [dest_center_x - dest_half_size, dest_start_y - dest_size]])
-    # 2) Apply perspective transform
-    warped = perspect_transform(image, source, destination)
 
-    # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
-    navigable_selection = color_thresh(warped, rgb_thresh_lower=(160, 160, 160))
-    navigable_selection = clip_selection(navigable_selection)
-    obstacle_selection = color_thresh(warped, rgb_thresh_lower=(0, 0, 0), rgb_thresh_upper=(160, 160, 160))
-    obstacle_selection = clip_selection(obstacle_selection)
-    rock_selection = color_thresh(warped, rgb_thresh_lower=(100, 0, 0), rgb_thresh_upper=(180, 180, 70))
-
-    # 4) Update Rover.vision_image (this will be displayed on left side of screen)
-    Rover.vision_image[:, :, 0] = obstacle_selection
-    Rover.vision_image[:, :, 1] = rock_selection
-    Rover.vision_image[:, :, 2] = navigable_selection
-
-    # 5) Convert map image pixel values to rover-centric coords
-    obstacle_xpix, obstacle_ypix = rover_coords(obstacle_selection)
-    rock_xpix, rock_ypix = rover_coords(rock_selection)
-    navigable_xpix, navigable_ypix = rover_coords(navigable_selection)
-
-    # 6) Convert rover-centric pixel values to world coordinates
-    rover_xpos = Rover.pos[0]
-    rover_ypos = Rover.pos[1]
-    rover_yaw = Rover.yaw
-    scale = 10
-    world_size = Rover.worldmap.shape[0]
-    obstacle_x_world, obstacle_y_world = pix_to_world(obstacle_xpix, obstacle_ypix, rover_xpos,
-                                                      rover_ypos, rover_yaw,
-                                                      world_size, scale)
-    rock_x_world, rock_y_world = pix_to_world(rock_xpix, rock_ypix, rover_xpos,
-                                              rover_ypos, rover_yaw,
-                                              world_size, scale)
-    navigable_x_world, navigable_y_world = pix_to_world(navigable_xpix, navigable_ypix, rover_xpos,
-                                              rover_ypos, rover_yaw,
-                                              world_size, scale)
-
-    # 7) Update Rover worldmap (to be displayed on right side of screen)
-    Rover.worldmap[obstacle_y_world, obstacle_x_world, 0] += 1
-    Rover.worldmap[rock_y_world, rock_x_world, 1] += 1
-    Rover.worldmap[navigable_y_world, navigable_x_world, 2] += 1
-
-    # 8) Convert rover-centric pixel positions to polar coordinates
-    # Update Rover pixel distances and angles
-    Rover.nav_dists, Rover.nav_angles = to_polar_coords(navigable_xpix, navigable_ypix)
-
-    # 9) Determine if there is a sample nearby
+    # 1) Perspective transform, color thresholds and update of the Rover worldmap
+    # (to be displayed on right side of screen)
+    buffers = Rover.buffers
+    engine, labels = map_image(Rover.img, Rover.pos[0], Rover.pos[1], Rover.yaw, Rover.world_map,
+                               thresholds=Rover.terrain_thresholds or TERRAIN_THRESHOLDS, buffers=buffers)
+
+    # 2) Update Rover.vision_image (this will be displayed on left side of screen)
+    engine.paint(labels, Rover.vision_image, buffers.get('vision_colors', (engine.pixel_count, 3), np.uint8))
+
+    # 3) Convert rover-centric pixel positions to polar coordinates
+    # Update Rover pixel distances and angles, in buffers until the next frame
+    navigable_selection = np.bitwise_and(labels, NAVIGABLE, out=buffers.get('navigable', labels.shape, np.uint8))
+    Rover.nav_dists = buffers.select('nav_dists', navigable_selection, engine.dists)
+    Rover.nav_angles = buffers.select('nav_angles', navigable_selection, engine.angles)
+
+    # 4) Determine if there is a sample nearby
+    update_active_sample(Rover)
+
+    return Rover
+
+
+def update_active_sample(Rover):
+    """
+    Distance and angle from the rover to the sample it is going for, if any
+    :param RoverState Rover: the rover
+    """
     if Rover.active_sample_position:
         Rover.active_sample_distance, Rover.active_sample_angle = to_polar_coords(Rover.active_sample_position[0] - Rover.pos[0],
-                                                                                  Rover.active_sample_position[1] - Rover.pos[1])
-
-    return Rover
\ No newline at end of file
+                                                                                  Rover.active_sample_position[1] - Rover.pos[1])
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Pipelined execution of the telemetry handler over worker processes.
+
+Camera images are decoded and inset images encoded in a process pool, while the
+perception and decision steps stay in the handler process on the one RoverState.
+Frames are handed over through shared memory buffers instead of being pickled: a
+worker decodes a camera image straight into a shared buffer that becomes Rover.img,
+and reads the inset images from shared buffers the encoder thread fills.  The
+encoder thread only waits for its worker, so the perception of frame N+1 runs while
+the insets of frame N are encoded.
+"""
+import multiprocessing
+import signal
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import cv2
+
+from image_encoding import InsetEncoder, encode_image
+from telemetry import TelemetryDecoder
+
+# Shared buffers attached by a worker process, by name
+_attached = {}
+
+
+def _ignore_interrupts():
+    # Ctrl-C stops the server, which closes the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _attach(name, shape):
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+        # The buffer belongs to the handler process, keep the worker from unlinking it at exit
+        resource_tracker.unregister(_attached[name]._name, 'shared_memory')
+    return np.ndarray(shape, dtype=np.uint8, buffer=_attached[name].buf)
+
+
+def _decode_into(name, shape, jpeg):
+    """
+    Decode a JPEG camera image into a shared buffer, in a worker process
+    :return: True if the image was decoded, False if it does not fit the buffer
+    """
+    bgr = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError("Could not decode the camera image")
+    if bgr.shape != tuple(shape):
+        return False
+    cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=_attach(name, shape))
+    return True
+
+
+def _encode_from(buffers, image_format, compression):
+    """
+    Encode images held in shared buffers, in a worker process
+    :param list buffers: (name, shape) of every image
+    :return: list of base64 encoded images
+    """
+    return [encode_image(_attach(name, shape), image_format, compression) for name, shape in buffers]
+
+
+class SharedBuffer(object):
+    """
+    A uint8 array in shared memory, that worker processes attach to by name
+    """
+
+    def __init__(self, shape):
+        """
+        :param tuple shape: shape of the array
+        """
+        self.shape = tuple(shape)
+        self._memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(self.shape)), 1))
+        self.name = self._memory.name
+        self.array = np.ndarray(self.shape, dtype=np.uint8, buffer=self._memory.buf)
+
+    def close(self):
+        # Views of the buffer must be gone before it can be closed
+        self.array = None
+        self._memory.close()
+        self._memory.unlink()
+
+
+class PipelinedDecoder(TelemetryDecoder):
+    """
+    TelemetryDecoder that decodes the camera images in a worker process.
+
+    Images are decoded into a ring of shared buffers, the returned image stays valid
+    until slots - 1 more images have been decoded.  Images that do not have the
+    expected shape are decoded in this process.
+    """
+
+    def __init__(self, pool, wait, image_shape=(160, 320, 3), slots=3):
+        """
+        :param multiprocessing.pool.Pool pool: worker processes
+        :param wait: called with an AsyncResult, returns its value
+        :param tuple image_shape: expected shape of the camera images
+        :param int slots: number of shared image buffers
+        """
+        super(PipelinedDecoder, self).__init__(image_shape)
+        self.pool = pool
+        self.wait = wait
+        self.buffers = [SharedBuffer(image_shape) for _ in range(slots)]
+        self._slot = 0
+
+    def decode_jpeg(self, jpeg):
+        buffer = self.buffers[self._slot]
+        if not self.wait(self.pool.apply_async(_decode_into, (buffer.name, buffer.shape, jpeg))):
+            return super(PipelinedDecoder, self).decode_jpeg(jpeg)
+        self._slot = (self._slot + 1) % len(self.buffers)
+        return buffer.array
+
+    def close(self):
+        super(PipelinedDecoder, self).close()
+        for buffer in self.buffers:
+            buffer.close()
+
+
+class PipelinedInsetEncoder(InsetEncoder):
+    """
+    InsetEncoder that encodes the images in a worker process, handing them over in shared buffers
+    """
+
+    def __init__(self, pool, **kwargs):
+        """
+        :param multiprocessing.pool.Pool pool: worker processes
+        :param kwargs: see InsetEncoder
+        """
+        self.pool = pool
+        self.buffers = []
+        super(PipelinedInsetEncoder, self).__init__(**kwargs)
+
+    def _encode(self, images):
+        # Called from the encoder thread only, one set of buffers is enough
+        for idx, image in enumerate(images):
+            if idx == len(self.buffers):
+                self.buffers.append(SharedBuffer(image.shape))
+            elif self.buffers[idx].shape != image.shape:
+                self.buffers[idx].close()
+                self.buffers[idx] = SharedBuffer(image.shape)
+            self.buffers[idx].array[...] = image
+        return self.pool.apply(_encode_from, ([(buffer.name, buffer.shape) for buffer in self.buffers[:len(images)]],
+                                              self.image_format, self.compression))
+
+    def close(self):
+        super(PipelinedInsetEncoder, self).close()
+        for buffer in self.buffers:
+            buffer.close()
+
+
+class FramePipeline(object):
+    """
+    Process pool shared by the pipelined decoder and inset encoder
+    """
+
+    def __init__(self, workers=2, wait=None):
+        """
+        :param int workers: number of worker processes
+        :param wait: called with an AsyncResult, returns its value.  In an eventlet server
+            use eventlet.tpool.execute(result.get), so other green threads run meanwhile
+        """
+        self.pool = multiprocessing.Pool(workers, initializer=_ignore_interrupts)
+        self.wait = wait if wait is not None else lambda result: result.get()
+
+    def decoder(self, image_shape=(160, 320, 3), slots=3):
+        """
+        :return: a PipelinedDecoder, to be used as the telemetry decoder of a rover and closed
+            by the caller before the pipeline
+        """
+        return PipelinedDecoder(self.pool, self.wait, image_shape, slots)
+
+    def inset_encoder(self, **kwargs):
+        """
+        :param kwargs: see InsetEncoder
+        :return: a PipelinedInsetEncoder, closed by the caller before the pipeline
+        """
+        return PipelinedInsetEncoder(self.pool, **kwargs)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,270 @@
+"""
+Frontier based exploration: plans a path from the rover to the nearest unexplored
+frontier of the worldmap and hands decision_step a waypoint on it.
+"""
+import heapq
+import time
+
+import numpy as np
+import cv2
+
+from world_map import OBSTACLE_CHANNEL, NAVIGABLE_CHANNEL
+
+# Terrain states of the navigability grid
+UNKNOWN = 0
+FREE = 1
+BLOCKED = 2
+
+SQRT2 = np.sqrt(2)
+
+
+def navigability(grid, navigable_share=0.1):
+    """
+    Terrain state of every worldmap cell from its observation counts.  Obstacle pixels
+    far outnumber navigable ones, so a cell is free from a small share of navigable
+    observations on
+    :param np.ndarray grid: (rows, cols, channels) worldmap counts
+    :param float navigable_share: share of the observations of a free cell that are navigable
+    :return: (rows, cols) uint8 grid of UNKNOWN, FREE and BLOCKED
+    """
+    navigable = grid[:, :, NAVIGABLE_CHANNEL].astype(np.float32)
+    obstacle = grid[:, :, OBSTACLE_CHANNEL].astype(np.float32)
+    state = np.full(navigable.shape, UNKNOWN, dtype=np.uint8)
+    free = (navigable > 0) & (navigable >= navigable_share * (navigable + obstacle))
+    state[free] = FREE
+    state[~free & (obstacle > 0)] = BLOCKED
+    return state
+
+
+def frontiers(state, min_unknown_neighbors=3):
+    """
+    Free cells at the border of the unexplored part of the map
+    :param np.ndarray state: grid from navigability()
+    :param int min_unknown_neighbors: unknown cells among the 8 neighbors of a frontier cell
+    :return: boolean (rows, cols) grid
+    """
+    unknown = (state == UNKNOWN).astype(np.uint8)
+    neighbors = cv2.filter2D(unknown, -1, np.ones((3, 3), dtype=np.float32), borderType=cv2.BORDER_CONSTANT)
+    return (state == FREE) & (neighbors - unknown >= min_unknown_neighbors)
+
+
+class FrontierPlanner(object):
+    """
+    Plans from the rover to the nearest frontier with D* Lite, incrementally.
+
+    All frontier cells are goals of a single backwards search, so the path leads to
+    the cheapest one to reach.  Between calls only the cells whose terrain or frontier
+    state changed are updated, and the search resumes from where it stopped: every
+    call spends at most budget seconds expanding cells.  Cells next to obstacles are
+    more expensive, and unknown cells are assumed passable at a higher cost.
+    """
+    free_cost = 1.0
+    near_obstacle_cost = 3.0
+    unknown_cost = 2.0
+    # Cells from the rover to the waypoint, along the path
+    lookahead = 6
+
+    def __init__(self, map_shape, budget=0.005, min_unknown_neighbors=3, max_expansions=None):
+        """
+        :param tuple map_shape: (rows, cols) of the worldmap
+        :param float budget: seconds of search per call, None for no time limit
+        :param int min_unknown_neighbors: see frontiers()
+        :param int max_expansions: cells expanded per call at most, None for no limit.  Unlike budget it does
+            not depend on the speed or load of the CPU, so that simulated runs repeat exactly
+        """
+        self.map_shape = tuple(map_shape[:2])
+        self.budget = budget
+        self.max_expansions = max_expansions
+        self.min_unknown_neighbors = min_unknown_neighbors
+        rows, cols = self.map_shape
+        # The grid is padded with blocked cells, so the neighbors of the map cells are all in the grid;
+        # the padding is never updated, which the searches make sure of by skipping blocked cells
+        self.width = cols + 2
+        size = (rows + 2) * self.width
+        self.g = np.full(size, np.inf)
+        self.rhs = np.full(size, np.inf)
+        self.cost = np.full(size, np.inf)
+        self.goal = np.zeros(size, dtype=bool)
+        self.offsets = [(-self.width - 1, SQRT2), (-self.width, 1.0), (-self.width + 1, SQRT2), (-1, 1.0),
+                        (1, 1.0), (self.width - 1, SQRT2), (self.width, 1.0), (self.width + 1, SQRT2)]
+        inner = np.zeros((rows + 2, self.width), dtype=bool)
+        inner[1:-1, 1:-1] = True
+        self._inner = np.flatnonzero(inner)
+        self._queue = []
+        self._queued = {}
+        self._km = 0.0
+        self._start = None
+        self._last_start = None
+        self._cell_cost = None
+        self._frontier = None
+        self._revision = 0
+        self.waypoint = None
+        self.expanded = 0
+
+    def _heuristic(self, a, b):
+        # Octile distance, admissible with free_cost per cell
+        (ay, ax), (by, bx) = divmod(a, self.width), divmod(b, self.width)
+        dx, dy = abs(ax - bx), abs(ay - by)
+        return self.free_cost * (max(dx, dy) + (SQRT2 - 1) * min(dx, dy))
+
+    def _key(self, cell):
+        value = min(self.g[cell], self.rhs[cell])
+        return value + self._heuristic(self._start, cell) + self._km, value
+
+    def _update_vertex(self, cell):
+        if not self.goal[cell]:
+            g, cost = self.g, self.cost
+            self.rhs[cell] = min(step * cost[cell + offset] + g[cell + offset] for offset, step in self.offsets)
+        if self.g[cell] != self.rhs[cell]:
+            key = self._key(cell)
+            self._queued[cell] = key
+            heapq.heappush(self._queue, (key, cell))
+        else:
+            self._queued.pop(cell, None)
+
+    def _compute(self, deadline):
+        """
+        Expand cells until the rover's cell is consistent, the deadline passes or max_expansions cells were expanded
+        :param float deadline: time.perf_counter() to stop at, None for no deadline
+        :return: True if the search completed
+        """
+        g, rhs, cost, queue, queued = self.g, self.rhs, self.cost, self._queue, self._queued
+        start = self._start
+        last_expansion = self.expanded + self.max_expansions if self.max_expansions is not None else None
+        while queue:
+            key, cell = queue[0]
+            if queued.get(cell) != key:
+                heapq.heappop(queue)
+                continue
+            if key >= self._key(start) and rhs[start] == g[start]:
+                return True
+            if last_expansion is not None and self.expanded >= last_expansion:
+                return False
+            if deadline is not None and self.expanded % 64 == 0 and time.perf_counter() > deadline:
+                return False
+            self.expanded += 1
+            heapq.heappop(queue)
+            new_key = self._key(cell)
+            if key < new_key:
+                queued[cell] = new_key
+                heapq.heappush(queue, (new_key, cell))
+            elif g[cell] > rhs[cell]:
+                g[cell] = rhs[cell]
+                del queued[cell]
+                for offset, step in self.offsets:
+                    neighbor = cell + offset
+                    if cost[neighbor] != np.inf or neighbor == start:
+                        self._update_vertex(neighbor)
+            else:
+                g[cell] = np.inf
+                self._update_vertex(cell)
+                for offset, step in self.offsets:
+                    neighbor = cell + offset
+                    # Blocked cells are never on a path, unless they were reached before they got blocked
+                    if cost[neighbor] != np.inf or neighbor == start or g[neighbor] != np.inf:
+                        self._update_vertex(neighbor)
+        return rhs[start] == g[start]
+
+    def _cell(self, pos):
+        rows, cols = self.map_shape
+        x = min(max(int(pos[0]), 0), cols - 1)
+        y = min(max(int(pos[1]), 0), rows - 1)
+        return (y + 1) * self.width + x + 1
+
+    def _terrain(self, grid):
+        """
+        :param np.ndarray grid: (rows, cols, channels) worldmap counts
+        :return: (rows, cols) cost of entering every cell and frontier mask
+        """
+        state = navigability(grid)
+        cell_cost = np.where(state == FREE, self.free_cost, self.unknown_cost)
+        near_obstacle = cv2.dilate((state == BLOCKED).astype(np.uint8), np.ones((3, 3), dtype=np.uint8)) > 0
+        cell_cost[near_obstacle & (state == FREE)] = self.near_obstacle_cost
+        cell_cost[state == BLOCKED] = np.inf
+        return cell_cost, frontiers(state, self.min_unknown_neighbors)
+
+    def _changed_cells(self, world_map):
+        """
+        Recompute the terrain around the tiles of the worldmap window changed since the previous call
+        :return: flat (row * cols + col) indexes of the cells whose cost or frontier state changed
+        """
+        rows, cols = self.map_shape
+        if self._cell_cost is None:
+            self._revision = world_map.revision
+            self._cell_cost, self._frontier = self._terrain(world_map.grid)
+            return np.arange(rows * cols)
+        size = world_map.tile_size
+        keys = np.array([key for key in world_map.changed_tiles(self._revision)
+                         if 0 <= key[0] < rows // size and 0 <= key[1] < cols // size]).reshape(-1, 2)
+        self._revision = world_map.revision
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.intp)
+        # Costs and frontiers depend on the neighbors of a cell, recompute them one cell around
+        # the changed tiles, from the terrain two cells around
+        top, left = keys.min(axis=0) * size
+        bottom, right = (keys.max(axis=0) + 1) * size
+        outer = slice(max(top - 2, 0), min(bottom + 2, rows)), slice(max(left - 2, 0), min(right + 2, cols))
+        inner = slice(max(top - 1, 0), min(bottom + 1, rows)), slice(max(left - 1, 0), min(right + 1, cols))
+        crop = (slice(inner[0].start - outer[0].start, inner[0].stop - outer[0].start),
+                slice(inner[1].start - outer[1].start, inner[1].stop - outer[1].start))
+        cell_cost, frontier = self._terrain(world_map.grid[outer])
+        cell_cost, frontier = cell_cost[crop], frontier[crop]
+        changed_rows, changed_cols = np.nonzero((cell_cost != self._cell_cost[inner]) |
+                                                (frontier != self._frontier[inner]))
+        self._cell_cost[inner], self._frontier[inner] = cell_cost, frontier
+        return (changed_rows + inner[0].start) * cols + changed_cols + inner[1].start
+
+    def update(self, world_map, pos):
+        """
+        Update the plan with the worldmap and the rover position
+        :param TiledWorldMap world_map: the worldmap, only its tiles changed since the previous call are looked at
+        :param tuple pos: rover (x, y) position
+        :return: (x, y) waypoint towards the nearest frontier, None until a path is found
+        """
+        deadline = time.perf_counter() + self.budget if self.budget is not None else None
+        first = self._cell_cost is None
+        changed = self._changed_cells(world_map)
+        cell_cost, frontier = self._cell_cost.ravel(), self._frontier.ravel()
+
+        start = self._cell(pos)
+        if first:
+            self._start = self._last_start = start
+        else:
+            self._start = start
+            self._km += self._heuristic(self._last_start, start)
+            self._last_start = start
+
+        # The cost of entering a cell changed, or whether it is a goal
+        cells = self._inner[changed]
+        self.cost[cells] = cell_cost[changed]
+        self.goal[cells] = frontier[changed]
+        self.rhs[cells[frontier[changed]]] = 0
+        if first:
+            # Nothing was reached yet, only the goals are inconsistent
+            affected = set(cells[frontier[changed]].tolist())
+        else:
+            affected = set(cells.tolist())
+            for offset, step in self.offsets:
+                affected.update((cells + offset).tolist())
+        affected.add(start)
+        for cell in affected:
+            # Blocked cells are never on a path, only the rover can be on one
+            if self.cost[cell] != np.inf or cell == start or self.goal[cell] or self.g[cell] != np.inf:
+                self._update_vertex(cell)
+
+        if self._compute(deadline):
+            self.waypoint = self._follow(start)
+        return self.waypoint
+
+    def _follow(self, cell):
+        if self.g[cell] == np.inf:
+            return None
+        for _ in range(self.lookahead):
+            if self.goal[cell]:
+                break
+            distance, cell = min((step * self.cost[cell + offset] + self.g[cell + offset], cell + offset)
+                                 for offset, step in self.offsets)
+            if distance == np.inf:
+                return None
+        y, x = divmod(cell, self.width)
+        return x - 1 + 0.5, y - 1 + 0.5
@@ -0,0 +1,167 @@
+import csv
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageProfiler(object):
+    """
+    Latency of the stages of the telemetry handler, over a window of the most recent frames.
+
+    Besides the per stage latencies it counts frames, dropped frames and keeps the
+    current and maximum depth of the telemetry queue.
+    """
+
+    def __init__(self, window=1024):
+        """
+        :param int window: number of most recent samples per stage the percentiles are computed over
+        """
+        self.window = window
+        self.start_time = time.time()
+        self.frames = 0
+        self.frames_dropped = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self._samples = {}
+        self._counts = {}
+        self._totals = {}
+        self._frame_times = np.zeros(window)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as a stage
+        :param str name: stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """
+        :param str name: stage name
+        :param float seconds: latency of the stage
+        """
+        if name not in self._samples:
+            self._samples[name] = np.zeros(self.window)
+            self._counts[name] = 0
+            self._totals[name] = 0.0
+        self._samples[name][self._counts[name] % self.window] = seconds
+        self._counts[name] += 1
+        self._totals[name] += seconds
+
+    def add_log(self, log):
+        """
+        Record the stages and dropped frames of a StageLog, as if they had been recorded here
+        :param tuple log: from StageLog.pop()
+        """
+        stages, frames_dropped = log
+        for name, seconds in stages:
+            self.record(name, seconds)
+        if frames_dropped:
+            self.record_dropped(frames_dropped)
+
+    def record_frame(self):
+        """Count a handled frame"""
+        self._frame_times[self.frames % self.window] = time.time()
+        self.frames += 1
+
+    def record_dropped(self, count=1):
+        """Count frames that were not handled"""
+        self.frames_dropped += count
+
+    def set_queue_depth(self, depth):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    @property
+    def fps(self):
+        """Handled frames per second, over the window"""
+        count = min(self.frames, self.window)
+        if count < 2:
+            return 0.0
+        times = self._frame_times[:count]
+        elapsed = times.max() - times.min()
+        return (count - 1) / elapsed if elapsed > 0 else 0.0
+
+    def stage_summary(self, name):
+        """
+        :param str name: stage name
+        :return: dict with the count, mean, p50, p95, p99 and max latency in milliseconds
+        """
+        count = self._counts[name]
+        samples = self._samples[name][:min(count, self.window)] * 1000
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {
+            'count': count,
+            'mean_ms': self._totals[name] * 1000 / count,
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+            'max_ms': samples.max(),
+        }
+
+    def summary(self):
+        """
+        :return: dict of all metrics
+        """
+        return {
+            'uptime_s': time.time() - self.start_time,
+            'frames': self.frames,
+            'frames_dropped': self.frames_dropped,
+            'fps': self.fps,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'stages': {name: self.stage_summary(name) for name in self._samples},
+        }
+
+    def dump_csv(self, path):
+        """
+        Write the per stage summary to a csv file
+        :param str path: csv file
+        """
+        fields = ['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for name in self._samples:
+                row = self.stage_summary(name)
+                row['stage'] = name
+                writer.writerow(row)
+
+
+class StageLog(object):
+    """
+    Stage latencies and dropped frames recorded in one process, to be added to the
+    StageProfiler of another one with StageProfiler.add_log(), like the sessions of
+    worker processes do after every frame.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.frames_dropped = 0
+
+    # Same timing as a StageProfiler, into record() of the log
+    stage = StageProfiler.stage
+
+    def record(self, name, seconds):
+        """
+        :param str name: stage name
+        :param float seconds: latency of the stage
+        """
+        self.stages.append((name, seconds))
+
+    def record_dropped(self, count=1):
+        """Count frames that were not handled"""
+        self.frames_dropped += count
+
+    def pop(self):
+        """
+        :return: (stages, frames dropped) recorded since the previous call, for StageProfiler.add_log()
+        """
+        log = self.stages, self.frames_dropped
+        self.stages, self.frames_dropped = [], 0
+        return log
@@ -0,0 +1,206 @@
+"""
+Recording format for runs: a folder with a preallocated, memory-mapped store of raw
+uint8 frames, one memory-mapped array per telemetry column and a small json file
+with the number of recorded frames.
+
+Convert a simulator recording (IMG folder and robot_log.csv) from the code folder with:
+
+    python recording.py ../test_dataset/robot_log.csv ../test_dataset/recording
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from telemetry import TelemetryDecoder
+
+# Telemetry columns: name and shape of a row
+RECORDING_COLUMNS = (
+    ('time', ()),
+    ('pos', (2,)),
+    ('yaw', ()),
+    ('pitch', ()),
+    ('roll', ()),
+    ('speed', ()),
+    ('throttle', ()),
+    ('brake', ()),
+    ('steer', ()),
+)
+FRAMES_FILE = 'frames.npy'
+META_FILE = 'meta.json'
+
+
+class RecordingWriter(object):
+    """
+    Appends frames and telemetry to a recording.
+
+    The frame store and the columns are preallocated for capacity frames, frames
+    appended beyond it are dropped.  With background=True, append() only queues a
+    copy of the frame and a writer thread stores it.  The frame count on disk is
+    updated every meta_every frames and on close().
+    """
+    meta_every = 100
+
+    def __init__(self, path, capacity, frame_shape=(160, 320, 3), background=True, queue_size=64):
+        """
+        :param str path: recording folder, created if needed
+        :param int capacity: maximum number of frames
+        :param tuple frame_shape: shape of the uint8 frames
+        :param bool background: store frames from a writer thread
+        :param int queue_size: frames waiting to be stored before append() blocks
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.dropped = 0
+        self.frames = open_memmap(os.path.join(path, FRAMES_FILE), mode='w+', dtype=np.uint8,
+                                  shape=(capacity,) + tuple(frame_shape))
+        self.columns = {name: open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=np.float64,
+                                          shape=(capacity,) + shape)
+                        for name, shape in RECORDING_COLUMNS}
+        self._write_meta()
+        self._queue = None
+        if background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._run, name='recording-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def append(self, frame, telemetry):
+        """
+        :param np.ndarray frame: uint8 frame
+        :param dict telemetry: a value for every recording column
+        """
+        if self._queue is None:
+            self._store(frame, telemetry)
+        else:
+            self._queue.put((np.array(frame, copy=True), dict(telemetry)))
+
+    def close(self):
+        """Store the queued frames and flush the recording to disk"""
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+        self.frames.flush()
+        for column in self.columns.values():
+            column.flush()
+        self._write_meta()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._store(*item)
+
+    def _store(self, frame, telemetry):
+        if self.count >= self.capacity:
+            self.dropped += 1
+            return
+        self.frames[self.count] = frame
+        for name, column in self.columns.items():
+            column[self.count] = telemetry[name]
+        self.count += 1
+        if self.count % self.meta_every == 0:
+            self._write_meta()
+
+    def _write_meta(self):
+        meta = {'count': self.count, 'capacity': self.capacity, 'frame_shape': list(self.frames.shape[1:])}
+        temporary_path = os.path.join(self.path, META_FILE + '.tmp')
+        with open(temporary_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temporary_path, os.path.join(self.path, META_FILE))
+
+
+class Recording(object):
+    """
+    Read-only, memory-mapped view of a recording
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: recording folder
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            self.count = json.load(f)['count']
+        self.frames = np.load(os.path.join(path, FRAMES_FILE), mmap_mode='r')[:self.count]
+        self.columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')[:self.count]
+                        for name, _ in RECORDING_COLUMNS}
+
+    def __len__(self):
+        return self.count
+
+    def row(self, idx):
+        """
+        :param int idx: frame index
+        :return: dict with the telemetry of a frame
+        """
+        row = {name: float(column[idx]) for name, column in self.columns.items() if name != 'pos'}
+        row['pos'] = [float(value) for value in self.columns['pos'][idx]]
+        if np.isnan(row['time']):
+            row['time'] = None
+        return row
+
+    def iter_frames(self):
+        """
+        :return: generator of (telemetry dict, frame), frames are views of the memory map
+        """
+        for idx in range(self.count):
+            yield self.row(idx), self.frames[idx]
+
+
+def is_recording(path):
+    """
+    :param str path: a path
+    :return: True if path is a recording folder
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def convert_log(rows, path):
+    """
+    Convert frames of a simulator recording to the recording format
+    :param list rows: frames from replay.read_log()
+    :param str path: recording folder
+    :return: the number of converted frames
+    """
+    decoder = TelemetryDecoder()
+    writer = None
+    for row in rows:
+        with open(row['path'], 'rb') as f:
+            frame = decoder.decode_jpeg(f.read())
+        if writer is None:
+            writer = RecordingWriter(path, len(rows), frame.shape, background=False)
+        telemetry = dict(row)
+        if telemetry['time'] is None:
+            telemetry['time'] = np.nan
+        writer.append(frame, telemetry)
+    if writer is None:
+        return 0
+    writer.close()
+    return writer.count
+
+
+if __name__ == '__main__':
+    from replay import read_log
+
+    parser = argparse.ArgumentParser(description='Convert a simulator recording to the recording format')
+    parser.add_argument(
+        'log',
+        type=str,
+        help='Path to the recording log (robot_log.csv).'
+    )
+    parser.add_argument(
+        'output',
+        type=str,
+        help='Recording folder to create.'
+    )
+    args = parser.parse_args()
+
+    print("Converted {} frames".format(convert_log(read_log(args.log), args.output)))
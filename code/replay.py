@@ -0,0 +1,186 @@
+"""
+Replays a recorded drive through the perception and decision steps, without the simulator.
+
+Run it from the code folder, like drive_rover.py, on a recording log or on a folder
+in the recording format (see recording.py):
+
+    python replay.py ../test_dataset/robot_log.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import convert_to_float, render_output_images
+from image_encoding import encode_image
+from profiling import StageProfiler
+from recording import Recording, is_recording
+from rover_state import RoverState
+
+
+def frame_time(image_path):
+    """
+    Capture time of a recorded image, from its robocam_YYYY_MM_DD_HH_MM_SS_mmm.jpg name
+    :param str image_path: image path
+    :return: seconds since the epoch, or None if the name has no timestamp
+    """
+    stamp = os.path.splitext(os.path.basename(image_path))[0].split('_', 1)[-1]
+    try:
+        return (datetime.strptime(stamp[:-4], '%Y_%m_%d_%H_%M_%S') - datetime(1970, 1, 1)).total_seconds() \
+            + int(stamp[-3:]) / 1000.0
+    except ValueError:
+        return None
+
+
+def read_log(csv_path):
+    """
+    Read a recording log, as written by the simulator in training mode
+    :param str csv_path: robot_log.csv
+    :return: list of dicts with the image path and the telemetry of every frame
+    """
+    folder = os.path.dirname(os.path.abspath(csv_path))
+    rows = []
+    with open(csv_path) as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            path = row['Path']
+            # Paths are relative to where the recording was made, look next to the log otherwise
+            if not os.path.exists(path):
+                path = os.path.join(folder, 'IMG', os.path.basename(path))
+            rows.append({
+                'path': path,
+                'time': frame_time(path),
+                'steer': convert_to_float(row['SteerAngle']),
+                'throttle': convert_to_float(row['Throttle']),
+                'brake': convert_to_float(row['Brake']),
+                'speed': convert_to_float(row['Speed']),
+                'pos': [convert_to_float(row['X_Position']), convert_to_float(row['Y_Position'])],
+                'pitch': convert_to_float(row['Pitch']),
+                'yaw': convert_to_float(row['Yaw']),
+                'roll': convert_to_float(row['Roll']),
+            })
+    return rows
+
+
+def log_frames(csv_path):
+    """
+    Frames of a recording log
+    :param str csv_path: robot_log.csv
+    :return: generator of (telemetry dict, JPEG bytes)
+    """
+    for row in read_log(csv_path):
+        with open(row['path'], 'rb') as f:
+            yield row, f.read()
+
+
+def replay(frames, Rover=None, profiler=None, encode=False, frame_interval=0.04):
+    """
+    Run recorded frames through the perception and decision steps
+    :param frames: iterable of (telemetry dict, image), the image as JPEG bytes or an RGB array
+    :param RoverState Rover: the rover, a new one if None
+    :param StageProfiler profiler: profiler for the stage timings, a new one if None
+    :param bool encode: also encode the output images, like the simulator insets
+    :param float frame_interval: seconds between frames without a capture time
+    :return: the rover and the profiler
+    """
+    Rover = Rover if Rover is not None else RoverState()
+    profiler = profiler if profiler is not None else StageProfiler()
+    first_time = None
+    for idx, (row, image) in enumerate(frames):
+        profiler.record_frame()
+        with profiler.stage('update_rover'):
+            if row.get('time') is None:
+                row_time = idx * frame_interval
+            else:
+                row_time = row['time']
+            if first_time is None:
+                first_time = row_time
+                Rover.start_time = row_time
+            Rover.total_time = row_time - first_time
+            Rover.pos = list(row['pos'])
+            Rover.yaw = row['yaw']
+            Rover.pitch = row['pitch']
+            Rover.roll = row['roll']
+            Rover.vel = row['speed']
+            Rover.throttle = row['throttle']
+            Rover.brake = row['brake']
+            Rover.steer = row['steer']
+            if isinstance(image, bytes):
+                Rover.img = Rover.telemetry_decoder.decode_jpeg(image)
+            else:
+                Rover.img = image
+
+        with profiler.stage('perception_step'):
+            Rover = perception_step(Rover)
+        with profiler.stage('decision_step'):
+            Rover = decision_step(Rover)
+        with profiler.stage('create_output_images'):
+            output_images = render_output_images(Rover)
+            if encode:
+                for output_image in output_images:
+                    encode_image(output_image)
+    return Rover, profiler
+
+
+def report(Rover, profiler, elapsed):
+    """
+    :param RoverState Rover: the rover after the replay
+    :param StageProfiler profiler: the replay profiler
+    :param float elapsed: wall clock duration of the replay, in seconds
+    :return: dict with the throughput, stage timings and mapping results
+    """
+    return {
+        'frames': profiler.frames,
+        'elapsed_s': elapsed,
+        'fps': profiler.frames / elapsed if elapsed > 0 else 0.0,
+        'stages': {name: profiler.stage_summary(name) for name in profiler.summary()['stages']},
+        'mapped_percent': Rover.map_stats.perc_mapped,
+        'fidelity_percent': Rover.map_stats.fidelity,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded drive without the simulator')
+    parser.add_argument(
+        'log',
+        type=str,
+        help='Path to the recording log (robot_log.csv) or to a recording folder.'
+    )
+    parser.add_argument(
+        '--encode',
+        action='store_true',
+        help='Also encode the output images, like the simulator insets.'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the report as json.'
+    )
+    parser.add_argument(
+        '--min_fps',
+        type=float,
+        default=0,
+        help='Exit with an error if the replay runs slower than this many frames per second.'
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    frames = Recording(args.log).iter_frames() if is_recording(args.log) else log_frames(args.log)
+    Rover, profiler = replay(frames, encode=args.encode)
+    results = report(Rover, profiler, time.time() - start)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("Frames: {frames}, {elapsed_s:.2f} s, {fps:.1f} frames/s".format(**results))
+        for name, stage in results['stages'].items():
+            print("  {:<22} mean {mean_ms:7.2f} ms  p50 {p50_ms:7.2f} ms  p95 {p95_ms:7.2f} ms  "
+                  "p99 {p99_ms:7.2f} ms".format(name, **stage))
+        print("Mapped: {mapped_percent}%, Fidelity: {fidelity_percent}%".format(**results))
+    if results['fps'] < args.min_fps:
+        print("Replay ran at {:.1f} frames/s, below --min_fps {}".format(results['fps'], args.min_fps))
+        sys.exit(1)
@@ -1,6 +1,13 @@
 import numpy as np
 
 import matplotlib.image as mpimg
+
+from world_map import TiledWorldMap, MapStatistics
+from telemetry import TelemetryDecoder
+from planner import FrontierPlanner
+from buffers import BufferPool
+from map_renderer import MapRenderer
+
 # Read in ground truth map and create 3-channel green version for overplotting
 # NOTE: images are read in by default with the origin (0, 0) in the upper left
 # and y-axis increasing downward.
@@ -16,6 +23,7 @@ class RoverState():
         self.start_time = None # To record the start time of navigation
         self.total_time = None # To record total duration of navigation
         self.img = None # Current camera image
+        self.telemetry_decoder = TelemetryDecoder() # Decodes telemetry, reusing the camera image buffer
         self.pos = None # Current position (x, y)
         self.seconds_for_being_stuck = 7  # How many seconds at the same place for considering that the rover is stuck
         self.pos_every_second = np.full((self.seconds_for_being_stuck, 3), -1, dtype=float)  # Position every second % size
@@ -29,6 +37,7 @@ class RoverState():
         self.nav_angles = None # Angles of navigable terrain pixels
         self.nav_dists = None # Distances of navigable terrain pixels
         self.ground_truth = ground_truth_3d # Ground truth worldmap
+        self.map_renderer = MapRenderer(self.ground_truth) # Renders the worldmap inset incrementally
         self.mode = 'forward' # Current mode (can be forward or stop)
         self.throttle_set = 0.2 # Throttle setting when accelerating
         self.brake_set = 10 # Brake setting when braking
@@ -39,15 +48,25 @@ class RoverState():
         self.stop_forward = 50 # Threshold to initiate stopping
         self.go_forward = 500 # Threshold to go forward again
         self.max_vel = 2.2 # Maximum velocity (meters/second)
+        self.terrain_thresholds = None # Color thresholds of the terrain classes, perception.TERRAIN_THRESHOLDS if None
         # Image output from perception step
         # Update this image to display your intermediate analysis steps
         # on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=np.float)
+        self.vision_image = np.zeros((160, 320, 3), dtype=np.uint8)
         # Worldmap
         # Update this image with the positions of navigable terrain
         # obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=np.float)
+        self.buffers = BufferPool() # Arrays of the perception and render steps, reused from frame to frame
+        self.world_map = TiledWorldMap(200, 200) # Dense over the ground truth extent, tiles beyond it
+        self.worldmap = self.world_map.grid
+        self.map_stats = MapStatistics(ground_truth)
+        self.planner = FrontierPlanner(self.worldmap.shape) # Plans to the nearest unexplored frontier, None to not plan
+        self.waypoint = None # Waypoint towards the nearest frontier (x, y), None without a plan
+        self.waypoint_window = 0.35 # Navigable terrain within this many radians of the waypoint bearing is followed
+        self.waypoint_cooldown = 15 # Seconds to ignore the waypoint after getting stuck
+        self.waypoint_ignore_until = None
         self.samples_pos = None # To store the actual sample positions
+        self.sample_index = None # Index of the sample positions, for confirming rock detections
         self.samples_to_find = 0 # To store the initial count of samples
         self.samples_located = 0 # To store number of samples located on map
         self.samples_collected = 0 # To count the number of samples collected
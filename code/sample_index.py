@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class SampleIndex(object):
+    """
+    Known rock sample positions, indexed by world cell.
+
+    Every world cell holds the bitset of the samples it is close enough to for a rock
+    detection there to confirm them, so each newly observed rock cell is matched with
+    a single lookup.  Confirmed and picked up samples are kept as bitsets as well.
+    """
+    # Rock detections within this distance (in meters) of a sample confirm it
+    confirm_distance = 3
+    # Picked up positions within this distance of a sample mark it as collected
+    picked_up_distance = 3
+    max_samples = 64
+
+    def __init__(self, samples_x, samples_y, map_shape):
+        """
+        :param np.ndarray samples_x: x of the known samples
+        :param np.ndarray samples_y: y of the known samples
+        :param tuple map_shape: (rows, cols) of the worldmap
+        """
+        self.samples_x = np.asarray(samples_x)
+        self.samples_y = np.asarray(samples_y)
+        self.sample_count = len(self.samples_x)
+        if self.sample_count > self.max_samples:
+            raise ValueError("At most {} samples are supported, got {}".format(self.max_samples, self.sample_count))
+        self.map_shape = tuple(map_shape[:2])
+        self.cover = np.zeros(self.map_shape, dtype=np.uint64)
+        rows, cols = np.mgrid[0:self.map_shape[0], 0:self.map_shape[1]]
+        for idx in range(self.sample_count):
+            near = (self.samples_x[idx] - cols) ** 2 + (self.samples_y[idx] - rows) ** 2 < self.confirm_distance ** 2
+            self.cover[near] |= np.uint64(1 << idx)
+        self._cover_cells = self.cover.reshape(-1)
+        self._rock_seen = np.zeros(self._cover_cells.shape, dtype=bool)
+        self.confirmed = 0
+        self.picked_up = 0
+        self.located = 0
+        self._picked_up_synced = 0
+
+    def observe(self, cells):
+        """
+        Match rock detections against the known samples, each cell only the first time it is seen
+        :param np.ndarray cells: flat (row * cols + col) worldmap cells with rock detections
+        """
+        cells = cells[~self._rock_seen[cells]]
+        if len(cells) == 0:
+            return
+        self._rock_seen[cells] = True
+        hits = int(np.bitwise_or.reduce(self._cover_cells[cells]))
+        if hits & ~self.confirmed:
+            self.confirmed |= hits
+            self.located = bin(self.confirmed).count('1')
+
+    def sync_picked_up(self, picked_up_positions):
+        """
+        Mark samples near positions that were picked up since the previous call
+        :param list picked_up_positions: all (x, y) picked up positions, appended to only
+        """
+        for px, py in picked_up_positions[self._picked_up_synced:]:
+            near = np.sqrt((self.samples_x - px) ** 2 + (self.samples_y - py) ** 2) <= self.picked_up_distance
+            for idx in near.nonzero()[0]:
+                self.picked_up |= 1 << int(idx)
+        self._picked_up_synced = len(picked_up_positions)
+
+    def confirmed_samples(self):
+        """
+        :return: indexes of the confirmed samples
+        """
+        return [idx for idx in range(self.sample_count) if self.confirmed >> idx & 1]
+
+    def active_sample(self, pos, max_distance=10):
+        """
+        Confirmed sample, not picked up yet, within max_distance of a position
+        :param pos: (x, y) position of the rover
+        :param float max_distance: distance in meters
+        :return: (x, y) of the sample, or None
+        """
+        active = None
+        candidates = self.confirmed & ~self.picked_up
+        for idx in range(self.sample_count):
+            if not candidates >> idx & 1:
+                continue
+            sample_x, sample_y = self.samples_x[idx], self.samples_y[idx]
+            if np.sqrt((sample_x - pos[0]) ** 2 + (sample_y - pos[1]) ** 2) < max_distance:
+                active = (sample_x, sample_y)
+        return active
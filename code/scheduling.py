@@ -0,0 +1,73 @@
+import time
+
+
+class LatestFrameScheduler(object):
+    """
+    Runs the telemetry handling of every session on the freshest frame only.
+
+    submit() keeps a single pending frame per session, a frame that arrives before
+    the previous one was picked up replaces it and is counted as skipped.  Each
+    session is drained by one worker spawned with spawn (e.g. eventlet.spawn_n), so
+    commands are never computed from a stale backlog.  When handling a frame took
+    longer than frame_budget seconds, the next one is handled degraded (the
+    handler decides what to leave out, e.g. the inset images).
+    """
+
+    def __init__(self, process, spawn, profiler=None, frame_budget=None):
+        """
+        :param process: called with (sid, data, degraded) for each frame that is handled
+        :param spawn: starts process in the background, called with (function, sid)
+        :param StageProfiler profiler: records skipped frames and the pending frame count
+        :param float frame_budget: seconds per frame before handling degrades, None to never degrade
+        """
+        self.process = process
+        self.spawn = spawn
+        self.profiler = profiler
+        self.frame_budget = frame_budget
+        self.skipped = 0
+        self.degraded = 0
+        self._pending = {}
+        self._draining = set()
+        self._overloaded = set()
+
+    def submit(self, sid, data):
+        """
+        :param sid: session id
+        :param dict data: telemetry
+        """
+        if sid in self._pending:
+            self.skipped += 1
+            if self.profiler is not None:
+                self.profiler.record_dropped()
+        self._pending[sid] = data
+        if self.profiler is not None:
+            self.profiler.set_queue_depth(len(self._pending))
+        if sid not in self._draining:
+            self._draining.add(sid)
+            self.spawn(self._drain, sid)
+
+    def discard(self, sid):
+        """
+        Forget a session, e.g. on disconnect
+        :param sid: session id
+        """
+        self._pending.pop(sid, None)
+        self._overloaded.discard(sid)
+
+    def _drain(self, sid):
+        try:
+            while sid in self._pending:
+                data = self._pending.pop(sid)
+                if self.profiler is not None:
+                    self.profiler.set_queue_depth(len(self._pending))
+                degraded = sid in self._overloaded
+                if degraded:
+                    self.degraded += 1
+                start = time.time()
+                self.process(sid, data, degraded)
+                if self.frame_budget is not None and time.time() - start > self.frame_budget:
+                    self._overloaded.add(sid)
+                else:
+                    self._overloaded.discard(sid)
+        finally:
+            self._draining.discard(sid)
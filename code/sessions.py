@@ -0,0 +1,302 @@
+"""
+Per connection state of the controller: every connected simulator gets its own
+rover, inset encoder and optional snapshot and recording writers.  Sessions run
+in the server process (Sessions) or are spread over worker processes (SessionWorkers).
+"""
+import multiprocessing
+import os
+import signal
+from datetime import datetime
+
+import numpy as np
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import update_rover, update_frame_state, render_output_images, render_fidelity_map
+from profiling import StageProfiler, StageLog
+
+
+def numbered_path(path, index):
+    """
+    :param str path: a file or folder path
+    :param int index: session index
+    :return: path for the session, path itself for the first session
+    """
+    if index == 0:
+        return path
+    # Without a trailing separator, so that a folder is numbered rather than given a subfolder
+    root, extension = os.path.splitext(path.rstrip('/' + os.sep))
+    return '{}_{}{}'.format(root, index, extension)
+
+
+def control_data(commands, image_string1, image_string2):
+    """
+    :param tuple commands: throttle, brake and steering angle
+    :param str image_string1: base64 encoded worldmap inset
+    :param str image_string2: base64 encoded vision inset
+    :return: payload of the 'data' event
+    """
+    return {
+        'throttle': commands[0].__str__(),
+        'brake': commands[1].__str__(),
+        'steering_angle': commands[2].__str__(),
+        'inset_image1': image_string1,
+        'inset_image2': image_string2,
+        }
+
+
+class Session(object):
+    """
+    State of one connected simulator
+    """
+
+    def __init__(self, Rover, inset_encoder, snapshot_writer=None, recording_writer=None, image_folder='',
+                 profiler=None, checkpoint_writer=None):
+        """
+        :param RoverState Rover: the rover
+        :param InsetEncoder inset_encoder: encoder of the inset images
+        :param SnapshotWriter snapshot_writer: writer of the fidelity map snapshots, None for no snapshots
+        :param RecordingWriter recording_writer: writer of the recording, None to not record
+        :param str image_folder: folder to save the camera images to, '' to not save them
+        :param StageProfiler profiler: profiler for the stage timings, a new one if None
+        :param CheckpointWriter checkpoint_writer: writer of the checkpoints, None to not checkpoint
+        """
+        self.Rover = Rover
+        self.inset_encoder = inset_encoder
+        self.snapshot_writer = snapshot_writer
+        self.recording_writer = recording_writer
+        self.checkpoint_writer = checkpoint_writer
+        self.image_folder = image_folder
+        self.profiler = profiler if profiler is not None else StageProfiler()
+
+    def step(self, data, degraded=False):
+        """
+        Update the rover with telemetry and run the perception and decision steps
+        :param dict data: telemetry
+        :param bool degraded: the previous frame took too long, do only what is needed for the commands
+        :return: event and payload to send back to the simulator
+        """
+        profiler = self.profiler
+        # Initialize / update Rover with current telemetry
+        with profiler.stage('update_rover'):
+            self.Rover, jpeg = update_rover(self.Rover, data)
+        Rover = self.Rover
+
+        if np.isfinite(Rover.vel):
+
+            # Execute the perception and decision steps to update the Rover's state
+            with profiler.stage('perception_step'):
+                Rover = self.Rover = perception_step(Rover)
+            with profiler.stage('decision_step'):
+                Rover = self.Rover = decision_step(Rover)
+
+            # Create output images to send to server, they are encoded in the background
+            # and the commands go out with the latest ones that are ready
+            # When overloaded, skip rendering and resend the previous images
+            with profiler.stage('create_output_images'):
+                if not degraded:
+                    self.inset_encoder.submit(render_output_images(Rover))
+                else:
+                    # The map state and the frame count stay current, only the inset images are not rendered
+                    update_frame_state(Rover)
+                out_image_string1, out_image_string2 = self.inset_encoder.latest()
+                # Save the fidelity map when due, written to disk in the background
+                if self.snapshot_writer is not None:
+                    self.snapshot_writer.maybe_submit(Rover.image_generation_counter,
+                                                      lambda: render_fidelity_map(Rover))
+                # Checkpoint the run when due, written to disk in the background
+                if self.checkpoint_writer is not None:
+                    self.checkpoint_writer.maybe_submit(Rover.image_generation_counter, Rover)
+
+            # Don't send both of these, they both trigger the simulator
+            # to send back new telemetry so we must only send one
+            # back in respose to the current telemetry data.
+
+            # If in a state where want to pickup a rock send pickup command
+            if Rover.send_pickup and not Rover.picking_up:
+                # Reset Rover flags
+                Rover.send_pickup = False
+                reply = ('pickup', {})
+            else:
+                commands = (Rover.throttle, Rover.brake, Rover.steer)
+                reply = ('data', control_data(commands, out_image_string1, out_image_string2))
+
+        # In case of invalid telemetry, send null commands
+        else:
+            profiler.record_dropped()
+
+            # Send zeros for throttle, brake and steer and empty images
+            reply = ('data', control_data((0, 0, 0), '', ''))
+
+        # Conditional to save image frame if folder was specified
+        if self.image_folder != '':
+            with profiler.stage('record_image'):
+                timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+                image_filename = os.path.join(self.image_folder, timestamp)
+                with open('{}.jpg'.format(image_filename), 'wb') as f:
+                    f.write(jpeg)
+        # Or to a memory-mapped recording, written in the background
+        if self.recording_writer is not None:
+            with profiler.stage('record_image'):
+                self.recording_writer.append(Rover.img, {
+                    'time': Rover.total_time, 'pos': Rover.pos, 'yaw': Rover.yaw, 'pitch': Rover.pitch,
+                    'roll': Rover.roll, 'speed': Rover.vel, 'throttle': Rover.throttle, 'brake': Rover.brake,
+                    'steer': Rover.steer})
+        return reply
+
+    def close(self):
+        self.Rover.telemetry_decoder.close()
+        self.inset_encoder.close()
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()
+        if self.recording_writer is not None:
+            self.recording_writer.close()
+        if self.checkpoint_writer is not None:
+            # A last checkpoint, to resume from where the run stopped
+            if self.Rover.start_time is not None:
+                self.checkpoint_writer.submit(self.Rover, block=True)
+            self.checkpoint_writer.close()
+
+
+class Sessions(object):
+    """
+    Sessions by session id, run in this process
+    """
+
+    def __init__(self, create_session):
+        """
+        :param create_session: called with the index of a new session, returns its Session
+        """
+        self.create_session = create_session
+        self.opened = 0
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __getitem__(self, sid):
+        return self._sessions[sid]
+
+    def open(self, sid):
+        """
+        :param sid: session id
+        """
+        if sid not in self._sessions:
+            self._sessions[sid] = self.create_session(self.opened)
+            self.opened += 1
+
+    def step(self, sid, data, degraded=False):
+        """
+        :param sid: session id, opened if needed
+        :return: see Session.step()
+        """
+        self.open(sid)
+        return self._sessions[sid].step(data, degraded)
+
+    def close(self, sid):
+        """
+        :param sid: session id
+        """
+        session = self._sessions.pop(sid, None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        for sid in list(self._sessions):
+            self.close(sid)
+
+
+# Sessions of a worker process and the function that creates them
+_worker_sessions = None
+
+
+def _init_worker(create_session):
+    global _worker_sessions
+    # Ctrl-C stops the server, which closes the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_sessions = Sessions(create_session)
+
+
+def _open_in_worker(sid, index):
+    _worker_sessions.opened = index
+    _worker_sessions.open(sid)
+    # The stages are logged per frame and sent back with the reply, the server profiles all sessions
+    _worker_sessions[sid].profiler = StageLog()
+
+
+def _step_in_worker(sid, data, degraded):
+    reply = _worker_sessions.step(sid, data, degraded)
+    return reply, _worker_sessions[sid].profiler.pop()
+
+
+def _close_in_worker(sid):
+    _worker_sessions.close(sid)
+
+
+class SessionWorkers(object):
+    """
+    Sessions by session id, spread over worker processes.
+
+    Every session stays in the worker process it was opened in, new sessions go to
+    the worker with the fewest sessions.  Only the telemetry and the replies cross
+    process boundaries, the rovers live in the workers.  The stage latencies of
+    every frame come back with its reply and are recorded in profiler.
+    """
+
+    def __init__(self, create_session, workers=2, wait=None, profiler=None):
+        """
+        :param create_session: called in a worker with the index of a new session, returns its Session
+        :param int workers: number of worker processes
+        :param wait: called with an AsyncResult, returns its value.  In an eventlet server
+            use eventlet.tpool.execute(result.get), so other green threads run meanwhile
+        :param StageProfiler profiler: profiler for the stages of the sessions, a new one if None
+        """
+        # One single process pool per worker, so that a session always runs in the same process
+        self.pools = [multiprocessing.Pool(1, initializer=_init_worker, initargs=(create_session,))
+                      for _ in range(workers)]
+        self.wait = wait if wait is not None else lambda result: result.get()
+        self.profiler = profiler if profiler is not None else StageProfiler()
+        self.opened = 0
+        self._workers = {}
+
+    def __len__(self):
+        return len(self._workers)
+
+    def open(self, sid):
+        """
+        :param sid: session id
+        """
+        if sid in self._workers:
+            return
+        loads = [0] * len(self.pools)
+        for worker in self._workers.values():
+            loads[worker] += 1
+        worker = loads.index(min(loads))
+        self._workers[sid] = worker
+        self.wait(self.pools[worker].apply_async(_open_in_worker, (sid, self.opened)))
+        self.opened += 1
+
+    def step(self, sid, data, degraded=False):
+        """
+        :param sid: session id, opened if needed
+        :return: see Session.step()
+        """
+        self.open(sid)
+        reply, log = self.wait(self.pools[self._workers[sid]].apply_async(_step_in_worker, (sid, data, degraded)))
+        self.profiler.add_log(log)
+        return reply
+
+    def close(self, sid):
+        """
+        :param sid: session id
+        """
+        worker = self._workers.pop(sid, None)
+        if worker is not None:
+            self.wait(self.pools[worker].apply_async(_close_in_worker, (sid,)))
+
+    def close_all(self):
+        for sid in list(self._workers):
+            self.close(sid)
+        for pool in self.pools:
+            pool.close()
+            pool.join()
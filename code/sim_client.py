@@ -0,0 +1,254 @@
+"""
+Headless stand-in for the simulator in autonomous mode, to load test drive_rover.py.
+
+Every connection sends telemetry with the frames of a recorded drive over socket.io
+and consumes the 'data' and 'pickup' replies.  By default a connection sends its next
+frame when the reply to the previous one arrives, like the simulator.  With --rate
+it sends at a fixed rate instead, whether replies keep up or not.  Needs the
+python-socketio client dependencies (requests and websocket-client).
+
+Start drive_rover.py, then from the code folder:
+
+    python sim_client.py ../test_dataset/robot_log.csv --connections 4
+"""
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+import socketio
+
+from replay import read_log
+from recording import Recording, is_recording
+from kinematic_sim import sample_positions
+
+
+def load_frames(path, max_frames=None):
+    """
+    Frames of a recorded drive, with the camera images as base64 JPEG strings like the simulator sends them
+    :param str path: recording log (robot_log.csv) or recording folder
+    :param int max_frames: maximum number of frames to load, None for all
+    :return: list of (telemetry dict, base64 image)
+    """
+    frames = []
+    if is_recording(path):
+        recording = Recording(path)
+        for idx in range(min(len(recording), max_frames or len(recording))):
+            ok, jpeg = cv2.imencode('.jpg', cv2.cvtColor(recording.frames[idx], cv2.COLOR_RGB2BGR))
+            frames.append((recording.row(idx), base64.b64encode(jpeg).decode('utf-8')))
+    else:
+        for row in read_log(path)[:max_frames]:
+            with open(row['path'], 'rb') as f:
+                frames.append((row, base64.b64encode(f.read()).decode('utf-8')))
+    return frames
+
+
+def telemetry(row, image, samples, samples_left):
+    """
+    :param dict row: recorded telemetry
+    :param str image: base64 JPEG camera image
+    :param tuple samples: x and y positions of the rock samples
+    :param int samples_left: number of samples not picked up yet
+    :return: telemetry dict, as the simulator sends it
+    """
+    return {
+        'speed': str(row['speed']),
+        'position': '{};{}'.format(*row['pos']),
+        'yaw': str(row['yaw']),
+        'pitch': str(row['pitch']),
+        'roll': str(row['roll']),
+        'throttle': str(row['throttle']),
+        'steering_angle': str(row['steer']),
+        'near_sample': '0',
+        'picking_up': '0',
+        'sample_count': str(samples_left),
+        'samples_x': ';'.join(str(value) for value in samples[0]),
+        'samples_y': ';'.join(str(value) for value in samples[1]),
+        'image': image,
+    }
+
+
+class SimulatorConnection(object):
+    """
+    One simulator: sends telemetry and times the replies.
+
+    The round trip is the time from sending a frame to the next reply.  At a fixed
+    rate the server may skip frames, then it is measured to the latest frame sent.
+    """
+
+    def __init__(self, url, frames, samples, rate=0, reply_timeout=5):
+        """
+        :param str url: drive_rover.py server
+        :param list frames: frames from load_frames(), sent in a loop
+        :param tuple samples: x and y positions of the rock samples
+        :param float rate: frames per second, 0 to send a frame per reply
+        :param float reply_timeout: seconds to wait for a reply before sending the next frame anyway
+        """
+        self.url = url
+        self.frames = frames
+        self.samples = samples
+        self.rate = rate
+        self.reply_timeout = reply_timeout
+        self.round_trips = []
+        self.sent = 0
+        self.replies = 0
+        self.pickups = 0
+        self.timeouts = 0
+        self.inset_bytes = 0
+        self._sent_time = None
+        self._reply = threading.Event()
+        self.client = socketio.Client()
+        self.client.on('data', self._on_data)
+        self.client.on('pickup', self._on_pickup)
+
+    def _on_reply(self):
+        # The reply to the connection is not to a frame
+        if self._sent_time is not None:
+            self.round_trips.append(time.time() - self._sent_time)
+            self.replies += 1
+        self._reply.set()
+
+    def _on_data(self, data):
+        self.inset_bytes += len(data.get('inset_image1', '')) + len(data.get('inset_image2', ''))
+        self._on_reply()
+
+    def _on_pickup(self, data):
+        self.pickups += 1
+        self._on_reply()
+
+    def run(self, duration):
+        """
+        Connect, send frames for duration seconds and disconnect
+        :param float duration: seconds
+        """
+        self.client.connect(self.url)
+        # The server greets with zero commands
+        self._reply.wait(self.reply_timeout)
+        start = time.time()
+        try:
+            while time.time() - start < duration:
+                row, image = self.frames[self.sent % len(self.frames)]
+                self._reply.clear()
+                self._sent_time = time.time()
+                self.client.emit('telemetry', telemetry(row, image, self.samples, len(self.samples[0])))
+                self.sent += 1
+                if self.rate > 0:
+                    time.sleep(max(start + self.sent / self.rate - time.time(), 0))
+                elif not self._reply.wait(self.reply_timeout):
+                    self.timeouts += 1
+        finally:
+            self.client.disconnect()
+
+
+def run_connections(url, frames, connections=1, duration=10, rate=0, samples=6):
+    """
+    Run simulator connections in parallel
+    :param str url: drive_rover.py server
+    :param list frames: frames from load_frames()
+    :param int connections: number of simulators
+    :param float duration: seconds every simulator sends frames for
+    :param float rate: frames per second per simulator, 0 to send a frame per reply
+    :param int samples: number of rock samples
+    :return: report dict
+    """
+    sims = [SimulatorConnection(url, frames, sample_positions(samples, seed), rate) for seed in range(connections)]
+    threads = [threading.Thread(target=sim.run, args=(duration,)) for sim in sims]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    round_trips = np.array([round_trip for sim in sims for round_trip in sim.round_trips] or [0]) * 1000
+    replies = sum(sim.replies for sim in sims)
+    return {
+        'connections': connections,
+        'elapsed_s': elapsed,
+        'sent': sum(sim.sent for sim in sims),
+        'replies': replies,
+        'pickups': sum(sim.pickups for sim in sims),
+        'timeouts': sum(sim.timeouts for sim in sims),
+        'replies_per_s': replies / elapsed if elapsed > 0 else 0.0,
+        'inset_kb_per_reply': sum(sim.inset_bytes for sim in sims) / 1024.0 / max(replies, 1),
+        'round_trip_ms': dict(zip(['p50', 'p95', 'p99', 'max'],
+                                  np.percentile(round_trips, [50, 95, 99, 100]).tolist())),
+        'per_connection_replies_per_s': [sim.replies / duration for sim in sims],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless simulator stand-in to load test drive_rover.py')
+    parser.add_argument(
+        'log',
+        type=str,
+        help='Path to the recording log (robot_log.csv) or to a recording folder.'
+    )
+    parser.add_argument(
+        '--url',
+        type=str,
+        default='http://localhost:4567',
+        help='drive_rover.py server.'
+    )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=1,
+        help='Number of simulators connecting in parallel.'
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=10,
+        help='Seconds every simulator sends frames for.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=0,
+        help='Frames per second per simulator, 0 to send the next frame when the reply arrives.'
+    )
+    parser.add_argument(
+        '--frames',
+        type=int,
+        default=500,
+        help='Number of recorded frames to load, they are sent in a loop.'
+    )
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=6,
+        help='Number of rock samples reported to the server.'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the report as json.'
+    )
+    parser.add_argument(
+        '--min_replies_per_s',
+        type=float,
+        default=0,
+        help='Exit with an error if the total reply rate is below this.'
+    )
+    args = parser.parse_args()
+
+    results = run_connections(args.url, load_frames(args.log, args.frames), args.connections, args.duration,
+                              args.rate, args.samples)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("Connections: {connections}, {elapsed_s:.2f} s, sent {sent}, replies {replies} "
+              "({replies_per_s:.1f}/s), pickups {pickups}, timeouts {timeouts}".format(**results))
+        print("Round trip: p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms  max {max:.2f} ms".format(
+            **results['round_trip_ms']))
+        print("Inset images: {inset_kb_per_reply:.1f} kB per reply".format(**results))
+    if results['replies_per_s'] < args.min_replies_per_s:
+        print("Replies at {:.1f}/s, below --min_replies_per_s {}".format(results['replies_per_s'],
+                                                                        args.min_replies_per_s))
+        sys.exit(1)
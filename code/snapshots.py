@@ -0,0 +1,47 @@
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from background_writer import BackgroundWriter, replace_file
+
+
+class SnapshotWriter(BackgroundWriter):
+    """
+    Writes image snapshots (the fidelity map) to disk on a background thread.
+
+    A snapshot is taken every every_n_frames frames and/or every interval seconds,
+    queued without blocking (it is dropped if the queue is full) and written to a
+    temporary file that atomically replaces path.  With keep > 0, the last keep
+    snapshots are also kept as numbered files next to it.
+    """
+
+    def __init__(self, path, every_n_frames=250, interval=None, keep=0, queue_size=2):
+        """
+        :param str path: snapshot file
+        :param int every_n_frames: take a snapshot every N frames, 0 to only use interval
+        :param float interval: take a snapshot every interval seconds, None to only use every_n_frames
+        :param int keep: number of numbered snapshots to keep, 0 for none
+        :param int queue_size: snapshots waiting to be written before new ones are dropped
+        """
+        self.path = path
+        self.keep = keep
+        super(SnapshotWriter, self).__init__(every_n_frames, interval, queue_size, name='snapshot-writer')
+
+    def payload(self, render):
+        """
+        :param render: called without arguments to get the uint8 RGB image, only when a snapshot is due
+        :return: the image
+        """
+        return render()
+
+    def write(self, image):
+        buff = BytesIO()
+        Image.fromarray(image).save(buff, format="PNG")
+        replace_file(self.path, buff.getvalue())
+        if self.keep:
+            root, extension = os.path.splitext(self.path)
+            replace_file('{}_{:06d}{}'.format(root, self.written, extension), buff.getvalue())
+            expired = '{}_{:06d}{}'.format(root, self.written - self.keep, extension)
+            if self.written >= self.keep and os.path.exists(expired):
+                os.remove(expired)
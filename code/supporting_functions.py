@@ -1,11 +1,8 @@
 import numpy as np
-import cv2
-from PIL import Image
-from io import BytesIO, StringIO
-import base64
-import time
-import matplotlib.image as mpimg
 from rover_state import RoverState
+from world_map import ROCK_CHANNEL
+from sample_index import SampleIndex
+from image_encoding import encode_image
 
 
 # Define a function to convert telemetry strings to float independent of decimal convention
@@ -18,54 +15,19 @@ def convert_to_float(string_to_convert):
 
 
 def update_rover(Rover, data):
-    # Initialize start time and sample positions
-    if Rover.start_time == None:
-        Rover.start_time = time.time()
-        Rover.total_time = 0
-        samples_xpos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_x"].split(';')])
-        samples_ypos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_y"].split(';')])
-        Rover.samples_pos = (samples_xpos, samples_ypos)
-        Rover.samples_to_find = np.int(data["sample_count"])
-    # Or just update elapsed time
-    else:
-        tot_time = time.time() - Rover.start_time
-        if np.isfinite(tot_time):
-            Rover.total_time = tot_time
-    # Print out the fields in the telemetry data dictionary
-    print(data.keys())
-    # The current speed of the rover in m/s
-    Rover.vel = convert_to_float(data["speed"])
-    # The current position of the rover
-    Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
-    # The current yaw angle of the rover
-    Rover.yaw = convert_to_float(data["yaw"])
-    # The current yaw angle of the rover
-    Rover.pitch = convert_to_float(data["pitch"])
-    # The current yaw angle of the rover
-    Rover.roll = convert_to_float(data["roll"])
-    # The current throttle setting
-    Rover.throttle = convert_to_float(data["throttle"])
-    # The current steering angle
-    Rover.steer = convert_to_float(data["steering_angle"])
-    # Near sample flag
-    Rover.near_sample = np.int(data["near_sample"])
-    # Picking up flag
-    Rover.picking_up = np.int(data["picking_up"])
-    # Update number of rocks collected
-    Rover.samples_collected = Rover.samples_to_find - np.int(data["sample_count"])
-
-    print('speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
-          Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
-          'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup,
-          'total time:', Rover.total_time, 'samples remaining:', data["sample_count"],
-          'samples collected:', Rover.samples_collected)
-    # Get the current image from the center camera of the rover
-    imgString = data["image"]
-    image = Image.open(BytesIO(base64.b64decode(imgString)))
-    Rover.img = np.asarray(image)
-
-    # Return updated Rover and separate image for optional saving
-    return Rover, image
+    """
+    Update the rover with telemetry
+    :param RoverState Rover: the rover
+    :param dict data: telemetry
+    :return: the rover and the JPEG bytes of the camera image, for optional saving
+    """
+    first_telemetry = Rover.start_time is None
+    jpeg = Rover.telemetry_decoder.decode(Rover, data)
+    if first_telemetry:
+        Rover.sample_index = SampleIndex(Rover.samples_pos[0], Rover.samples_pos[1], Rover.worldmap.shape)
+
+    # Return updated Rover and the camera image for optional saving
+    return Rover, jpeg
 
 
 # Define a function to create display output given worldmap results
@@ -73,133 +35,67 @@ def create_output_images(Rover):
     """
     Creates output images
     :param RoverState Rover:
-    :return:
+    :return: base64 encoded map and vision images
+    """
+    map_image, vision_image = render_output_images(Rover)
+    return encode_image(map_image), encode_image(vision_image)
+
+
+def update_map_state(Rover):
+    """
+    Update the rock sample search and the map statistics from the worldmap cells updated since the last call
+    :param RoverState Rover:
+    """
+    updated = Rover.world_map.pop_updated()
+    # Confirm rock detections observed since the last frame against the known sample positions
+    if Rover.sample_index is not None:
+        channels = Rover.worldmap.shape[2]
+        Rover.sample_index.observe(updated[updated % channels == ROCK_CHANNEL] // channels)
+        Rover.sample_index.sync_picked_up(Rover.picked_up_sample_position)
+        Rover.samples_located = Rover.sample_index.located
+
+        active_sample_position = Rover.sample_index.active_sample(Rover.pos)
+        if active_sample_position is not None:
+            Rover.active_sample_position = active_sample_position
+            if Rover.active_sample_start_time is None and \
+                    (Rover.active_sample_search_ignore_until is None or Rover.active_sample_search_ignore_until < Rover.total_time):
+                print("Adding SAMPLE")
+                Rover.active_sample_start_time = Rover.total_time
+                Rover.active_sample_search_started = True
+
+    # Statistics on the map results, updated from the cells observed since the last frame
+    Rover.map_stats.update(updated)
+
+
+def update_frame_state(Rover):
+    """
+    Count the frame and update the map state, every frame needs it whether its output images are rendered or not
+    :param RoverState Rover:
     """
     Rover.image_generation_counter += 1
-    # Create a scaled map for plotting and clean up obs/nav pixels a bit
-    if np.max(Rover.worldmap[:, :, 2]) > 0:
-        nav_pix = Rover.worldmap[:, :, 2] > 0
-        navigable = Rover.worldmap[:, :, 2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
-    else:
-        navigable = Rover.worldmap[:, :, 2]
-    if np.max(Rover.worldmap[:, :, 0]) > 0:
-        obs_pix = Rover.worldmap[:, :, 0] > 0
-        obstacle = Rover.worldmap[:, :, 0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
-    else:
-        obstacle = Rover.worldmap[:, :, 0]
-
-    likely_nav = navigable >= obstacle
-    obstacle[likely_nav] = 0
-    plotmap = np.zeros_like(Rover.worldmap)
-    plotmap[:, :, 0] = obstacle
-    plotmap[:, :, 2] = navigable
-    plotmap = plotmap.clip(0, 255)
-    # Overlay obstacle and navigable terrain map with ground truth map
-    map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-    # Check whether any rock detections are present in worldmap
-    rock_world_pos = Rover.worldmap[:, :, 1].nonzero()
-    # If there are, we'll step through the known sample positions
-    # to confirm whether detections are real
-    samples_located = 0
-    if rock_world_pos[0].any():
-
-        rock_size = 2
-        for idx in range(len(Rover.samples_pos[0])):
-            test_rock_x = Rover.samples_pos[0][idx]
-            test_rock_y = Rover.samples_pos[1][idx]
-            rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1]) ** 2 + \
-                                        (test_rock_y - rock_world_pos[0]) ** 2)
-            # If rocks were detected within 3 meters of known sample positions
-            # consider it a success and plot the location of the known
-            # sample on the map
-            if np.min(rock_sample_dists) < 3:
-                samples_located += 1
-                map_add[test_rock_y - rock_size:test_rock_y + rock_size,
-                test_rock_x - rock_size:test_rock_x + rock_size, :] = 255
-
-                distance_to_rover = np.sqrt((test_rock_x - Rover.pos[0]) ** 2 +
-                                            (test_rock_y - Rover.pos[1]) ** 2)
-                distances_to_picked_up_samples = [np.sqrt((test_rock_x - px) ** 2 + (test_rock_y - py) ** 2) for px, py in Rover.picked_up_sample_position]
-                min_distance_to_picked_up = 999 if len(distances_to_picked_up_samples) == 0 else sorted(distances_to_picked_up_samples)[0]
-                if distance_to_rover < 10 and min_distance_to_picked_up > 3:
-                    Rover.active_sample_position = (test_rock_x, test_rock_y)
-                    if Rover.active_sample_start_time is None and \
-                            (Rover.active_sample_search_ignore_until is None or Rover.active_sample_search_ignore_until < Rover.total_time):
-                        print("Adding SAMPLE")
-                        Rover.active_sample_start_time = Rover.total_time
-                        Rover.active_sample_search_started = True
-
-    # Calculate some statistics on the map results
-    # First get the total number of pixels in the navigable terrain map
-    tot_nav_pix = np.float(len((plotmap[:, :, 2].nonzero()[0])))
-    # Next figure out how many of those correspond to ground truth pixels
-    good_nav_pixels_bool = (plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] > 0)
-    good_nav_pix = np.float(len(good_nav_pixels_bool.nonzero()[0]))
-    # Next find how many do not correspond to ground truth pixels
-    bad_nav_pixels_bool = ((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] == 0))
-    bad_nav_pix = np.float(len(bad_nav_pixels_bool.nonzero()[0]))
-    # Grab the total number of map pixels
-    tot_map_pix = np.float(len((Rover.ground_truth[:, :, 1].nonzero()[0])))
-    # Calculate the percentage of ground truth map that has been successfully found
-    perc_mapped = round(100 * good_nav_pix / tot_map_pix, 1)
-    # Calculate the number of good map pixel detections divided by total pixels
-    # found to be navigable terrain
-    if tot_nav_pix > 0:
-        fidelity = round(100 * good_nav_pix / (tot_nav_pix), 1)
-    else:
-        fidelity = 0
-
-    draw_rover(Rover, map_add)
-
-    # Flip the map for plotting so that the y-axis points upward in the display
-    map_add = np.flipud(map_add).astype(np.float32)
-    # Add some text about map and rock sample detection results
-    cv2.putText(map_add, "Time: " + str(np.round(Rover.total_time, 1)) + ' s', (0, 10),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Mapped: " + str(perc_mapped) + '%', (0, 25),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Fidelity: " + str(fidelity) + '%', (0, 40),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Rocks", (0, 55),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Located: " + str(samples_located), (0, 70),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Collected: " + str(Rover.samples_collected), (0, 85),
-                cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    # Save the fidelity map
-    if Rover.image_generation_counter % 250:
-        fidelity_map = np.zeros_like(map_add)
-        fidelity_map[:, :, 0][bad_nav_pixels_bool] = 255
-        fidelity_map[:, :, 1][good_nav_pixels_bool] = 255
-        fidelity_map[:, :, 2][good_nav_pixels_bool & bad_nav_pixels_bool] = 255
-        fidelity_map_img = Image.fromarray(fidelity_map.astype(np.uint8))
-        mpimg.imsave("../output/fidelity_render.png", fidelity_map_img)
-
-    # Convert map and vision image to base64 strings for sending to server
-    pil_img = Image.fromarray(map_add.astype(np.uint8))
-    buff = BytesIO()
-    pil_img.save(buff, format="PNG")
-    encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
-
-    pil_img = Image.fromarray((Rover.vision_image * 255).astype(np.uint8))
-    buff = BytesIO()
-    pil_img.save(buff, format="PNG")
-    encoded_string2 = base64.b64encode(buff.getvalue()).decode("utf-8")
-
-    return encoded_string1, encoded_string2
-
-
-def draw_rover(rover, image):
+    update_map_state(Rover)
+
+
+def render_output_images(Rover):
     """
-    Draw the rover on the image
-    :param RoverState rover: the rover
-    :param np.ndarray image: the image
-    :return:
+    Renders the output images, without encoding them
+    :param RoverState Rover:
+    :return: uint8 RGB map and vision images, in buffers of the rover valid until the next call
+    """
+    update_frame_state(Rover)
+    return Rover.map_renderer.render(Rover), Rover.vision_image
+
+
+def render_fidelity_map(Rover):
+    """
+    Renders the fidelity map: navigable terrain found that is (green) and is not (red) in the ground truth
+    :param RoverState Rover:
+    :return: uint8 RGB image
     """
-    # Mark the rover
-    rover_half_size = 2
-    rover_x, rover_y = int(rover.pos[0]), int(rover.pos[1])
-    image[rover_y-rover_half_size: rover_y+rover_half_size, rover_x-rover_half_size: rover_x+rover_half_size, 0] = 255
-    image[rover_y-rover_half_size: rover_y+rover_half_size, rover_x-rover_half_size: rover_x+rover_half_size, 1] = 255
-    image[rover_y-rover_half_size: rover_y+rover_half_size, rover_x-rover_half_size: rover_x+rover_half_size, 2] = 0
+    fidelity_map = np.zeros(Rover.worldmap.shape, dtype=np.uint8)
+    good_nav_pixels_bool = Rover.map_stats.good_nav_pixels()
+    bad_nav_pixels_bool = Rover.map_stats.bad_nav_pixels()
+    fidelity_map[:, :, 0][bad_nav_pixels_bool] = 255
+    fidelity_map[:, :, 1][good_nav_pixels_bool] = 255
+    fidelity_map[:, :, 2][good_nav_pixels_bool & bad_nav_pixels_bool] = 255
+    return fidelity_map
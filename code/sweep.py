@@ -0,0 +1,307 @@
+"""
+Parameter sweeps over the rover's tuning knobs, evaluated in a process pool.
+
+Every configuration is evaluated on the kinematic simulator (see kinematic_sim.py),
+which exercises the decision and sample search parameters, or by replaying a
+recorded drive (see replay.py), which only exercises perception: the recorded
+commands drive the rover, so the decision parameters do not change a replay, and
+the simulator synthesizes the terrain labels, so the color thresholds do not
+change a simulation.  A sweep only takes the parameters its evaluation exercises.
+Run it from the code folder, with a grid of values:
+
+    python sweep.py --param throttle_set=0.2,0.3 --param stop_forward=50,100,200 --seeds 4
+
+or with a random search over ranges:
+
+    python sweep.py --random 40 --param max_vel=1.5:3 --param go_forward=300:800
+
+    python sweep.py --evaluate replay --log ../test_dataset/robot_log.csv --param navigable_threshold=150,160,170
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from perception import OBSTACLE, ROCK, NAVIGABLE
+from kinematic_sim import simulate
+from replay import replay, log_frames
+from recording import Recording, is_recording
+from rover_state import RoverState
+
+# Tuning knobs of RoverState that can be swept
+ROVER_PARAMETERS = ('throttle_set', 'brake_set', 'stop_forward', 'go_forward', 'max_vel', 'seconds_for_being_stuck',
+                    'sample_search_timeout', 'active_sample_search_cooldown', 'waypoint_window', 'waypoint_cooldown')
+# Color threshold knobs, see terrain_thresholds()
+THRESHOLD_PARAMETERS = ('navigable_threshold', 'rock_min_red', 'rock_max_blue')
+# Parameters that change the results of each evaluation
+EVALUATED_PARAMETERS = {'sim': ROVER_PARAMETERS, 'replay': THRESHOLD_PARAMETERS}
+RESULT_COLUMNS = ('mapped_percent', 'fidelity_percent', 'samples_collected')
+# Results of each evaluation, a replay follows the recorded commands and collects no samples
+EVALUATED_COLUMNS = {'sim': RESULT_COLUMNS, 'replay': ('mapped_percent', 'fidelity_percent')}
+
+
+def terrain_thresholds(navigable_threshold=160, rock_min_red=100, rock_max_blue=70):
+    """
+    Terrain class thresholds from the color threshold knobs, the defaults give perception.TERRAIN_THRESHOLDS
+    :param int navigable_threshold: minimum value of all channels of navigable terrain, the maximum for obstacles
+    :param int rock_min_red: minimum red value of rock samples
+    :param int rock_max_blue: maximum blue value of rock samples
+    :return: thresholds for RoverState.terrain_thresholds
+    """
+    return (
+        (OBSTACLE, (0, 0, 0), (navigable_threshold,) * 3),
+        (ROCK, (rock_min_red, 0, 0), (180, 180, rock_max_blue)),
+        (NAVIGABLE, (navigable_threshold,) * 3, (255, 255, 255)),
+    )
+
+
+def configure(Rover, parameters):
+    """
+    Set swept parameters on a rover
+    :param RoverState Rover: the rover
+    :param dict parameters: values by name, from ROVER_PARAMETERS and THRESHOLD_PARAMETERS
+    :return: the rover
+    """
+    thresholds = {}
+    for name, value in parameters.items():
+        if name in THRESHOLD_PARAMETERS:
+            thresholds[name] = int(round(value))
+        elif name == 'seconds_for_being_stuck':
+            Rover.seconds_for_being_stuck = int(value)
+            Rover.pos_every_second = np.full((Rover.seconds_for_being_stuck, 3), -1, dtype=float)
+        elif name in ROVER_PARAMETERS:
+            setattr(Rover, name, value)
+        else:
+            raise ValueError("Unknown parameter {}".format(name))
+    if thresholds:
+        Rover.terrain_thresholds = terrain_thresholds(**thresholds)
+    return Rover
+
+
+def parse_parameter(spec):
+    """
+    :param str spec: name=v1,v2,... for a list of values or name=low:high for a range
+    :return: name and list of values, or name and (low, high) tuple
+    """
+    name, _, values = spec.partition('=')
+    if name not in ROVER_PARAMETERS + THRESHOLD_PARAMETERS:
+        raise ValueError("Unknown parameter {}, expected one of {}".format(
+            name, ', '.join(ROVER_PARAMETERS + THRESHOLD_PARAMETERS)))
+    number = lambda value: int(value) if value.lstrip('-').isdigit() else float(value)
+    if ':' in values:
+        low, high = values.split(':')
+        return name, (number(low), number(high))
+    return name, [number(value) for value in values.split(',')]
+
+
+def grid(parameters):
+    """
+    :param dict parameters: list of values by name
+    :return: list of configurations, every combination of the values
+    """
+    names = sorted(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+
+def random_search(parameters, count, seed=0):
+    """
+    :param dict parameters: (low, high) range or list of values by name
+    :param int count: number of configurations
+    :param int seed: random seed
+    :return: list of configurations, uniformly drawn from the ranges (integers if both bounds are) or lists
+    """
+    random = np.random.RandomState(seed)
+    configurations = []
+    for _ in range(count):
+        configuration = {}
+        for name in sorted(parameters):
+            values = parameters[name]
+            if isinstance(values, list):
+                configuration[name] = values[random.randint(len(values))]
+            elif isinstance(values[0], int) and isinstance(values[1], int):
+                configuration[name] = int(random.randint(values[0], values[1] + 1))
+            else:
+                configuration[name] = float(random.uniform(*values))
+        configurations.append(configuration)
+    return configurations
+
+
+def evaluate(job):
+    """
+    Evaluate a configuration, in a worker process
+    :param tuple job: configuration index, parameters, 'sim' or 'replay', seed and the evaluation options
+    :return: configuration index and dict of the EVALUATED_COLUMNS of the evaluation
+    """
+    index, parameters, evaluation, seed, options = job
+    if evaluation == 'sim':
+        result = simulate(options['minutes'], seed, configure=lambda Rover: configure(Rover, parameters))
+    else:
+        log = options['log']
+        frames = Recording(log).iter_frames() if is_recording(log) else log_frames(log)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            Rover, _ = replay(frames, configure(RoverState(), parameters))
+        result = {'mapped_percent': Rover.map_stats.perc_mapped, 'fidelity_percent': Rover.map_stats.fidelity}
+    return index, {column: result[column] for column in EVALUATED_COLUMNS[evaluation]}
+
+
+def sweep(configurations, evaluation='sim', seeds=1, workers=None, **options):
+    """
+    Evaluate configurations in a process pool
+    :param list configurations: parameter dicts
+    :param str evaluation: 'sim' for the kinematic simulator, 'replay' to replay options['log']
+    :param int seeds: simulator runs per configuration, averaged.  Replays are evaluated once
+    :param int workers: number of worker processes, the number of CPUs if None
+    :param options: minutes for the simulator, log for replays
+    :return: list of dicts with the parameters and the mean results of every configuration
+    """
+    ignored = sorted({name for parameters in configurations for name in parameters}
+                     - set(EVALUATED_PARAMETERS[evaluation]))
+    if ignored:
+        raise ValueError("{} do not change a '{}' evaluation".format(', '.join(ignored), evaluation))
+    seeds = seeds if evaluation == 'sim' else 1
+    jobs = [(index, parameters, evaluation, seed, options)
+            for index, parameters in enumerate(configurations) for seed in range(seeds)]
+    results = [[] for _ in configurations]
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for index, result in (pool.imap_unordered(evaluate, jobs) if pool else map(evaluate, jobs)):
+            results[index].append(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    rows = []
+    for parameters, runs in zip(configurations, results):
+        row = dict(parameters)
+        row.update({column: float(np.mean([run[column] for run in runs])) for column in runs[0]})
+        rows.append(row)
+    return rows
+
+
+def result_columns(rows):
+    """
+    :param list rows: results from sweep()
+    :return: the RESULT_COLUMNS of the rows, in order
+    """
+    return [column for column in RESULT_COLUMNS if any(column in row for row in rows)]
+
+
+def rank(rows, rank_by='mapped_percent'):
+    """
+    :param list rows: results from sweep()
+    :param str rank_by: result column to rank by, ties are ranked by the other result columns
+    :return: rows from best to worst, with their rank
+    """
+    columns = result_columns(rows)
+    if rows and rank_by not in columns:
+        raise ValueError("The results have no {} column".format(rank_by))
+    keys = (rank_by,) + tuple(column for column in columns if column != rank_by)
+    ranked = sorted(rows, key=lambda row: tuple(row[key] for key in keys), reverse=True)
+    for position, row in enumerate(ranked):
+        row['rank'] = position + 1
+    return ranked
+
+
+def write_table(rows, path):
+    """
+    Write ranked results to a csv file
+    :param list rows: results from rank()
+    :param str path: csv file
+    """
+    parameters = sorted({name for row in rows for name in row} - set(RESULT_COLUMNS) - {'rank'})
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['rank'] + parameters + result_columns(rows))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the tuning parameters of the rover')
+    parser.add_argument(
+        '--param',
+        action='append',
+        default=[],
+        help='name=v1,v2,... or name=low:high, repeat for every parameter. Parameters with --evaluate sim: {}. '
+             'With --evaluate replay: {}.'.format(', '.join(ROVER_PARAMETERS), ', '.join(THRESHOLD_PARAMETERS))
+    )
+    parser.add_argument(
+        '--random',
+        type=int,
+        default=0,
+        help='Evaluate this many random configurations instead of the grid of all combinations.'
+    )
+    parser.add_argument(
+        '--evaluate',
+        choices=['sim', 'replay'],
+        default='sim',
+        help='Evaluate on the kinematic simulator or by replaying --log.'
+    )
+    parser.add_argument(
+        '--log',
+        type=str,
+        default='../test_dataset/robot_log.csv',
+        help='Recording log or recording folder to replay.'
+    )
+    parser.add_argument(
+        '--minutes',
+        type=float,
+        default=15,
+        help='Simulated minutes per run.'
+    )
+    parser.add_argument(
+        '--seeds',
+        type=int,
+        default=1,
+        help='Simulator runs per configuration, each with other sample positions.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='Number of worker processes, 0 for one per CPU.'
+    )
+    parser.add_argument(
+        '--rank_by',
+        choices=RESULT_COLUMNS,
+        default='mapped_percent',
+        help='Result column to rank the configurations by, replays have no samples_collected.'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='../output/sweep_results.csv',
+        help='Csv file to write the ranked results to.'
+    )
+    args = parser.parse_args()
+
+    parameters = dict(parse_parameter(spec) for spec in args.param)
+    ignored = [name for name in parameters if name not in EVALUATED_PARAMETERS[args.evaluate]]
+    if ignored:
+        parser.error("{} do not change the results of --evaluate {}".format(', '.join(ignored), args.evaluate))
+    if args.rank_by not in EVALUATED_COLUMNS[args.evaluate]:
+        parser.error("--evaluate {} has no {} to rank by".format(args.evaluate, args.rank_by))
+    if args.random > 0:
+        configurations = random_search(parameters, args.random)
+    elif any(isinstance(values, tuple) for values in parameters.values()):
+        parser.error("Ranges need --random, give a list of values for a grid")
+    else:
+        configurations = grid(parameters)
+
+    start = time.time()
+    rows = rank(sweep(configurations, args.evaluate, args.seeds, args.workers or None,
+                      minutes=args.minutes, log=args.log), args.rank_by)
+    write_table(rows, args.output)
+    print("Evaluated {} configurations in {:.1f} s, results in {}".format(len(rows), time.time() - start,
+                                                                          args.output))
+    results = "mapped {mapped_percent:.1f}%, fidelity {fidelity_percent:.1f}%"
+    if 'samples_collected' in EVALUATED_COLUMNS[args.evaluate]:
+        results += ", samples collected {samples_collected:.2f}"
+    for row in rows[:10]:
+        print(("{:>3}. {}  " + results).format(
+            row['rank'], ', '.join('{}={}'.format(name, row[name]) for name in sorted(parameters)), **row))
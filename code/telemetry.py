@@ -0,0 +1,109 @@
+import base64
+import logging
+import time
+
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Numeric telemetry fields, in the order they are parsed.  position holds two values
+TELEMETRY_FIELDS = ('speed', 'position', 'yaw', 'pitch', 'roll', 'throttle', 'steering_angle',
+                    'near_sample', 'picking_up', 'sample_count')
+
+
+def parse_values(data, fields=TELEMETRY_FIELDS):
+    """
+    Parse numeric telemetry strings in one pass, independent of decimal convention
+    :param dict data: telemetry
+    :param tuple fields: fields to parse, values separated by ';' within a field
+    :return: list of floats, in field order
+    """
+    return [float(value) for value in ';'.join([data[field] for field in fields]).replace(',', '.').split(';')]
+
+
+class TelemetryDecoder(object):
+    """
+    Decodes telemetry into a RoverState, the camera image into a reusable buffer.
+
+    Only the RGB image is reused: cv2.imdecode() has no output argument, so every
+    call still allocates the BGR frame it decodes to, which the conversion to RGB
+    then writes into the buffer.
+    """
+
+    def __init__(self, image_shape=(160, 320, 3)):
+        """
+        :param tuple image_shape: expected shape of the camera images
+        """
+        self.image = np.empty(image_shape, dtype=np.uint8)
+        # Time it took to decode the last telemetry, in seconds
+        self.decode_seconds = 0
+
+    def decode_image(self, image_string):
+        """
+        Decode a base64 JPEG camera image into the image buffer
+        :param str image_string: base64 encoded image
+        :return: the image buffer and the JPEG bytes
+        """
+        jpeg = base64.b64decode(image_string)
+        return self.decode_jpeg(jpeg), jpeg
+
+    def decode_jpeg(self, jpeg):
+        """
+        Decode a JPEG camera image into the image buffer, through a new BGR frame
+        :param bytes jpeg: JPEG file contents
+        :return: the image buffer
+        """
+        bgr = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise ValueError("Could not decode the camera image")
+        if bgr.shape != self.image.shape:
+            self.image = np.empty(bgr.shape, dtype=np.uint8)
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self.image)
+        return self.image
+
+    def close(self):
+        """Release the image buffer, the images the decoder returned are not used anymore"""
+        self.image = None
+
+    def decode(self, Rover, data):
+        """
+        Update the rover with telemetry
+        :param RoverState Rover: the rover
+        :param dict data: telemetry
+        :return: JPEG bytes of the camera image
+        """
+        start = time.time()
+        # Initialize start time and sample positions
+        if Rover.start_time is None:
+            Rover.start_time = start
+            Rover.total_time = 0
+            Rover.samples_pos = (np.int_(parse_values(data, ('samples_x',))),
+                                 np.int_(parse_values(data, ('samples_y',))))
+            Rover.samples_to_find = int(data["sample_count"])
+        # Or just update elapsed time
+        else:
+            tot_time = start - Rover.start_time
+            if np.isfinite(tot_time):
+                Rover.total_time = tot_time
+        logger.debug("telemetry fields: %s", list(data.keys()))
+
+        (Rover.vel, pos_x, pos_y, Rover.yaw, Rover.pitch, Rover.roll, Rover.throttle, Rover.steer,
+         near_sample, picking_up, sample_count) = parse_values(data)
+        Rover.pos = [pos_x, pos_y]
+        Rover.near_sample = int(near_sample)
+        Rover.picking_up = int(picking_up)
+        Rover.samples_collected = Rover.samples_to_find - int(sample_count)
+
+        # Get the current image from the center camera of the rover
+        Rover.img, jpeg = self.decode_image(data["image"])
+
+        self.decode_seconds = time.time() - start
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('speed = %s position = %s throttle = %s steer_angle = %s near_sample: %s picking_up: %s '
+                         'sending pickup: %s total time: %s samples remaining: %s samples collected: %s '
+                         'decode time: %.2f ms',
+                         Rover.vel, Rover.pos, Rover.throttle, Rover.steer, Rover.near_sample, Rover.picking_up,
+                         Rover.send_pickup, Rover.total_time, int(sample_count), Rover.samples_collected,
+                         self.decode_seconds * 1000)
+        return jpeg
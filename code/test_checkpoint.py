@@ -0,0 +1,37 @@
+import numpy as np
+
+from checkpoint import CheckpointWriter, has_checkpoint, open_world_map, restore
+from perception import NAVIGABLE, WORLD_MAP_CHANNELS
+from rover_state import RoverState
+
+
+def checkpointed_rover(path):
+    """
+    :param str path: checkpoint folder
+    :return: a rover that observed a few cells, with a checkpoint written
+    """
+    Rover = RoverState()
+    Rover.world_map = open_world_map(path, Rover.worldmap.shape, Rover.world_map.tile_size)
+    Rover.worldmap = Rover.world_map.grid
+    Rover.total_time = 42.0
+    Rover.world_map.accumulate(np.array([10, 11]), np.array([20, 21]), np.full(2, NAVIGABLE, dtype=np.uint8),
+                               WORLD_MAP_CHANNELS)
+    writer = CheckpointWriter(str(path))
+    assert writer.submit(Rover, block=True)
+    writer.close()
+    return Rover
+
+
+def test_resume(tmp_path):
+    Rover = checkpointed_rover(tmp_path)
+    assert has_checkpoint(str(tmp_path))
+    resumed = restore(RoverState(), str(tmp_path))
+    assert resumed.total_time == Rover.total_time
+    assert np.array_equal(resumed.worldmap, Rover.worldmap)
+
+
+def test_fresh_run_invalidates_the_previous_checkpoint(tmp_path):
+    Rover = checkpointed_rover(tmp_path)
+    # A new run in the same folder that dies before its first checkpoint
+    open_world_map(str(tmp_path), Rover.worldmap.shape, Rover.world_map.tile_size)
+    assert not has_checkpoint(str(tmp_path))
@@ -0,0 +1,20 @@
+import itertools
+
+import planner
+from kinematic_sim import simulate
+
+# Results that depend on the wall clock, not on the run
+TIMING_RESULTS = ('elapsed_s', 'speedup')
+
+
+def run(seed):
+    result = simulate(0.5, seed)
+    return {name: value for name, value in result.items() if name not in TIMING_RESULTS}
+
+
+def test_a_seed_repeats_the_same_run(monkeypatch):
+    first = run(3)
+    # Even on a CPU so loaded that every clock reading is a second later than the previous one
+    clock = itertools.count()
+    monkeypatch.setattr(planner.time, 'perf_counter', lambda: float(next(clock)))
+    assert run(3) == first
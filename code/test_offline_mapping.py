@@ -0,0 +1,46 @@
+import numpy as np
+
+from offline_mapping import map_log
+from perception import map_image, map_images
+from replay import read_log
+from telemetry import TelemetryDecoder
+from world_map import TiledWorldMap
+from rover_state import RoverState
+
+FRAMES = 24
+
+
+def new_world_map():
+    return TiledWorldMap(*RoverState().worldmap.shape)
+
+
+def assert_same_world_map(world_map, expected):
+    assert np.array_equal(world_map.grid, expected.grid)
+    tiles, expected_tiles = world_map.outside_tiles(), expected.outside_tiles()
+    assert sorted(tiles) == sorted(expected_tiles)
+    for key, tile in tiles.items():
+        assert np.array_equal(tile, expected_tiles[key])
+
+
+def test_parallel_mapping_matches_a_single_worker():
+    rows = read_log('../test_dataset/robot_log.csv')[::10][:FRAMES]
+    expected = map_log(rows, new_world_map(), workers=1)
+    assert expected.grid.any()
+    assert_same_world_map(map_log(rows, new_world_map(), workers=3), expected)
+
+
+def test_batched_mapping_matches_mapping_frame_by_frame():
+    rows = read_log('../test_dataset/robot_log.csv')[::10][:FRAMES]
+    decoder = TelemetryDecoder()
+    images = []
+    for row in rows:
+        with open(row['path'], 'rb') as f:
+            images.append(decoder.decode_jpeg(f.read()).copy())
+    expected = new_world_map()
+    for row, image in zip(rows, images):
+        map_image(image, row['pos'][0], row['pos'][1], row['yaw'], expected)
+    world_map = new_world_map()
+    map_images(np.array(images), [row['pos'][0] for row in rows], [row['pos'][1] for row in rows],
+               [row['yaw'] for row in rows], world_map)
+    assert expected.grid.any()
+    assert_same_world_map(world_map, expected)
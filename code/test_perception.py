@@ -0,0 +1,79 @@
+import glob
+
+import matplotlib.image as mpimg
+import numpy as np
+import pytest
+
+from perception import (NAVIGABLE, OBSTACLE, ROCK, TERRAIN_THRESHOLDS, classify_terrain, color_thresh,
+                        get_perception_engine, perspect_transform, perspective_points, terrain_lut)
+
+DATASET_IMAGES = sorted(glob.glob('../test_dataset/IMG/*.jpg'))
+# Levels the fixed point warp of the perception engine may differ from cv2.warpPerspective() by
+WARP_TOLERANCE = 3
+
+
+def assert_same_selections(img, thresholds=TERRAIN_THRESHOLDS):
+    """
+    :param np.ndarray img: uint8 RGB image
+    :param tuple thresholds: see terrain_lut()
+    """
+    labels = classify_terrain(img, terrain_lut(thresholds))
+    for label, lower, upper in thresholds:
+        np.testing.assert_array_equal((labels & label) != 0, color_thresh(img, lower, upper) == 1,
+                                      err_msg='label {}'.format(label))
+
+
+def test_dataset_is_there():
+    assert DATASET_IMAGES
+
+
+@pytest.mark.parametrize('path', DATASET_IMAGES)
+def test_lut_matches_color_thresh_on_dataset_images(path):
+    img = mpimg.imread(path)
+    assert_same_selections(img)
+    # And on the warped image, the one perception classifies
+    engine = get_perception_engine(img.shape[:2])
+    assert_same_selections(engine.warp(img))
+
+
+@pytest.mark.parametrize('path', DATASET_IMAGES)
+def test_warp_matches_perspect_transform_on_dataset_images(path):
+    img = mpimg.imread(path)
+    engine = get_perception_engine(img.shape[:2])
+    expected = perspect_transform(img, *perspective_points(img.shape[:2])).reshape(-1, 3)[engine.pixel_index]
+    warped = engine.warp(img)
+    assert np.abs(warped.astype(np.int16) - expected).max() <= WARP_TOLERANCE
+    np.testing.assert_array_equal(engine.classify(warped), engine.classify(expected))
+
+
+def test_lut_matches_color_thresh_on_any_color():
+    # Every value of every channel, against thresholds on each side of it
+    random = np.random.RandomState(0)
+    img = random.randint(0, 256, (64, 256, 3)).astype(np.uint8)
+    img[0] = np.arange(256)[:, None]
+    thresholds = tuple((1 << idx, tuple(random.randint(0, 128, 3)), tuple(random.randint(128, 256, 3)))
+                       for idx in range(3))
+    assert_same_selections(img, thresholds)
+
+
+def test_classify_into_buffers():
+    img = mpimg.imread(DATASET_IMAGES[0])
+    lut = terrain_lut()
+    out = np.empty(img.shape[:2], dtype=np.uint8)
+    scratch = np.empty(img.shape, dtype=np.uint8)
+    assert classify_terrain(img, lut, out, scratch) is out
+    np.testing.assert_array_equal(out, classify_terrain(img, lut))
+
+
+def test_engines_of_other_thresholds_share_the_camera_tables():
+    img = mpimg.imread(DATASET_IMAGES[0])
+    thresholds = ((OBSTACLE, (0, 0, 0), (150, 150, 150)), (ROCK, (90, 0, 0), (180, 180, 80)),
+                  (NAVIGABLE, (150, 150, 150), (255, 255, 255)))
+    default = get_perception_engine(img.shape[:2])
+    other = get_perception_engine(img.shape[:2], thresholds)
+    assert other is get_perception_engine(img.shape[:2], thresholds)
+    assert other.map1 is default.map1 and other.pixel_index is default.pixel_index
+    warped = default.warp(img)
+    np.testing.assert_array_equal(other.classify(warped),
+                                  classify_terrain(warped, terrain_lut(thresholds)) & default.label_mask)
+    assert default.thresholds == TERRAIN_THRESHOLDS
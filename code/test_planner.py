@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from perception import NAVIGABLE, OBSTACLE, WORLD_MAP_CHANNELS
+from planner import FrontierPlanner
+from world_map import TiledWorldMap
+
+
+def observe(world_map, x, y, label, hits=5):
+    """
+    :param TiledWorldMap world_map: the worldmap
+    :param np.ndarray x: x cells
+    :param np.ndarray y: y cells
+    :param int label: label bit of the cells
+    :param int hits: observations of every cell
+    """
+    x, y = np.repeat(np.ravel(x), hits), np.repeat(np.ravel(y), hits)
+    world_map.accumulate(x, y, np.full(len(x), label, dtype=np.uint8), WORLD_MAP_CHANNELS)
+
+
+@pytest.mark.parametrize('edge_row', [0, 199])
+def test_blocking_a_route_along_the_map_edge(edge_row):
+    # Everything is an obstacle but a corridor along the edge row, that leads to a free
+    # room at the border of an unexplored region
+    world_map = TiledWorldMap(200, 200)
+    rows = np.arange(200) if edge_row == 0 else np.arange(200)[::-1]
+    room = rows[:10]
+    y, x = np.mgrid[0:200, 0:200]
+    unexplored = (x > 160) & np.isin(y, room)
+    room_cells = (x >= 150) & (x <= 160) & np.isin(y, room)
+    corridor = (y == edge_row) & (x < 150)
+    blocked = ~(unexplored | room_cells | corridor)
+    observe(world_map, x[blocked], y[blocked], OBSTACLE)
+    observe(world_map, x[room_cells | corridor], y[room_cells | corridor], NAVIGABLE)
+
+    planner = FrontierPlanner((200, 200), budget=10)
+    pos = (5.5, edge_row + 0.5)
+    waypoint = planner.update(world_map, pos)
+    assert waypoint is not None
+    assert int(waypoint[1]) == edge_row and waypoint[0] > pos[0]
+
+    # Cut the corridor: no frontier can be reached anymore
+    observe(world_map, np.array([80]), np.array([edge_row]), OBSTACLE, hits=100)
+    assert planner.update(world_map, pos) is None
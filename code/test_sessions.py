@@ -0,0 +1,61 @@
+import os
+
+from image_encoding import InsetEncoder
+from kinematic_sim import sample_positions
+from profiling import StageProfiler
+from rover_state import RoverState
+from sessions import Session, SessionWorkers, numbered_path
+from sim_client import load_frames, telemetry
+
+STEP_STAGES = ('update_rover', 'perception_step', 'decision_step', 'create_output_images')
+
+
+def create_session(index):
+    return Session(RoverState(), InsetEncoder())
+
+
+def test_worker_stages_reach_the_server_profiler():
+    frames = load_frames('../test_dataset/robot_log.csv', max_frames=3)
+    samples = sample_positions(6)
+    profiler = StageProfiler()
+    sessions = SessionWorkers(create_session, workers=1, profiler=profiler)
+    try:
+        for row, image in frames:
+            event, payload = sessions.step('sid', telemetry(row, image, samples, 6))
+            assert event == 'data'
+    finally:
+        sessions.close_all()
+    stages = profiler.summary()['stages']
+    for name in STEP_STAGES:
+        assert stages[name]['count'] == len(frames)
+
+
+def test_degraded_frames_keep_the_map_state_current():
+    frames = load_frames('../test_dataset/robot_log.csv', max_frames=3)
+    samples = sample_positions(6)
+    session = create_session(0)
+    try:
+        for count, (row, image) in enumerate(frames, 1):
+            session.step(telemetry(row, image, samples, 6), degraded=count > 1)
+            assert session.Rover.image_generation_counter == count
+            # The cells observed this frame went to the sample search and the map statistics
+            assert len(session.Rover.world_map.pop_updated()) == 0
+        assert session.Rover.map_stats.perc_mapped > 0
+    finally:
+        session.close()
+
+
+def test_sessions_save_their_images_to_their_own_folders(tmp_path):
+    frames = load_frames('../test_dataset/robot_log.csv', max_frames=2)
+    samples = sample_positions(6)
+    folders = [numbered_path(str(tmp_path / 'IMG') + '/', index) for index in range(2)]
+    assert folders == [str(tmp_path / 'IMG') + '/', str(tmp_path / 'IMG_1')]
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+        session = Session(RoverState(), InsetEncoder(), image_folder=folder)
+        try:
+            for row, image in frames:
+                session.step(telemetry(row, image, samples, 6))
+        finally:
+            session.close()
+        assert len(os.listdir(folder)) == len(frames)
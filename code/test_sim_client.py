@@ -0,0 +1,46 @@
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from kinematic_sim import sample_positions
+from sim_client import SimulatorConnection, load_frames
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server_url():
+    """drive_rover.py on a free port, for the duration of a test"""
+    port = free_port()
+    server = subprocess.Popen([sys.executable, 'drive_rover.py', '--port', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            assert server.poll() is None, "drive_rover.py exited"
+            try:
+                socket.create_connection(('localhost', port), timeout=1).close()
+                break
+            except OSError:
+                assert time.time() < deadline, "drive_rover.py is not listening"
+                time.sleep(0.2)
+        yield 'http://localhost:{}'.format(port)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def test_telemetry_control_round_trip(server_url):
+    frames = load_frames('../test_dataset/robot_log.csv', max_frames=2)
+    sim = SimulatorConnection(server_url, frames, sample_positions(6), reply_timeout=20)
+    sim.run(duration=0.1)
+    assert sim.sent >= 1
+    assert sim.replies == sim.sent
+    assert sim.timeouts == 0
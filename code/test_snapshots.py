@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+
+from snapshots import SnapshotWriter
+
+
+def test_snapshots_keep_the_last_numbered_files(tmp_path):
+    path = str(tmp_path / 'map.png')
+    writer = SnapshotWriter(path, every_n_frames=1, keep=2, queue_size=5)
+    for frame in range(1, 5):
+        writer.submit(lambda: np.full((4, 4, 3), frame, dtype=np.uint8), block=True)
+    writer.close()
+    assert writer.written == 4 and writer.dropped == 0
+    assert sorted(os.listdir(str(tmp_path))) == ['map.png', 'map_000002.png', 'map_000003.png']
+
+
+def test_snapshots_that_are_not_due_are_not_rendered(tmp_path):
+    writer = SnapshotWriter(str(tmp_path / 'map.png'), every_n_frames=10)
+    rendered = []
+    for frame in range(1, 11):
+        writer.maybe_submit(frame, lambda: rendered.append(frame) or np.zeros((4, 4, 3), dtype=np.uint8))
+    writer.close()
+    assert rendered == [10] and writer.written == 1
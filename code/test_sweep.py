@@ -0,0 +1,24 @@
+import pytest
+
+from sweep import rank, sweep, write_table
+
+
+@pytest.mark.parametrize('evaluation, parameters', [
+    ('sim', {'navigable_threshold': 150}),
+    ('replay', {'max_vel': 2.0}),
+])
+def test_sweep_rejects_parameters_its_evaluation_ignores(evaluation, parameters):
+    with pytest.raises(ValueError):
+        sweep([parameters], evaluation)
+
+
+def test_replay_results_leave_out_the_samples_collected(tmp_path):
+    rows = rank(sweep([{'navigable_threshold': 150}, {'navigable_threshold': 170}], 'replay', workers=1,
+                      log='../test_dataset/robot_log.csv'))
+    assert [set(row) for row in rows] == [{'navigable_threshold', 'mapped_percent', 'fidelity_percent', 'rank'}] * 2
+    with pytest.raises(ValueError):
+        rank(rows, 'samples_collected')
+    path = str(tmp_path / 'results.csv')
+    write_table(rows, path)
+    with open(path) as f:
+        assert f.readline().strip() == 'rank,navigable_threshold,mapped_percent,fidelity_percent'
@@ -0,0 +1,349 @@
+import numpy as np
+
+# Worldmap channels
+OBSTACLE_CHANNEL = 0
+ROCK_CHANNEL = 1
+NAVIGABLE_CHANNEL = 2
+
+
+def _within(cells, size):
+    """
+    :param np.ndarray cells: cell coordinates, not empty
+    :param int size: extent along that axis
+    :return: True if all cells are in [0, size)
+    """
+    return cells.min() >= 0 and cells.max() < size
+
+
+class WorldMap(object):
+    """
+    Observation counts of obstacles, rock samples and navigable terrain per world cell.
+
+    Counts are kept in a uint16 grid and saturate instead of wrapping around.  Every
+    observation of a frame is counted, including several pixels landing on the same
+    cell, with a single bincount over the range of cells the frame touched.  The
+    per channel totals and the cells updated since the last pop_updated() are kept
+    up to date along the way, so consumers never have to rescan the grid.
+    """
+    max_count = np.iinfo(np.uint16).max
+
+    def __init__(self, rows=200, cols=200, channels=3, counts=None):
+        """
+        :param int rows: world size along y
+        :param int cols: world size along x
+        :param int channels: number of observation classes
+        :param np.ndarray counts: (rows, cols, channels) uint16 counts to keep the map in and start from, e.g. a
+            memory-mapped file.  Its observed cells are the first ones pop_updated() returns.  None for a new grid
+        """
+        if counts is None:
+            counts = np.zeros((rows, cols, channels), dtype=np.uint16)
+        elif counts.shape != (rows, cols, channels) or counts.dtype != np.uint16:
+            raise ValueError("Expected {} uint16 counts, got {} {}".format((rows, cols, channels), counts.shape,
+                                                                           counts.dtype))
+        self.grid = counts
+        self._counts = self.grid.reshape(-1)
+        # Sum of the counts and number of observed cells per channel
+        per_channel = self._counts.reshape(-1, channels)
+        self.channel_totals = per_channel.sum(axis=0, dtype=np.int64)
+        self.channel_observed = np.count_nonzero(per_channel, axis=0).astype(np.int64)
+        observed = np.flatnonzero(self._counts)
+        self._updated = [observed] if len(observed) else []
+
+    @property
+    def shape(self):
+        return self.grid.shape
+
+    def add_hits(self, indexes):
+        """
+        Count observations given as flat indexes into the grid
+        :param np.ndarray indexes: flat (row, column, channel) indexes, duplicates allowed
+        :return: flat indexes of the cells that were updated
+        """
+        if len(indexes) == 0:
+            return np.empty(0, dtype=np.intp)
+        first = indexes.min()
+        hits = np.bincount(indexes - first)
+        updated = hits.nonzero()[0]
+        hits = hits[updated]
+        updated += first
+        return self._add(updated, hits)
+
+    def merge(self, counts):
+        """
+        Add the counts of another map of the same shape, as if its observations had been
+        accumulated here.  Merging is associative: merging partial maps in any grouping
+        gives the same counts as accumulating all their observations into one map
+        :param np.ndarray counts: (rows, cols, channels) counts, e.g. WorldMap.grid of a partial map
+        :return: flat indexes of the cells that were updated
+        """
+        counts = counts.reshape(-1)
+        updated = counts.nonzero()[0]
+        return self._add(updated, counts[updated].astype(np.int64))
+
+    def _add(self, updated, hits):
+        previous = self._counts[updated]
+        counts = previous + hits
+        np.minimum(counts, self.max_count, out=counts)
+        self._counts[updated] = counts
+
+        channels = self.grid.shape[2]
+        updated_channels = updated % channels
+        self.channel_totals += np.bincount(updated_channels, weights=counts - previous,
+                                           minlength=channels).astype(np.int64)
+        self.channel_observed += np.bincount(updated_channels[previous == 0], minlength=channels)
+        self._updated.append(updated)
+        return updated
+
+    def pop_updated(self):
+        """
+        Cells updated since the previous call
+        :return: sorted unique flat (row, column, channel) indexes
+        """
+        if not self._updated:
+            return np.empty(0, dtype=np.intp)
+        updated = np.unique(np.concatenate(self._updated))
+        self._updated = []
+        return updated
+
+    def accumulate(self, x_world, y_world, labels, label_channels):
+        """
+        Count the observations of all classes in one call
+        :param np.ndarray x_world: x cell of every observed pixel, integer
+        :param np.ndarray y_world: y cell of every observed pixel, integer
+        :param np.ndarray labels: label bits of every observed pixel
+        :param tuple label_channels: (label bit, channel) pairs
+        :return: flat indexes of the cells that were updated
+        """
+        rows, cols, channels = self.grid.shape
+        # Observations beyond the map pile up on its border cells, the usual frame is all inside
+        if len(x_world) and not (_within(x_world, cols) and _within(y_world, rows)):
+            x_world = np.clip(x_world, 0, cols - 1)
+            y_world = np.clip(y_world, 0, rows - 1)
+        cells = (y_world * cols + x_world) * channels
+        indexes = np.concatenate([cells[(labels & label) != 0] + channel for label, channel in label_channels])
+        return self.add_hits(indexes)
+
+
+class TiledWorldMap(WorldMap):
+    """
+    Worldmap of arbitrary extent, stored in square tiles of counts allocated where observations land.
+
+    The window of rows x cols cells from the origin stays dense, as WorldMap.grid, for
+    the display, the statistics and the planner, and its tiles are views into it.
+    Observations beyond the window go to tiles allocated on first use instead of
+    piling up on the border cells; the channel totals and pop_updated() cover the
+    window only.  Every update bumps the map revision and stamps the tiles it touched,
+    so consumers keep the revision they last saw and process only the tiles changed
+    since with changed_tiles().
+    """
+
+    def __init__(self, rows=200, cols=200, channels=3, tile_size=20, counts=None, tiles=None):
+        """
+        :param int rows: window size along y, a multiple of tile_size
+        :param int cols: window size along x, a multiple of tile_size
+        :param int channels: number of observation classes
+        :param int tile_size: tile side, in cells
+        :param np.ndarray counts: window counts to keep the map in and start from, see WorldMap
+        :param dict tiles: tiles beyond the window to start from, from outside_tiles()
+        """
+        if rows % tile_size or cols % tile_size:
+            raise ValueError("The window of {}x{} cells is not made of {} cell tiles".format(rows, cols, tile_size))
+        super(TiledWorldMap, self).__init__(rows, cols, channels, counts)
+        self.tile_size = tile_size
+        # Tiles by (tile row, tile column), the window tiles are views into the grid
+        self.tiles = {}
+        self.tile_revisions = {}
+        self.revision = 0
+        if self._updated:
+            self._stamp_window_tiles(self._updated[0])
+        if tiles:
+            self.revision += 1
+            for key, tile in tiles.items():
+                self._add_to_tile(key, tile)
+
+    def _window_tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None:
+            size = self.tile_size
+            tile = self.tiles[key] = self.grid[key[0] * size:(key[0] + 1) * size, key[1] * size:(key[1] + 1) * size]
+        return tile
+
+    def _add(self, updated, hits):
+        updated = super(TiledWorldMap, self)._add(updated, hits)
+        if len(updated):
+            self._stamp_window_tiles(updated)
+        return updated
+
+    def _stamp_window_tiles(self, updated):
+        rows, cols, channels = self.grid.shape
+        cells = updated // channels
+        tiles_across = cols // self.tile_size
+        self.revision += 1
+        for key in np.unique(cells // cols // self.tile_size * tiles_across + cells % cols // self.tile_size):
+            key = divmod(int(key), tiles_across)
+            self._window_tile(key)
+            self.tile_revisions[key] = self.revision
+
+    def accumulate(self, x_world, y_world, labels, label_channels):
+        """
+        Count the observations of all classes in one call, wherever they are
+        :param np.ndarray x_world: x cell of every observed pixel, integer
+        :param np.ndarray y_world: y cell of every observed pixel, integer
+        :param np.ndarray labels: label bits of every observed pixel
+        :param tuple label_channels: (label bit, channel) pairs
+        :return: flat indexes of the window cells that were updated
+        """
+        rows, cols, channels = self.grid.shape
+        if len(x_world) == 0 or _within(x_world, cols) and _within(y_world, rows):
+            return super(TiledWorldMap, self).accumulate(x_world, y_world, labels, label_channels)
+        inside = (x_world >= 0) & (x_world < cols) & (y_world >= 0) & (y_world < rows)
+        outside = ~inside
+        self._accumulate_outside(x_world[outside], y_world[outside], labels[outside], label_channels)
+        return super(TiledWorldMap, self).accumulate(x_world[inside], y_world[inside], labels[inside],
+                                                     label_channels)
+
+    def _accumulate_outside(self, x_world, y_world, labels, label_channels):
+        size, channels = self.tile_size, self.grid.shape[2]
+        tile_x, local_x = np.divmod(x_world, size)
+        tile_y, local_y = np.divmod(y_world, size)
+        cells = (local_y * size + local_x) * channels
+        selected = [(labels & label) != 0 for label, channel in label_channels]
+        indexes = np.concatenate([cells[selection] + channel
+                                  for selection, (label, channel) in zip(selected, label_channels)])
+        keys = np.stack([np.concatenate([tile_y[selection] for selection in selected]),
+                         np.concatenate([tile_x[selection] for selection in selected])])
+        if len(indexes) == 0:
+            return
+        keys, tile_of_index = np.unique(keys, axis=1, return_inverse=True)
+        tile_of_index = tile_of_index.reshape(-1)
+        self.revision += 1
+        for tile_idx, (tile_row, tile_col) in enumerate(keys.T.tolist()):
+            hits = np.bincount(indexes[tile_of_index == tile_idx], minlength=size * size * channels)
+            self._add_to_tile((tile_row, tile_col), hits.reshape(size, size, channels))
+
+    def _add_to_tile(self, key, counts):
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self.tiles[key] = np.zeros((self.tile_size, self.tile_size, self.grid.shape[2]), dtype=np.uint16)
+        tile[:] = np.minimum(tile + counts.astype(np.int64), self.max_count)
+        self.tile_revisions[key] = self.revision
+
+    def outside_tiles(self):
+        """
+        :return: dict of the tiles beyond the window by (tile row, tile column)
+        """
+        tile_rows, tile_cols = self.grid.shape[0] // self.tile_size, self.grid.shape[1] // self.tile_size
+        return {key: tile for key, tile in self.tiles.items()
+                if not (0 <= key[0] < tile_rows and 0 <= key[1] < tile_cols)}
+
+    def merge(self, counts, tiles=None):
+        """
+        Add the counts of another map with the same window and tile size, see WorldMap.merge()
+        :param np.ndarray counts: (rows, cols, channels) window counts
+        :param dict tiles: tiles beyond the window, from outside_tiles(), None if there are none
+        :return: flat indexes of the window cells that were updated
+        """
+        if tiles:
+            self.revision += 1
+            for key, tile in tiles.items():
+                self._add_to_tile(key, tile.astype(np.int64))
+        return super(TiledWorldMap, self).merge(counts)
+
+    def changed_tiles(self, since):
+        """
+        :param int since: a revision, 0 for all tiles
+        :return: (tile row, tile column) keys of the tiles updated after that revision
+        """
+        return [key for key, revision in self.tile_revisions.items() if revision > since]
+
+    def bounds(self):
+        """
+        :return: (x_min, y_min, x_max, y_max) cell extent of the allocated tiles, x_max and y_max excluded,
+            the window if nothing was observed beyond it
+        """
+        rows, cols = self.grid.shape[:2]
+        keys = np.array(list(self.tiles) or [(0, 0)])
+        size = self.tile_size
+        return (min(int(keys[:, 1].min()) * size, 0), min(int(keys[:, 0].min()) * size, 0),
+                max(int(keys[:, 1].max() + 1) * size, cols), max(int(keys[:, 0].max() + 1) * size, rows))
+
+    def region(self, x_min, y_min, x_max, y_max):
+        """
+        Dense counts of a region of the world, zero where no tile was allocated
+        :param int x_min: first x cell
+        :param int y_min: first y cell
+        :param int x_max: x cell after the last
+        :param int y_max: y cell after the last
+        :return: (y_max - y_min, x_max - x_min, channels) uint16 counts
+        """
+        size = self.tile_size
+        counts = np.zeros((y_max - y_min, x_max - x_min, self.grid.shape[2]), dtype=np.uint16)
+        for key, tile in self.tiles.items():
+            y0, x0 = key[0] * size, key[1] * size
+            top, left = max(y0, y_min), max(x0, x_min)
+            bottom, right = min(y0 + size, y_max), min(x0 + size, x_max)
+            if top < bottom and left < right:
+                counts[top - y_min:bottom - y_min, left - x_min:right - x_min] = \
+                    tile[top - y0:bottom - y0, left - x0:right - x0]
+        return counts
+
+    @property
+    def nbytes(self):
+        """Bytes of counts allocated, the window and the tiles beyond it"""
+        return self.grid.nbytes + sum(tile.nbytes for tile in self.outside_tiles().values())
+
+
+class MapStatistics(object):
+    """
+    Mapped percentage and fidelity of the navigable terrain map, compared to the ground truth.
+
+    A cell counts as mapped from the first time it is observed as navigable, so the
+    statistics are updated from the cells that changed instead of the whole map.
+    """
+
+    def __init__(self, ground_truth, channels=3):
+        """
+        :param np.ndarray ground_truth: (rows, cols) ground truth map, > 0 where navigable
+        :param int channels: number of channels of the worldmap
+        """
+        self.channels = channels
+        self.truth = (ground_truth > 0).reshape(-1)
+        self.tot_map_pix = int(np.count_nonzero(self.truth))
+        self.navigable = np.zeros(self.truth.shape, dtype=bool)
+        self.map_shape = ground_truth.shape
+        self.tot_nav_pix = 0
+        self.good_nav_pix = 0
+        self.bad_nav_pix = 0
+
+    def update(self, updated):
+        """
+        Account for updated worldmap cells
+        :param np.ndarray updated: flat worldmap indexes, from WorldMap.pop_updated()
+        """
+        cells = updated[updated % self.channels == NAVIGABLE_CHANNEL] // self.channels
+        new_cells = cells[~self.navigable[cells]]
+        self.navigable[new_cells] = True
+        good = int(np.count_nonzero(self.truth[new_cells]))
+        self.tot_nav_pix += len(new_cells)
+        self.good_nav_pix += good
+        self.bad_nav_pix += len(new_cells) - good
+
+    @property
+    def perc_mapped(self):
+        """Percentage of ground truth map that has been successfully found"""
+        return round(100 * self.good_nav_pix / self.tot_map_pix, 1)
+
+    @property
+    def fidelity(self):
+        """Percentage of navigable terrain found that is navigable in the ground truth"""
+        if self.tot_nav_pix > 0:
+            return round(100 * self.good_nav_pix / self.tot_nav_pix, 1)
+        return 0
+
+    def good_nav_pixels(self):
+        """(rows, cols) mask of navigable cells found that are navigable in the ground truth"""
+        return (self.navigable & self.truth).reshape(self.map_shape)
+
+    def bad_nav_pixels(self):
+        """(rows, cols) mask of navigable cells found that are not navigable in the ground truth"""
+        return (self.navigable & ~self.truth).reshape(self.map_shape)